@@ -2,86 +2,250 @@
 AWS Bedrock APIを使ったサンプルコード
 """
 
-import boto3
+import startup_profile
+
+import asyncio
 import json
 
 import argparse
 
-def bedrock_text_sample(bedrock: boto3.client, model_id: str = 'anthropic.claude-v2'):
+# boto3等の重いモジュールは、使うモードの処理の中でimportする
+from model_adapters import get_adapter, invoke_text
+
+startup_profile.mark("import bedrock")
+
+def bedrock_text_sample(bedrock: 'boto3.client', model_id: str = 'anthropic.claude-v2', catalog: 'ModelCatalog' = None,
+                        temperature: float = None):
     """
     Bedrockにテキストを送信して結果を取得するサンプル
 
     Args:
         bedrock (boto3.client): Bedrockのクライアント
         model_id (str, optional): モデルID. Defaults to 'anthropic.claude-v2'.
+        catalog (ModelCatalog, optional): 指定時はキャッシュ済みのモデル一覧でmodel_idを確認する. Defaults to None.
+        temperature (float, optional): 温度. Defaults to None (モデルの既定値).
     """
+    if catalog is not None:
+        catalog.validate(model_id)
 
     input_prompt = input("Input prompt: ")
 
-    body = json.dumps({
-        'prompt': 'Human: ' + input_prompt + 'Assistant: ',
-        'max_tokens_to_sample': 100
-    })
+    output_text, usage = invoke_text(bedrock, model_id, input_prompt, max_tokens=100, temperature=temperature)
+    print(output_text)
+    print(usage)
 
+def bedrock_chat_sample(bedrock: 'boto3.client', model_id: str = 'anthropic.claude-v2', temperature: float = None):
+    """
+    Bedrockからストリーミングで結果を受け取り、差分を逐次表示するサンプル
 
-    response = bedrock.invoke_model(
-        modelId=model_id,
-        body=body,
-    )
-
-    if model_id == "anthropic.claude-v2":
-        response_body = json.loads(response.get('body').read().decode())
-        output_text = response_body.get('completion')
-        print(output_text)
-
-    elif model_id == "ai21.j2-ultra-v1":
-        response_body = json.loads(response.get('body').read().decode())
-        output_text = response_body.get('completions')[0].get('data').get('text')
-        print(output_text)
-
-def bedrock_chat_sample(bedrock: boto3.client):
-    body = json.dumps({
-        'prompt': '\n\nHuman:write an essay for living on mars in 1000 words\n\nAssistant:',
-        'max_tokens_to_sample': 100
-    })
+    Args:
+        bedrock (boto3.client): Bedrockのクライアント
+        model_id (str, optional): モデルID. Defaults to 'anthropic.claude-v2'.
+        temperature (float, optional): 温度. Defaults to None (モデルの既定値).
+    """
+    adapter = get_adapter(model_id)
+    body = json.dumps(adapter.build_body(
+        'write an essay for living on mars in 1000 words', max_tokens=100, temperature=temperature))
 
     response = bedrock.invoke_model_with_response_stream(
-        modelId='anthropic.claude-v2',
+        modelId=model_id,
         body=body
     )
 
+    usage = None
     stream = response.get('body')
     if stream:
         for event in stream:
             chunk = event.get('chunk')
             if chunk:
-                print(json.loads(chunk.get('bytes').decode()))
+                payload = json.loads(chunk.get('bytes'))
+                print(adapter.parse_stream_chunk(payload), end='', flush=True)
+                if 'amazon-bedrock-invocationMetrics' in payload:
+                    usage = adapter.usage(payload)
+    print()
+    if usage is not None:
+        print(usage)
+
+async def bedrock_async_chat_sample(profile: str, region: str, concurrency: int = 3):
+    """
+    1つのイベントループで複数のストリーミング生成を同時に行うサンプル
+    1本目のストリームの差分を表示し、全ストリームのtime-to-first-tokenとtokens/secを表示する
+
+    Args:
+        profile (str): AWS profile名
+        region (str): AWS region名
+        concurrency (int, optional): 同時に実行するストリーム数. Defaults to 3.
+    """
+    # aiobotocoreはこのモードでのみ必要なため、ここでimportする
+    from bedrock_async import AsyncBedrock
+
+    async def consume(stream, echo: bool):
+        async for delta in stream:
+            if echo:
+                print(delta, end='', flush=True)
+        return stream.stats
+
+    async with AsyncBedrock(profile=profile, region=region) as bedrock:
+        streams = [
+            bedrock.stream('write an essay for living on mars in 1000 words', max_tokens=100)
+            for _ in range(concurrency)
+        ]
+        results = await asyncio.gather(*(consume(stream, echo=i == 0) for i, stream in enumerate(streams)))
+
+    print()
+    for stats in results:
+        print(stats)
+
+def bedrock_batch_sample(bedrock: 'boto3.client', input_path: str, output_path: str, model_id: str = 'anthropic.claude-v2',
+                         max_concurrency: int = 16, rate: float = 5.0, rate_limits: dict = None, temperature: float = None):
+    """
+    JSONLのプロンプトを並列に実行して結果をJSONLに書き出すサンプル
+
+    Args:
+        bedrock (boto3.client): Bedrockのクライアント
+        input_path (str): 入力ファイルのパス ("-" の場合は標準入力)
+        output_path (str): 出力ファイルのパス
+        model_id (str, optional): モデルID. Defaults to 'anthropic.claude-v2'.
+        max_concurrency (int, optional): 同時リクエスト数. Defaults to 16.
+        rate (float, optional): モデルごとのリクエスト数/秒の上限. Defaults to 5.0.
+        rate_limits (dict, optional): モデルIDごとのリクエスト数/秒の上限. Defaults to None.
+        temperature (float, optional): 温度. Defaults to None (モデルの既定値).
+    """
+    from bedrock_batch import BatchRunner
+
+    runner = BatchRunner(
+        bedrock_runtime=bedrock,
+        model_id=model_id,
+        max_concurrency=max_concurrency,
+        rate_limits=rate_limits,
+        default_rate=rate,
+        temperature=temperature,
+    )
+    print(runner.run(input_path=input_path, output_path=output_path))
+
+def build_runtime_client(args):
+    """
+    text, chat, batchモードで使うbedrock-runtimeのクライアントを作成する
+    オプションに応じて同時リクエストの集約・応答のキャッシュを重ねる
+
+    Args:
+        args (argparse.Namespace): 起動パラメータ
+
+    Returns:
+        tuple: (クライアント, SingleFlightClient or None, ResponseCache or None)
+    """
+    from client_factory import DEFAULT_MAX_ATTEMPTS, NO_RETRY, get_client
+
+    # batchモードのスロットリングはBatchRunnerが再試行するため、botocoreではリトライしない
+    max_attempts = NO_RETRY if args.prayground_mode == 'batch' else DEFAULT_MAX_ATTEMPTS
+    # 並列実行時にコネクションが不足しないようプールを広げる
+    bedrock = get_client('bedrock-runtime', profile=args.profile, region=args.region,
+                         max_pool_connections=max(10, args.max_concurrency), max_attempts=max_attempts)
+    startup_profile.mark("create client")
+
+    # 同じリクエスト (温度0のみ) が同時に実行された場合は1回の呼び出しにまとめる
+    single_flight = None
+    if args.coalesce:
+        from single_flight import SingleFlightClient
+        single_flight = SingleFlightClient(bedrock)
+        bedrock = single_flight
+
+    response_cache = None
+    if args.response_cache:
+        from response_cache import CachedClient, ResponseCache
+        response_cache = ResponseCache(
+            path=args.response_cache,
+            max_bytes=args.response_cache_max_mb * 1024 * 1024,
+            ttl_sec=args.response_cache_ttl,
+        )
+        bedrock = CachedClient(bedrock, response_cache)
+
+    return bedrock, single_flight, response_cache
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Bedrock API sample')
     parser.add_argument('--profile', default='atl', help='AWS profile name')
     parser.add_argument('--region', default='us-west-2', help='AWS region name')
-    parser.add_argument('--prayground-mode', dest='prayground_mode', default = 'text', help='text or chat')
+    parser.add_argument('--prayground-mode', dest='prayground_mode', default = 'text', help='text, chat, async-chat or batch')
+    parser.add_argument('--model-id', dest='model_id', default='anthropic.claude-v2', help='modelId for text, chat and batch mode')
+    parser.add_argument('--list-models', dest='list_models', action='store_true', help='List available modelIds before running')
+    parser.add_argument('--refresh-models', dest='refresh_models', action='store_true', help='Refresh the cached model catalog')
+    parser.add_argument('--profile-startup', dest='profile_startup', action='store_true', help='Show elapsed time of each startup stage')
+    parser.add_argument('--input', dest='input_path', default='-', help='Prompt JSONL for batch mode ("-" for stdin)')
+    parser.add_argument('--output', dest='output_path', default='./batch_output.jsonl', help='Result JSONL for batch mode')
+    parser.add_argument('--max-concurrency', dest='max_concurrency', default=16, type=int, help='Concurrent requests in batch mode')
+    parser.add_argument('--rate', dest='rate', default=5.0, type=float, help='Requests per second per model in batch mode')
+    parser.add_argument('--rate-limit', dest='rate_limits', action='append', default=[], help='Per model limit as MODEL_ID=RPS')
+    parser.add_argument('--temperature', dest='temperature', default=None, type=float, help='Sampling temperature (0 makes requests cacheable)')
+    parser.add_argument('--response-cache', dest='response_cache', default=None, help='Cache deterministic responses in this SQLite file')
+    parser.add_argument('--response-cache-ttl', dest='response_cache_ttl', default=24 * 60 * 60, type=float, help='Response cache TTL in seconds')
+    parser.add_argument('--response-cache-max-mb', dest='response_cache_max_mb', default=256, type=int, help='Response cache size limit in MB')
+    parser.add_argument('--no-coalesce', dest='coalesce', action='store_false', help='Do not merge identical in-flight deterministic (temperature 0) requests')
+    parser.add_argument('--metrics-output', dest='metrics_output', default=None, help='Write call metrics to this file (.prom for Prometheus text, otherwise JSON)')
     args = parser.parse_args()
 
     profile = args.profile
-    session = boto3.Session(profile_name=profile, region_name=args.region)
-    bedrock = session.client('bedrock')
 
-    print("List of modelId")
-    for model in bedrock.list_foundation_models().get('modelSummaries'):
-        print(model.get('modelId'))
-    print("-------------------------")
-
-    bedrock = session.client('bedrock-runtime')
+    # モデル一覧はtextモードの確認と一覧表示でのみ使う
+    catalog = None
+    if args.refresh_models or args.list_models or args.prayground_mode == 'text':
+        from model_catalog import ModelCatalog
+        catalog = ModelCatalog(profile=profile, region=args.region)
+    if args.refresh_models:
+        catalog.summaries(refresh=True)
+
+    if args.list_models:
+        print("List of modelId")
+        for model_id in catalog.model_ids():
+            print(model_id)
+        print("-------------------------")
+        startup_profile.mark("list models")
+
+    # async-chatモードはaiobotocoreのクライアントを使うため作成しない
+    bedrock, single_flight, response_cache = None, None, None
+    if args.prayground_mode in ('text', 'chat', 'batch'):
+        bedrock, single_flight, response_cache = build_runtime_client(args)
+
+    if args.profile_startup:
+        startup_profile.report()
 
     if args.prayground_mode == 'chat':
         print("Chat sample")
-        bedrock_chat_sample(bedrock=bedrock)
+        bedrock_chat_sample(bedrock=bedrock, model_id=args.model_id, temperature=args.temperature)
 
     elif args.prayground_mode == 'text':
         print("Text sample")
-        bedrock_text_sample(bedrock=bedrock)
+        bedrock_text_sample(bedrock=bedrock, model_id=args.model_id, catalog=catalog, temperature=args.temperature)
+
+    elif args.prayground_mode == 'async-chat':
+        print("Async chat sample")
+        asyncio.run(bedrock_async_chat_sample(profile=profile, region=args.region, concurrency=args.max_concurrency))
+
+    elif args.prayground_mode == 'batch':
+        print("Batch sample")
+        bedrock_batch_sample(
+            bedrock=bedrock,
+            input_path=args.input_path,
+            output_path=args.output_path,
+            model_id=args.model_id,
+            max_concurrency=args.max_concurrency,
+            rate=args.rate,
+            temperature=args.temperature,
+            rate_limits={
+                model_id: float(rps) for model_id, rps in (limit.rsplit('=', 1) for limit in args.rate_limits)
+            },
+        )
 
     else:
-        print("Invalid mode")
\ No newline at end of file
+        print("Invalid mode")
+
+    if single_flight is not None:
+        print(single_flight.stats())
+
+    if response_cache is not None:
+        print(response_cache.stats())
+        response_cache.close()
+
+    if args.metrics_output:
+        from instrumentation import METRICS
+        METRICS.write(args.metrics_output)
@@ -0,0 +1,137 @@
+"""
+asyncioによるBedrockクライアント
+1つのイベントループ上で多数の生成・ストリーミングを同時に扱う
+
+boto3は同期I/Oのため、非同期版のaiobotocoreを使う
+"""
+import json
+import time
+
+from aiobotocore.config import AioConfig
+from aiobotocore.session import AioSession
+
+from model_adapters import get_adapter
+
+
+def _build_body(model_id: str, prompt: str, max_tokens: int) -> str:
+    """モデルに対応したリクエストボディ"""
+    return json.dumps(get_adapter(model_id).build_body(prompt, max_tokens=max_tokens))
+
+
+class TextStream:
+    """生成テキストの差分を届いた順に返す非同期イテレータ
+    イテレーション後、statsに time-to-first-token と tokens/sec が入る
+    """
+
+    def __init__(self, client, model_id: str, body: str):
+        """
+        Args:
+            client: aiobotocoreのbedrock-runtimeクライアント
+            model_id (str): モデルID
+            body (str): リクエストボディ
+        """
+        self.__client = client
+        self.__adapter = get_adapter(model_id)
+        self.model_id = model_id
+        self.body = body
+        self.text = ""
+        self.stats = {}
+
+    async def __aiter__(self):
+        started_at = time.perf_counter()
+        first_token_at = None
+        deltas = 0
+        output_tokens = None
+
+        response = await self.__client.invoke_model_with_response_stream(modelId=self.model_id, body=self.body)
+        async for event in response['body']:
+            chunk = event.get('chunk')
+            if not chunk:
+                continue
+
+            payload = json.loads(chunk.get('bytes'))
+            if 'amazon-bedrock-invocationMetrics' in payload:
+                output_tokens = self.__adapter.usage(payload).get('output_tokens')
+
+            delta = self.__adapter.parse_stream_chunk(payload)
+            if delta:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                deltas += 1
+                self.text += delta
+                yield delta
+
+        finished_at = time.perf_counter()
+        # 使用量が返らない場合は受信した差分の数で代用する
+        tokens = output_tokens if output_tokens is not None else deltas
+        generation_sec = finished_at - first_token_at if first_token_at is not None else None
+        self.stats = {
+            "model_id": self.model_id,
+            "time_to_first_token_sec": round(first_token_at - started_at, 4) if first_token_at is not None else None,
+            "elapsed_sec": round(finished_at - started_at, 4),
+            "output_tokens": tokens,
+            "tokens_per_sec": round(tokens / generation_sec, 2) if generation_sec else None,
+        }
+
+
+class AsyncBedrock:
+    """非同期のbedrock-runtimeクライアント
+
+    async with AsyncBedrock(profile, region) as bedrock:
+        text = await bedrock.invoke(prompt)
+        stream = bedrock.stream(prompt)
+        async for delta in stream:
+            ...
+        stream.stats
+    """
+
+    def __init__(self, profile: str, region: str, max_pool_connections: int = 100):
+        """
+        Args:
+            profile (str): AWS profile名
+            region (str): AWS region名
+            max_pool_connections (int, optional): 同時接続数の上限. Defaults to 100.
+        """
+        self.__session = AioSession(profile=profile)
+        self.__region = region
+        self.__config = AioConfig(max_pool_connections=max_pool_connections)
+        self.__context = None
+        self.__client = None
+
+    async def __aenter__(self):
+        self.__context = self.__session.create_client(
+            'bedrock-runtime', region_name=self.__region, config=self.__config)
+        self.__client = await self.__context.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.__context.__aexit__(exc_type, exc, traceback)
+        self.__client = None
+
+    async def invoke(self, prompt: str, model_id: str = 'anthropic.claude-v2', max_tokens: int = 300) -> str:
+        """生成結果をまとめて取得する
+
+        Args:
+            prompt (str): プロンプト
+            model_id (str, optional): モデルID. Defaults to 'anthropic.claude-v2'.
+            max_tokens (int, optional): 生成する最大トークン数. Defaults to 300.
+
+        Returns:
+            str: 生成されたテキスト
+        """
+        response = await self.__client.invoke_model(modelId=model_id, body=_build_body(model_id, prompt, max_tokens))
+        async with response['body'] as body:
+            return get_adapter(model_id).parse_response(json.loads(await body.read()))
+
+    def stream(self, prompt: str, model_id: str = 'anthropic.claude-v2', max_tokens: int = 300) -> TextStream:
+        """生成結果を差分ごとに受け取るストリームを作成する
+
+        Args:
+            prompt (str): プロンプト
+            model_id (str, optional): モデルID. Defaults to 'anthropic.claude-v2'.
+            max_tokens (int, optional): 生成する最大トークン数. Defaults to 300.
+
+        Returns:
+            TextStream: async forで差分を返すストリーム
+        """
+        return TextStream(self.__client, model_id, _build_body(model_id, prompt, max_tokens))
@@ -0,0 +1,280 @@
+"""
+プロンプトの一括実行
+JSONLのプロンプトを並列にBedrockへ送信し、結果をJSONLに書き出す
+
+入力形式 (1行1プロンプト)
+    {"id": "任意のID", "prompt": "プロンプト", "model_id": "省略時はデフォルトのモデル"}
+出力形式 (1行1結果)
+    {"id": "...", "model_id": "...", "completion": "...", "latency_sec": 0.0}
+    失敗時は completion の代わりに error を出力する
+
+出力済みのidは再実行時にスキップするため、中断後も同じ出力先を指定して再開できる
+"""
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from bedrock_errors import is_throttling_error
+from model_adapters import get_adapter, read_payload
+
+
+class TokenBucket:
+    """トークンバケットによる流量制限"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        """
+        Args:
+            rate (float): 1秒あたりに補充するトークン数 (リクエスト数/秒)
+            capacity (float, optional): バケットの容量 (バースト数). Defaults to rate.
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """トークンを1つ取得する (不足している場合は補充まで待機)"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+
+            time.sleep(wait)
+
+
+def read_prompts(path: str):
+    """JSONLファイル (または標準入力) からプロンプトを読み込む
+
+    Args:
+        path (str): 入力ファイルのパス ("-" の場合は標準入力)
+
+    Yields:
+        dict: プロンプト (idがない場合は行番号をidにする)
+    """
+    stream = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        for line_number, line in enumerate(stream):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            record.setdefault("id", str(line_number))
+            yield record
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def completed_ids(path: str) -> set:
+    """出力済み (成功した) プロンプトのidを取得する
+
+    Args:
+        path (str): 出力ファイルのパス
+
+    Returns:
+        set: id一覧
+    """
+    ids = set()
+    if not os.path.exists(path):
+        return ids
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 中断時に書きかけだった行
+                continue
+            if "error" not in record:
+                ids.add(str(record.get("id")))
+    return ids
+
+
+def truncate_partial_line(path: str):
+    """中断時に書きかけだった末尾の行を削除する
+    追記した最初の行が書きかけの行と連結されて壊れないよう、最後の改行の直後で切り詰める
+    末尾の行が改行のみ欠けた完全な結果の場合は、削除せずに改行を追加する
+
+    Args:
+        path (str): 出力ファイルのパス
+    """
+    if not os.path.exists(path):
+        return
+
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            step = min(64 * 1024, position)
+            f.seek(position - step)
+            newline = f.read(step).rfind(b"\n")
+            if newline != -1:
+                position = position - step + newline + 1
+                break
+            position -= step
+
+        if position == end:
+            return
+
+        f.seek(position)
+        try:
+            json.loads(f.read())
+        except ValueError:
+            f.truncate(position)
+        else:
+            f.write(b"\n")
+
+
+class BatchRunner:
+    """プロンプトを並列に実行し、結果を逐次JSONLへ書き出す"""
+
+    def __init__(
+        self,
+        bedrock_runtime,
+        model_id: str = 'anthropic.claude-v2',
+        max_concurrency: int = 16,
+        rate_limits: dict = None,
+        default_rate: float = 5.0,
+        max_retries: int = 8,
+        base_delay: float = 1.0,
+        max_delay: float = 30.0,
+        max_tokens: int = 300,
+        temperature: float = None,
+    ):
+        """
+        Args:
+            bedrock_runtime (boto3.client): bedrock-runtimeのクライアント (スレッド間で共有する)
+            model_id (str, optional): model_idを指定しないプロンプトに使うモデル. Defaults to 'anthropic.claude-v2'.
+            max_concurrency (int, optional): 同時リクエスト数の上限. Defaults to 16.
+            rate_limits (dict, optional): モデルIDごとのリクエスト数/秒の上限. Defaults to None.
+            default_rate (float, optional): rate_limitsにないモデルのリクエスト数/秒の上限. Defaults to 5.0.
+            max_retries (int, optional): スロットリング時の最大リトライ回数. Defaults to 8.
+            base_delay (float, optional): バックオフの初期待機秒数. Defaults to 1.0.
+            max_delay (float, optional): バックオフの最大待機秒数. Defaults to 30.0.
+            max_tokens (int, optional): 生成する最大トークン数. Defaults to 300.
+            temperature (float, optional): 温度. Defaults to None (モデルの既定値).
+        """
+        self.bedrock_runtime = bedrock_runtime
+        self.model_id = model_id
+        self.max_concurrency = max_concurrency
+        self.rate_limits = rate_limits or {}
+        self.default_rate = default_rate
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+        self.succeeded = 0
+        self.failed = 0
+        self.skipped = 0
+        self.throttled = 0
+
+    def __bucket(self, model_id: str) -> TokenBucket:
+        """モデルごとのトークンバケット"""
+        with self._lock:
+            if model_id not in self._buckets:
+                self._buckets[model_id] = TokenBucket(self.rate_limits.get(model_id, self.default_rate))
+            return self._buckets[model_id]
+
+    def __invoke(self, model_id: str, prompt: str) -> str:
+        """1プロンプトを実行する
+        スロットリング時はexponential backoff + full jitterで再試行する
+
+        Args:
+            model_id (str): モデルID
+            prompt (str): プロンプト
+
+        Returns:
+            str: 生成されたテキスト
+        """
+        adapter = get_adapter(model_id)
+        body = json.dumps(adapter.build_body(prompt, max_tokens=self.max_tokens, temperature=self.temperature))
+
+        for attempt in range(self.max_retries + 1):
+            self.__bucket(model_id).acquire()
+            try:
+                response = self.bedrock_runtime.invoke_model(modelId=model_id, body=body)
+                return adapter.parse_response(read_payload(response.get('body')))
+
+            except ClientError as error:
+                if not is_throttling_error(error) or attempt == self.max_retries:
+                    raise
+                with self._lock:
+                    self.throttled += 1
+                time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt))))
+
+    def __run_one(self, record: dict, output):
+        """1プロンプトを実行し、結果を出力する"""
+        model_id = record.get("model_id", self.model_id)
+        result = {"id": record["id"], "model_id": model_id}
+
+        started_at = time.perf_counter()
+        try:
+            result["completion"] = self.__invoke(model_id, record["prompt"])
+        except Exception as error:
+            result["error"] = repr(error)
+        result["latency_sec"] = round(time.perf_counter() - started_at, 3)
+
+        line = json.dumps(result, ensure_ascii=False) + "\n"
+        with self._write_lock:
+            output.write(line)
+            output.flush()
+            if "error" in result:
+                self.failed += 1
+            else:
+                self.succeeded += 1
+
+    def run(self, input_path: str, output_path: str) -> dict:
+        """入力のプロンプトをすべて実行する
+
+        Args:
+            input_path (str): 入力ファイルのパス ("-" の場合は標準入力)
+            output_path (str): 出力ファイルのパス (追記する)
+
+        Returns:
+            dict: 実行結果の集計
+        """
+        done = completed_ids(output_path)
+        truncate_partial_line(output_path)
+        # 投入済みで未完了のプロンプト数を制限し、入力を少しずつ読み込む
+        slots = threading.BoundedSemaphore(self.max_concurrency * 2)
+        started_at = time.perf_counter()
+
+        with open(output_path, "a", encoding="utf-8") as output, \
+                ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            for record in read_prompts(input_path):
+                if str(record["id"]) in done:
+                    self.skipped += 1
+                    continue
+
+                slots.acquire()
+                future = executor.submit(self.__run_one, record, output)
+                future.add_done_callback(lambda _: slots.release())
+
+        elapsed = time.perf_counter() - started_at
+        return {
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "throttled": self.throttled,
+            "elapsed_sec": round(elapsed, 3),
+            "prompts_per_sec": round((self.succeeded + self.failed) / elapsed, 2) if elapsed else None,
+        }
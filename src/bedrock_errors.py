@@ -0,0 +1,25 @@
+"""
+Bedrock呼び出しのエラー判定
+"""
+from botocore.exceptions import ClientError
+
+# スロットリングとして扱うエラーコード
+THROTTLING_ERROR_CODES = (
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+)
+
+
+def is_throttling_error(error: Exception) -> bool:
+    """Bedrockのスロットリングによるエラーか判定する
+
+    Args:
+        error (Exception): 発生した例外
+
+    Returns:
+        bool: スロットリングの場合True
+    """
+    if not isinstance(error, ClientError):
+        return False
+    return error.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
@@ -0,0 +1,97 @@
+"""
+boto3のセッション・クライアントをプロセス内で共有する
+(profile, region, service)ごとに1度だけ作成し、以降は同じクライアントを返す
+
+bedrock = get_client('bedrock-runtime', profile='atl', region='us-west-2', max_pool_connections=32)
+
+リトライはどちらか一方の層で行う
+スロットリング時に自前で再試行する呼び出し元 (BatchEmbedder, BatchRunner) には
+max_attempts=NO_RETRY のクライアントを渡し、botocoreのリトライと掛け合わせにならないようにする
+"""
+import threading
+
+import boto3
+from botocore.config import Config
+
+from instrumentation import instrument
+
+DEFAULT_MAX_POOL_CONNECTIONS = 50
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_MODE = 'adaptive'
+# botocoreではリトライしない (最初の1回のみ)
+NO_RETRY = 1
+
+_lock = threading.Lock()
+_sessions = {}
+_clients = {}
+
+
+def get_session(profile: str = None, region: str = None) -> boto3.Session:
+    """(profile, region)ごとのセッションを取得する
+
+    Args:
+        profile (str, optional): AWS profile名. Defaults to None (既定の認証情報).
+        region (str, optional): AWS region名. Defaults to None (既定のregion).
+
+    Returns:
+        boto3.Session: セッション
+    """
+    with _lock:
+        return _get_session(profile, region)
+
+
+def _get_session(profile: str, region: str) -> boto3.Session:
+    """NOTE: lock取得済みの状態で呼び出す"""
+    key = (profile, region)
+    if key not in _sessions:
+        _sessions[key] = boto3.Session(profile_name=profile, region_name=region)
+    return _sessions[key]
+
+
+def get_client(
+    service: str,
+    profile: str = None,
+    region: str = None,
+    max_pool_connections: int = DEFAULT_MAX_POOL_CONNECTIONS,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    retry_mode: str = DEFAULT_RETRY_MODE,
+):
+    """(profile, region, service, リトライ設定)ごとのクライアントを取得する
+    コネクションプールは再利用し、TCP keep-aliveとbotocoreのリトライ (既定はadaptiveモード) を有効にする
+    作成済みのクライアントより大きいプールを要求された場合のみ作り直す
+
+    boto3のクライアントはスレッドセーフだが、セッションからの作成はスレッドセーフでないため
+    作成はロックの中で行う
+
+    Args:
+        service (str): サービス名 (bedrock, bedrock-runtime等)
+        profile (str, optional): AWS profile名. Defaults to None (既定の認証情報).
+        region (str, optional): AWS region名. Defaults to None (既定のregion).
+        max_pool_connections (int, optional): コネクションプールの上限. Defaults to 50.
+        max_attempts (int, optional): botocoreのリトライを含む最大試行回数 (自前で再試行する場合はNO_RETRY). Defaults to 5.
+        retry_mode (str, optional): botocoreのリトライモード (legacy, standard, adaptive). Defaults to 'adaptive'.
+
+    Returns:
+        InstrumentedClient: 計測用のラッパーで包んだクライアント
+    """
+    key = (profile, region, service, retry_mode, max_attempts)
+    with _lock:
+        cached = _clients.get(key)
+        if cached is not None and cached[0] >= max_pool_connections:
+            return cached[1]
+
+        config = Config(
+            max_pool_connections=max_pool_connections,
+            tcp_keepalive=True,
+            retries={'mode': retry_mode, 'max_attempts': max_attempts},
+        )
+        client = instrument(_get_session(profile, region).client(service, config=config))
+        _clients[key] = (max_pool_connections, client)
+        return client
+
+
+def clear():
+    """作成済みのセッション・クライアントを破棄する"""
+    with _lock:
+        _sessions.clear()
+        _clients.clear()
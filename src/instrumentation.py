@@ -0,0 +1,394 @@
+"""
+Bedrock呼び出しの計測
+クライアントをInstrumentedClientで包むと、操作・モデルごとに以下を記録する
+    レイテンシとtime-to-first-byteのヒストグラム, 呼び出し数, エラー数, スロットリング数, リトライ数, 入出力トークン数
+
+bedrock = InstrumentedClient(session.client('bedrock-runtime'))
+METRICS.snapshot()       # JSON向けのdict
+METRICS.to_prometheus()  # Prometheusのテキスト形式
+"""
+import json
+import threading
+import time
+
+from bedrock_errors import is_throttling_error
+from model_adapters import INPUT_TOKEN_HEADER, OUTPUT_TOKEN_HEADER
+
+# レイテンシのヒストグラムの境界(秒)
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class Histogram:
+    """Prometheus形式の累積ヒストグラム"""
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        """
+        Args:
+            buckets (tuple, optional): バケットの上限値. Defaults to DEFAULT_BUCKETS.
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        """値を1件記録する"""
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float):
+        """分位点を推定する (該当するバケットの上限値を返す)
+
+        Args:
+            q (float): 分位 (0.0 - 1.0)
+
+        Returns:
+            float: 推定値 (記録がない場合はNone)
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return round(min(bound, self.max), 6)
+        return round(self.max, 6)
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "max": round(self.max, 6),
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+class _Series:
+    """操作・モデルごとの計測値"""
+
+    def __init__(self, buckets: tuple):
+        self.requests = 0
+        self.errors = 0
+        self.throttles = 0
+        self.retries = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.latency = Histogram(buckets)
+        self.ttfb = Histogram(buckets)
+
+
+class Metrics:
+    """計測値の集計 (スレッド間で共有できる)"""
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        """
+        Args:
+            buckets (tuple, optional): ヒストグラムのバケットの上限値. Defaults to DEFAULT_BUCKETS.
+        """
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def record(
+        self,
+        operation: str,
+        model_id: str,
+        latency: float,
+        ttfb: float = None,
+        error: Exception = None,
+        retries: int = 0,
+        input_tokens: int = None,
+        output_tokens: int = None,
+    ):
+        """1回の呼び出しを記録する
+
+        Args:
+            operation (str): 操作名 (例: invoke_model)
+            model_id (str): モデルID (モデルを指定しない操作は空文字)
+            latency (float): 呼び出しにかかった秒数
+            ttfb (float, optional): 最初のバイトを受信するまでの秒数. Defaults to None.
+            error (Exception, optional): 失敗した場合の例外. Defaults to None.
+            retries (int, optional): botocoreが内部で行ったリトライ数. Defaults to 0.
+            input_tokens (int, optional): 入力トークン数. Defaults to None.
+            output_tokens (int, optional): 出力トークン数. Defaults to None.
+        """
+        with self._lock:
+            series = self._series.get((operation, model_id))
+            if series is None:
+                series = self._series[(operation, model_id)] = _Series(self.buckets)
+
+            series.requests += 1
+            series.retries += retries
+            series.latency.observe(latency)
+            if ttfb is not None:
+                series.ttfb.observe(ttfb)
+            if error is not None:
+                series.errors += 1
+                if is_throttling_error(error):
+                    series.throttles += 1
+            if input_tokens:
+                series.input_tokens += input_tokens
+            if output_tokens:
+                series.output_tokens += output_tokens
+
+    def snapshot(self) -> list:
+        """現在の計測値
+
+        Returns:
+            list: 操作・モデルごとの計測値
+        """
+        with self._lock:
+            return [
+                {
+                    "operation": operation,
+                    "model_id": model_id,
+                    "requests": series.requests,
+                    "errors": series.errors,
+                    "throttles": series.throttles,
+                    "retries": series.retries,
+                    "input_tokens": series.input_tokens,
+                    "output_tokens": series.output_tokens,
+                    "latency_sec": series.latency.snapshot(),
+                    "ttfb_sec": series.ttfb.snapshot(),
+                }
+                for (operation, model_id), series in sorted(self._series.items())
+            ]
+
+    def to_json(self) -> str:
+        """計測値をJSON文字列で出力する"""
+        return json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+
+    def to_prometheus(self) -> str:
+        """計測値をPrometheusのテキスト形式で出力する"""
+        counters = (
+            ("bedrock_requests_total", "requests", "Bedrock API calls"),
+            ("bedrock_errors_total", "errors", "Failed Bedrock API calls"),
+            ("bedrock_throttles_total", "throttles", "Throttled Bedrock API calls"),
+            ("bedrock_retries_total", "retries", "Retries made by botocore"),
+            ("bedrock_input_tokens_total", "input_tokens", "Input tokens"),
+            ("bedrock_output_tokens_total", "output_tokens", "Output tokens"),
+        )
+        histograms = (
+            ("bedrock_latency_seconds", "latency", "Bedrock API call latency"),
+            ("bedrock_time_to_first_byte_seconds", "ttfb", "Time to the first byte of the response"),
+        )
+
+        lines = []
+        with self._lock:
+            items = sorted(self._series.items())
+
+            for name, attribute, description in counters:
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} counter")
+                for key, series in items:
+                    lines.append(f"{name}{{{_labels(*key)}}} {getattr(series, attribute)}")
+
+            for name, attribute, description in histograms:
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, series in items:
+                    histogram = getattr(series, attribute)
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{{{_labels(*key, le=bound)}}} {cumulative}")
+                    lines.append(f"{name}_bucket{{{_labels(*key, le='+Inf')}}} {histogram.count}")
+                    lines.append(f"{name}_sum{{{_labels(*key)}}} {histogram.sum}")
+                    lines.append(f"{name}_count{{{_labels(*key)}}} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """計測値をファイルに出力する
+        拡張子が .prom または .txt の場合はPrometheusのテキスト形式, それ以外はJSON
+
+        Args:
+            path (str): 出力先のパス
+        """
+        text = self.to_prometheus() if path.endswith((".prom", ".txt")) else self.to_json()
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def reset(self):
+        """計測値を破棄する"""
+        with self._lock:
+            self._series = {}
+
+
+def _labels(operation: str, model_id: str, le=None) -> str:
+    """Prometheusのラベル文字列"""
+    labels = f'operation="{operation}",model_id="{model_id}"'
+    if le is not None:
+        labels += f',le="{le}"'
+    return labels
+
+
+# プロセス全体で共有する計測値
+METRICS = Metrics()
+
+
+def _retry_attempts(response: dict) -> int:
+    return response.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+
+
+def _header_tokens(response: dict) -> tuple:
+    """レスポンスヘッダの入出力トークン数"""
+    headers = response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+    input_tokens = headers.get(INPUT_TOKEN_HEADER)
+    output_tokens = headers.get(OUTPUT_TOKEN_HEADER)
+    return (
+        int(input_tokens) if input_tokens is not None else None,
+        int(output_tokens) if output_tokens is not None else None,
+    )
+
+
+class InstrumentedClient:
+    """boto3クライアントの呼び出しを計測するラッパー
+    invoke_model_with_response_stream はストリームを最後まで受信した時点で記録する
+    """
+
+    def __init__(self, client, metrics: Metrics = None):
+        """
+        Args:
+            client (boto3.client): 計測するクライアント
+            metrics (Metrics, optional): 記録先. Defaults to METRICS.
+        """
+        self.client = client
+        self.metrics = metrics if metrics is not None else METRICS
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if not callable(attribute) or not self.__is_operation(name):
+            return attribute
+
+        def call(*args, **kwargs):
+            return self.__call(name, attribute, kwargs.get('modelId', ''), args, kwargs)
+        return call
+
+    def __is_operation(self, name: str) -> bool:
+        """APIの操作か判定する (get_paginator等のヘルパーは計測しない)"""
+        meta = getattr(self.client, 'meta', None)
+        if meta is not None and hasattr(meta, 'method_to_api_mapping'):
+            return name in meta.method_to_api_mapping
+        return not name.startswith('_')
+
+    def __call(self, operation: str, method, model_id: str, args, kwargs):
+        """操作を実行し、レイテンシ・リトライ数・ヘッダのトークン数を記録する"""
+        started_at = time.perf_counter()
+        try:
+            response = method(*args, **kwargs)
+        except Exception as error:
+            retries = _retry_attempts(getattr(error, 'response', None) or {})
+            self.metrics.record(operation, model_id, time.perf_counter() - started_at, error=error, retries=retries)
+            raise
+
+        elapsed = time.perf_counter() - started_at
+        if isinstance(response, dict):
+            input_tokens, output_tokens = _header_tokens(response)
+            self.metrics.record(
+                operation, model_id, elapsed,
+                ttfb=elapsed if operation == 'invoke_model' else None,
+                retries=_retry_attempts(response),
+                input_tokens=input_tokens,
+                output_tokens=output_tokens,
+            )
+        else:
+            self.metrics.record(operation, model_id, elapsed)
+        return response
+
+    def invoke_model_with_response_stream(self, **kwargs) -> dict:
+        model_id = kwargs.get('modelId', '')
+        started_at = time.perf_counter()
+        try:
+            response = self.client.invoke_model_with_response_stream(**kwargs)
+        except Exception as error:
+            retries = _retry_attempts(getattr(error, 'response', None) or {})
+            self.metrics.record(
+                'invoke_model_with_response_stream', model_id, time.perf_counter() - started_at,
+                error=error, retries=retries)
+            raise
+
+        stream = response['body']
+        response['body'] = MeasuredEventStream(
+            stream, self.__measure_stream(model_id, started_at, stream, _retry_attempts(response)))
+        return response
+
+    def __measure_stream(self, model_id: str, started_at: float, stream, retries: int):
+        """ストリームをそのまま返しつつ、最初のチャンクまでの時間と使用量を記録する"""
+        ttfb = None
+        input_tokens = output_tokens = None
+        error = None
+        try:
+            for event in stream:
+                chunk = event.get('chunk')
+                if chunk:
+                    if ttfb is None:
+                        ttfb = time.perf_counter() - started_at
+                    data = chunk.get('bytes')
+                    # 使用量は最後のチャンクにのみ含まれるため、該当する場合のみ解析する
+                    if b'amazon-bedrock-invocationMetrics' in data:
+                        metrics = json.loads(data).get('amazon-bedrock-invocationMetrics', {})
+                        input_tokens = metrics.get('inputTokenCount')
+                        output_tokens = metrics.get('outputTokenCount')
+                yield event
+        except Exception as exception:
+            error = exception
+            raise
+        finally:
+            self.metrics.record(
+                'invoke_model_with_response_stream', model_id, time.perf_counter() - started_at,
+                ttfb=ttfb, error=error, retries=retries,
+                input_tokens=input_tokens, output_tokens=output_tokens,
+            )
+
+
+class MeasuredEventStream:
+    """計測しながらイベントを返すストリーム
+    close()等のイテレーション以外の操作は元のEventStreamに委譲する
+    """
+
+    def __init__(self, stream, events):
+        """
+        Args:
+            stream (EventStream): 元のストリーム
+            events (generator): 計測しながら元のストリームのイベントを返すgenerator
+        """
+        self._stream = stream
+        self._events = events
+
+    def __iter__(self):
+        return self._events
+
+    def close(self):
+        """読み込みを中断し、元のストリームを閉じる"""
+        self._events.close()
+        self._stream.close()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def instrument(client, metrics: Metrics = None):
+    """クライアントを計測用のラッパーで包む (既に包まれている場合はそのまま返す)
+
+    Args:
+        client (boto3.client): クライアント
+        metrics (Metrics, optional): 記録先. Defaults to METRICS.
+
+    Returns:
+        InstrumentedClient: 計測用のラッパー
+    """
+    if isinstance(client, InstrumentedClient):
+        return client
+    return InstrumentedClient(client, metrics)
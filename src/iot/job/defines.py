@@ -6,3 +6,7 @@ class JobActionName(Enum):
     JOB1 = "job1"
     JOB2 = "job2"
     JOB3 = "job3"
+
+
+# MQTTのsubscribe・publish・接続の完了を待つ最大秒数
+MQTT_TIMEOUT_SEC = 10
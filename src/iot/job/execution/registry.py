@@ -0,0 +1,140 @@
+"""
+jobのアクションと実行関数の対応表
+
+セットアップ時・downstreamのどちらもここからアクション名で実行関数を引く
+jobの種類を追加する場合は ACTION_REGISTRY.register に ActionSpec を追加する
+"""
+import logging
+import math
+import traceback
+
+from defines import JobActionName
+from execution.downstream import DownstreamExecution
+from execution.setup import SetupExecution
+
+job_logger = logging.getLogger()
+
+
+class ActionSpec:
+    """アクションの定義"""
+
+    def __init__(
+        self,
+        name: JobActionName,
+        setup=None,
+        downstream=None,
+        timeout_sec: float = None,
+        concurrency_class: str = None,
+        idempotent: bool = False,
+        auto_report: bool = True,
+    ):
+        """
+        Args:
+            name (JobActionName): アクション名
+            setup (, optional): セットアップ時の実行関数 func(action). Defaults to None (セットアップ時は何もしない).
+            downstream (, optional): downstreamの実行関数 func(action). Defaults to None (downstreamでは何もしない).
+            timeout_sec (float, optional): 実行の制限時間. IN_PROGRESSの報告時にステップタイムアウトとして設定し、
+                超過した場合はAWS IoT側でTIMED_OUTになる. Defaults to None (制限なし).
+            concurrency_class (str, optional): 同時実行数の制限の単位. Defaults to None (アクション名).
+            idempotent (bool, optional): 途中で中断されたjobを再実行してよいか. Defaults to False.
+            auto_report (bool, optional): 実行後に成功(SUCCEEDED)を自動で報告するか.
+                Falseの場合は実行関数が報告する (例外発生時は常にFAILEDを報告する). Defaults to True.
+        """
+        self.name = name
+        self.setup = setup
+        self.downstream = downstream
+        self.timeout_sec = timeout_sec
+        self.concurrency_class = concurrency_class or name.value
+        self.idempotent = idempotent
+        self.auto_report = auto_report
+
+    @property
+    def step_timeout_in_minutes(self):
+        """IN_PROGRESSの報告に設定するステップタイムアウト(分)"""
+        if self.timeout_sec is None:
+            return None
+        return max(1, math.ceil(self.timeout_sec / 60))
+
+
+class ActionRegistry:
+    """アクション名から定義を引く対応表"""
+
+    def __init__(self):
+        self.__specs = {}
+
+    def register(self, spec: ActionSpec):
+        """アクションを登録する
+
+        Args:
+            spec (ActionSpec): アクションの定義
+        """
+        if spec.name.value in self.__specs:
+            raise Exception(f"Action already registered: {spec.name.value}")
+        self.__specs[spec.name.value] = spec
+
+    def get(self, action_name: str):
+        """アクション名に対応する定義を取得する
+
+        Args:
+            action_name (str): jobドキュメントのアクション名
+
+        Returns:
+            ActionSpec: アクションの定義 (未登録の場合はNone)
+        """
+        return self.__specs.get(action_name)
+
+    def names(self) -> list:
+        """登録済みのアクション名一覧"""
+        return list(self.__specs)
+
+
+def run_action(spec: ActionSpec, phase: str, action: dict, job_id: str, job_status_update) -> bool:
+    """アクションを実行し、結果を報告する
+    成功時はauto_reportの場合のみSUCCEEDED、例外発生時はFAILEDを報告する
+
+    Args:
+        spec (ActionSpec): アクションの定義
+        phase (str): "setup" または "downstream"
+        action (dict): jobドキュメントのaction
+        job_id (str): ジョブID
+        job_status_update (JobStatusUpdate): ステータスの報告先
+
+    Returns:
+        bool: 成功した場合True
+    """
+    handler = getattr(spec, phase)
+    try:
+        if handler is not None:
+            handler(action=action)
+    except Exception:
+        job_logger.error(traceback.format_exc())
+        job_status_update.publish_failed(job_id=job_id)
+        return False
+
+    if spec.auto_report:
+        job_status_update.publish_succeeded(job_id=job_id)
+    return True
+
+
+_setup_execution = SetupExecution()
+_downstream_execution = DownstreamExecution()
+
+ACTION_REGISTRY = ActionRegistry()
+ACTION_REGISTRY.register(ActionSpec(
+    name=JobActionName.JOB1,
+    setup=_setup_execution.setup_job1,
+    downstream=_downstream_execution.downstream_job1,
+    timeout_sec=10 * 60,
+))
+ACTION_REGISTRY.register(ActionSpec(
+    name=JobActionName.JOB2,
+    setup=_setup_execution.setup_job2,
+    downstream=_downstream_execution.downstream_job2,
+    idempotent=True,
+))
+ACTION_REGISTRY.register(ActionSpec(
+    name=JobActionName.JOB3,
+    setup=_setup_execution.setup_job3,
+    downstream=_downstream_execution.downstream_job3,
+    idempotent=True,
+))
@@ -26,3 +26,8 @@ class SetupExecution:
         """
         job_logger.info('JOB SETUP EXECUTION: JOB3')
         print(action)
+
+    def job_finish(self):
+        """溜まっていたjobをすべて処理した後の処理
+        """
+        job_logger.info('JOB SETUP EXECUTION: FINISH')
@@ -13,40 +13,67 @@ jobリスト
 """
 
 import logging
-import threading
+import time
 import traceback
 
 from awsiot import iotjobs
-from defines import JobActionName
-from execution.downstream import DownstreamExecution
+from awsiot.iotjobs import JobStatus
+from execution.registry import ACTION_REGISTRY, ActionSpec, run_action
 from utils.get_job import GetJob
+from utils.job_executor import JobExecutor
 from utils.job_status_update import JobStatusUpdate
 from utils.locked_data import LockedData
-from utils.mqtt_connection import connection_builder, disconnection
+from utils.mqtt_connection import MqttConnectionManager
 
 job_logger = logging.getLogger()
 
+# 終了時に実行中のjobの完了を待つ最大秒数
+EXIT_TIMEOUT_SEC = 60
+# 全体の同時実行数の既定値
+DEFAULT_MAX_CONCURRENCY = 4
+# 完了したjobを一覧の取得結果から除外する秒数
+# (ステータス更新がjob一覧に反映されるまでの間に、同じjobを再度実行しないため)
+FINISHED_JOB_TTL_SEC = 60
+
 
 class JobDownStream:
-    """jobの処理"""
+    """jobの処理
+    待機中のjob一覧を取得し、同時実行数の上限に空きがある限りjobを並列に実行する
+
+    NOTE: StartNextPendingJobExecutionは実行中(IN_PROGRESS)のjobを優先して返すため、
+          実行中に別のjobを取得できない。GetPendingJobExecutionsで一覧を取得し、
+          未着手のjobの詳細をDescribeJobExecutionで取得して実行する
+          同じ理由でNextJobExecutionChangedも実行中は通知されないため、
+          jobの追加はJobExecutionsChangedで検知する
+    """
 
-    def __init__(self, edge_config: dict):
+    def __init__(self, edge_config: dict, connection_manager: MqttConnectionManager):
         """
         Args:
-            config_filepath (str): 設定ファイルパス
             edge_config (dict): エッジ固定値
-            application (): アプリケーションインスタンス
-            application_restart (): アプリケーション再起動関数
-            is_application_start (bool): アプリ開始フラグ
+                job_max_concurrency (int, optional): 全体の同時実行数の上限. Defaults to 4.
+                job_action_limits (dict, optional): アクション名ごとの同時実行数の上限 (例: {"job1": 1})
+            connection_manager (MqttConnectionManager): セットアップと共有するmqtt接続
         """
         self.__locked_data = LockedData()
 
-        self.__execution = DownstreamExecution()
+        self.__executor = JobExecutor(
+            max_concurrency=edge_config.get("job_max_concurrency", DEFAULT_MAX_CONCURRENCY),
+            action_limits=edge_config.get("job_action_limits"),
+            on_job_done=self.__on_job_done,
+        )
+
+        # 詳細取得中・実行待ち・実行中のjob
+        self.__known_jobs = set()
+        # 実行待ちのjob (job_id: (queued_at, action, spec))
+        self.__waiting_jobs = {}
+        # 完了したjob (job_id: 完了時刻)
+        self.__finished_jobs = {}
 
-        self.__mqtt_connection = connection_builder(edge_config=edge_config)
+        self.__connection_manager = connection_manager
 
         jobs_client = iotjobs.IotJobsClient(
-            mqtt_connection=self.__mqtt_connection
+            mqtt_connection=connection_manager.get_connection()
         )
         self.__get_job = GetJob(
             thing_name=edge_config["edge_id"],
@@ -58,22 +85,15 @@ class JobDownStream:
             logger=job_logger
         )
 
-    def __callback_next_job_summary(self, response: iotjobs.NextJobExecutionChangedSubscriptionRequest):
-        """次のjobが更新されたときに概要を取得
+    def __callback_job_executions_changed(self, response: iotjobs.JobExecutionsChangedEvent):
+        """待機中のjobが追加・変更されたときに待機中のjob一覧を取得し直す
 
         Args:
-            response (iotjobs.NextJobExecutionChangedSubscriptionRequest): 取得したjobの概要
+            response (iotjobs.JobExecutionsChangedEvent): ステータスごとのjob一覧
         """
-
         try:
-            if response.execution:
-                # 他のjobが実行中でない場合True
-                can_start_job = self.__locked_data.lock_change_for_next_job_start()
-
-                if can_start_job:
-                    self.__get_job.request_next_job_for_start(
-                        locked_data=self.__locked_data)
-
+            if response.jobs:
+                self.__request_pending_jobs()
             else:
                 job_logger.info(
                     "job_id: None, Waiting for further jobs...")
@@ -82,135 +102,256 @@ class JobDownStream:
             job_logger.error(traceback.format_exc())
             raise
 
-    def __callback_next_job_for_start_accepted(self, response: iotjobs.StartNextPendingJobExecutionRequest):
-        """次のjobの詳細を取得し、ステータスをIN_PROGRESSに移行
-        actionごとに振り分ける
+    def __request_pending_jobs(self):
+        """空きがあれば待機中のjob一覧をrequestする
+        request中の場合は、完了後に再度requestする
+        """
+        if not self.__executor.has_capacity():
+            # 実行中のjobが完了したときに再度requestする
+            return
+
+        if self.__locked_data.lock_start_poll():
+            job_logger.info("Publish: get pending jobs request")
+            self.__get_job.request_pending_jobs()
+
+    def __finish_pending_jobs_request(self):
+        """待機中のjob一覧のrequest完了。request中に要求があれば再度requestする"""
+        if self.__locked_data.lock_finish_poll():
+            self.__request_pending_jobs()
+
+    def __callback_pending_jobs_accepted(self, response: iotjobs.GetPendingJobExecutionsResponse):
+        """待機中のjob一覧から未着手のjobの詳細をrequestする
 
         Args:
-            response (iotjobs.StartNextPendingJobExecutionRequest): ジョブの詳細
+            response (iotjobs.GetPendingJobExecutionsResponse): 取得したjob一覧
         """
         try:
-            if response.execution:
-                # NOTE: IN_PROGRESSへのupdateはsubscribe_next_job_for_startが行う
-                job_thread = threading.Thread(
-                    target=lambda: self.__switch_job(
-                        response.execution.job_id, response.execution.job_document
-                    ),
-                    name="job_thread"
-                )
-                job_thread.start()
+            jobs = list(response.in_progress_jobs or []) + list(response.queued_jobs or [])
+            # queue登録時間で昇順ソート
+            jobs.sort(key=lambda job: job.queued_at)
+
+            new_job_ids = []
+            now = time.monotonic()
+            with self.__locked_data.lock:
+                self.__finished_jobs = {
+                    job_id: finished_at for job_id, finished_at in self.__finished_jobs.items()
+                    if now - finished_at < FINISHED_JOB_TTL_SEC
+                }
+                for job in jobs:
+                    if job.job_id not in self.__known_jobs and job.job_id not in self.__finished_jobs:
+                        self.__known_jobs.add(job.job_id)
+                        new_job_ids.append(job.job_id)
+
+            for job_id in new_job_ids:
+                self.__get_job.request_job_detail(job_id=job_id)
+
+            if not jobs:
+                job_logger.info("No pending jobs, Waiting for further jobs...")
 
-            else:
-                job_logger.info(
-                    "Request to start next job was accepted, but there are no jobs to done, Waiting for further jobs...")
-                self.__done_working_on_job()
+        except Exception:
+            job_logger.error(traceback.format_exc())
+
+        finally:
+            self.__finish_pending_jobs_request()
+
+    def __callback_pending_jobs_rejected(self, response: iotjobs.RejectedError):
+        """待機中のjob一覧の取得に失敗
+
+        Args:
+            response (iotjobs.RejectedError): エラーメッセージ
+        """
+        job_logger.error(response)
+        self.__finish_pending_jobs_request()
+
+    def __callback_job_detail_accepted(self, response: iotjobs.DescribeJobExecutionResponse):
+        """jobの詳細を実行待ちに追加し、空きがあれば実行する
+
+        Args:
+            response (iotjobs.DescribeJobExecutionResponse): ジョブの詳細
+        """
+        execution = response.execution
+        if not execution:
+            # 取得までの間にjobが削除・キャンセルされた場合
+            self.__forget_job(response.client_token)
+            return
 
+        job_id = execution.job_id
+        try:
+            # actionはstepsの先頭のみ対応
+            action = execution.job_document["steps"][0]["action"]
+            spec = ACTION_REGISTRY.get(action["name"])
+            if spec is None:
+                # 定義外action
+                raise Exception(
+                    f"No Define Action: {action['name']}. The Job List is as Follows {ACTION_REGISTRY.names()}")
         except Exception:
             job_logger.error(traceback.format_exc())
-            self.__done_working_on_job()
-            raise
+            self.__job_status_update.publish_failed(job_id=job_id)
+            self.__finish_job(job_id)
+            return
+
+        with self.__locked_data.lock:
+            if job_id not in self.__known_jobs or self.__executor.is_running(job_id):
+                # 再接続前のrequestの応答が遅れて届いた場合など、管理対象外・実行中のjob
+                return
+
+        if execution.status not in (JobStatus.QUEUED, JobStatus.IN_PROGRESS):
+            # 一覧の取得後に完了・キャンセルされた場合
+            self.__finish_job(job_id)
+            return
+
+        if execution.status == JobStatus.IN_PROGRESS and not spec.idempotent:
+            # このプロセスで開始していない実行中のjob (前回の実行が中断された) は再実行しない
+            job_logger.error("Interrupted job is not idempotent: (job id: %s)", job_id)
+            self.__job_status_update.publish_failed(job_id=job_id)
+            self.__finish_job(job_id)
+            return
+
+        with self.__locked_data.lock:
+            self.__waiting_jobs[job_id] = (execution.queued_at, action, spec)
+        self.__dispatch()
 
-    def __callback_next_job_for_start_rejected(self, response: iotjobs.StartNextPendingJobExecutionRequest):
-        """ジョブ詳細取得に失敗したため次のジョブを試みる
+    def __callback_job_detail_rejected(self, response: iotjobs.RejectedError):
+        """jobの詳細取得に失敗
 
         Args:
-            response (iotjobs.StartNextPendingJobExecutionRequest): エラーメッセージ
+            response (iotjobs.RejectedError): エラーメッセージ
         """
         job_logger.error(response)
-        self.__done_working_on_job()
+        # request時にclient_tokenへjob_idを設定している
+        self.__forget_job(response.client_token)
 
     def __callback_job_status_update_accepted(self, response: iotjobs.UpdateJobExecutionResponse):
-        """ステータス更新後、次のjobを実行する
+        """ステータス更新の成功
 
         Args:
             response (iotjobs.UpdateJobExecutionResponse):
         """
-        self.__done_working_on_job()
+        job_logger.debug(response)
 
-    def __callback_job_status_update_rejected(self, response: iotjobs.UpdateJobExecutionResponse):
-        """ステータス更新が失敗したため、次のジョブを試みる
+    def __callback_job_status_update_rejected(self, response: iotjobs.RejectedError):
+        """ステータス更新の失敗
 
         Args:
-            response (iotjobs.UpdateJobExecutionResponse): エラーメッセージ
+            response (iotjobs.RejectedError): エラーメッセージ
         """
         job_logger.error(response)
-        self.__done_working_on_job()
 
-    def __done_working_on_job(self):
-        """job完了によるlock解除を行い、次のjobがあれば詳細をrequestする
+    def __callback_connection_resumed(self):
+        """再接続後に待機中のjob一覧をrequestし直す
+        接続断の間に一覧・詳細の応答が失われている場合があるため、
+        実行待ち・実行中以外のjobとrequest中の状態を破棄してから取得し直す
+        """
+        job_logger.info("Reconnected: request pending jobs again")
+        with self.__locked_data.lock:
+            self.__known_jobs = {
+                job_id for job_id in self.__known_jobs
+                if job_id in self.__waiting_jobs or self.__executor.is_running(job_id)
+            }
+        self.__locked_data.reset_poll()
+        self.__request_pending_jobs()
+
+    def __dispatch(self):
+        """実行待ちのjobを古いものから順に、上限に空きがある限り実行する
+        アクションごとの上限に達しているjobは飛ばし、別のアクションのjobを先に実行する
+        """
+        with self.__locked_data.lock:
+            if not self.__locked_data.is_mqtt_connect:
+                return
+
+            for job_id, (_, action, spec) in sorted(self.__waiting_jobs.items(), key=lambda item: item[1][0]):
+                started = self.__executor.try_submit(
+                    job_id=job_id,
+                    action_name=spec.concurrency_class,
+                    function=lambda job_id=job_id, action=action, spec=spec: self.__run_job(job_id, action, spec)
+                )
+                if started:
+                    del self.__waiting_jobs[job_id]
+                elif not self.__executor.has_capacity():
+                    break
+
+    def __on_job_done(self, job_id: str):
+        """job完了時に枠を解放し、実行待ちのjobと新しいjobを取得する
+
+        Args:
+            job_id (str): 完了したジョブID
         """
-        try_again = self.__locked_data.lock_change_by_complete_job()
+        self.__finish_job(job_id)
+        self.__dispatch()
+        self.__request_pending_jobs()
 
-        if try_again:
-            self.__get_job.request_next_job_for_start(
-                locked_data=self.__locked_data)
+    def __finish_job(self, job_id: str):
+        """jobを完了済みとして管理対象から外す"""
+        with self.__locked_data.lock:
+            self.__finished_jobs[job_id] = time.monotonic()
+        self.__forget_job(job_id)
 
-    def __switch_job(self, job_id: str, job_document: dict):
-        """jobを受け取りaction名によって振り分ける
+    def __forget_job(self, job_id: str):
+        """jobを管理対象から外す"""
+        with self.__locked_data.lock:
+            self.__known_jobs.discard(job_id)
+            self.__waiting_jobs.pop(job_id, None)
+
+    def __run_job(self, job_id: str, action: dict, spec: ActionSpec):
+        """jobを実行中にし、アクションの実行関数を実行する
 
         Args:
             job_id (str): ジョブID
-            job_document (dict): ジョブの詳細ドキュメント
+            action (dict): ジョブドキュメントのaction
+            spec (ActionSpec): アクションの定義
         """
         try:
-            self.__job_status_update.publish_in_progress(job_id=job_id)
-            # actionはstepsの先頭のみ対応
-            action = job_document["steps"][0]["action"]
-            job_logger.info('ACTION: %s', action)
-
-            action_name = JobActionName(action['name'])
-
-            if action_name == JobActionName.JOB1:
-                # job1
-                self.__execution.downstream_job1(action=action)
-            elif action_name == JobActionName.JOB2:
-                # job2
-                self.__execution.downstream_job2(action=action)
-                self.__job_status_update.publish_succeeded(job_id=job_id)
-            elif action_name == JobActionName.JOB3:
-                # job3
-                self.__execution.downstream_job3(action=action)
-                self.__job_status_update.publish_succeeded(job_id=job_id)
-            else:
-                # 定義外action
-                job_list = [i.value for i in JobActionName]
-                job_logger.error(
-                    "No Define Action: %s. The Job List is as Follows %s", action["name"], job_list)
-                self.__job_status_update.publish_failed(job_id=job_id)
-
+            self.__job_status_update.publish_in_progress(
+                job_id=job_id, step_timeout_in_minutes=spec.step_timeout_in_minutes)
         except Exception:
             job_logger.error(traceback.format_exc())
             self.__job_status_update.publish_failed(job_id=job_id)
+            return
+
+        job_logger.info('ACTION: %s', action)
+        run_action(spec, "downstream", action, job_id, self.__job_status_update)
 
     def main(self):
         """jobの開始
         更新取得
+        一覧取得
         詳細取得
         ステータス更新
         を設定する
         """
         job_logger.info("Run Job")
-        self.__get_job.subscribe_next_jobs_summary(
-            callback=self.__callback_next_job_summary
+        self.__get_job.subscribe_job_executions_changed(
+            callback=self.__callback_job_executions_changed
         )
-        self.__get_job.subscribe_next_job_for_start(
-            callback_accepted=self.__callback_next_job_for_start_accepted,
-            callback_rejected=self.__callback_next_job_for_start_rejected
+        self.__get_job.subscribe_pending_jobs(
+            callback_accepted=self.__callback_pending_jobs_accepted,
+            callback_rejected=self.__callback_pending_jobs_rejected
+        )
+        self.__get_job.subscribe_jobs_detail(
+            callback_accepted=self.__callback_job_detail_accepted,
+            callback_rejected=self.__callback_job_detail_rejected
         )
         self.__job_status_update.subscribe_job_status_update(
             callback_accept=self.__callback_job_status_update_accepted,
             callback_reject=self.__callback_job_status_update_rejected
         )
+        self.__connection_manager.add_resume_listener(self.__callback_connection_resumed)
 
-        self.__get_job.request_next_job_for_start(
-            locked_data=self.__locked_data
-        )
+        self.__request_pending_jobs()
         return True
 
-    def exit(self):
+    def exit(self, timeout: float = EXIT_TIMEOUT_SEC):
         """jobの停止
-        mqtt接続を切断する
+        新しいjobの受付を止め、実行中のjobの完了を待ってからmqtt接続を切断する
+
+        Args:
+            timeout (float, optional): 実行中のjobの完了を待つ最大秒数. Defaults to EXIT_TIMEOUT_SEC.
         """
         self.__locked_data.disconnect_mqtt()
-        disconnection(self.__mqtt_connection)
+
+        job_logger.info("Waiting for running jobs to finish")
+        if not self.__executor.shutdown(timeout=timeout):
+            job_logger.error("Timed out waiting for running jobs")
+
+        self.__connection_manager.disconnect()
         job_logger.info("Kill Job")
@@ -10,33 +10,40 @@ queue, in_progressにjobがある場合、以下の最新のもののみ実行
 """
 
 import logging
-import time
+import threading
 import traceback
+from concurrent.futures import Future
 
+from execution.registry import ACTION_REGISTRY, run_action
 from execution.setup import SetupExecution
 from awsiot import iotjobs
-from defines import JobActionName
 from utils.get_job import GetJob
 from utils.job_status_update import JobStatusUpdate
 from utils.locked_data import LockedData
-from utils.mqtt_connection import connection_builder
+from utils.mqtt_connection import MqttConnectionManager
 
 job_logger = logging.getLogger()
 
+# job一覧の応答を待つ最大秒数
+PENDING_JOBS_TIMEOUT_SEC = 30
+# job詳細の応答を待つ最大秒数
+DETAIL_TIMEOUT_SEC = 30
+
 
 class JobSetup:
     """セットアップ時のジョブ処理"""
 
-    def __init__(self, edge_config: dict):
+    def __init__(self, edge_config: dict, connection_manager: MqttConnectionManager):
         """
         Args:
             edge_config (dict): エッジ固定値
+            connection_manager (MqttConnectionManager): downstreamと共有するmqtt接続
         """
         self.__locked_data = LockedData()
 
         # job関連の通信に使うclient定義
         jobs_client = iotjobs.IotJobsClient(
-            mqtt_connection=connection_builder(edge_config=edge_config)
+            mqtt_connection=connection_manager.get_connection()
         )
 
         self.__get_job = GetJob(
@@ -47,8 +54,9 @@ class JobSetup:
 
         self.__setup_execution = SetupExecution()
 
-        self.__is_pending_job_get = False
+        self.__pending_jobs_received = threading.Event()
         self.__job_list = {}
+        self.__job_details = {}
         self.__complete_job_list = []
 
     def __callback_get_pending_jobs_accepted(self, response: iotjobs.GetPendingJobExecutionsRequest):
@@ -67,7 +75,7 @@ class JobSetup:
             # queue登録時間で昇順ソート
             self.__job_list = sorted(self.__job_list.items())
             self.__job_list = dict((x, y) for x, y in self.__job_list)
-        self.__is_pending_job_get = True
+        self.__pending_jobs_received.set()
 
     def __callback_get_pending_jobs_rejected(self, response: iotjobs.GetPendingJobExecutionsRequest):
         """待機中のjob一覧取得に失敗
@@ -76,44 +84,58 @@ class JobSetup:
             response (iotjobs.GetPendingJobExecutionsRequest): 取得したresponse
         """
         job_logger.error(response)
-        self.__is_pending_job_get = True
+        self.__pending_jobs_received.set()
 
-    def __callback_get_pending_job_detail_accepted(self, response: iotjobs.DescribeJobExecutionRequest):
+    def __callback_get_pending_job_detail_accepted(self, response: iotjobs.DescribeJobExecutionResponse):
         """job詳細取得成功時のcallback
-        actionごとに実行関数に振り分ける
+        対象jobのfutureに詳細を設定する (実行はmainで古いjobから順に行う)
+
+        Args:
+            response (iotjobs.DescribeJobExecutionResponse): ジョブの詳細
+        """
+        execution = response.execution
+        job_id = execution.job_id if execution else response.client_token
+        future = self.__job_details.get(job_id)
+        if future is not None and not future.done():
+            future.set_result(execution)
+
+    def __callback_get_pending_job_detail_rejected(self, response: iotjobs.RejectedError):
+        """job詳細取得失敗時のcallback
+
+        Args:
+            response (iotjobs.RejectedError): エラーメッセージ
+        """
+        job_logger.error(response)
+        # request時にclient_tokenへjob_idを設定している
+        future = self.__job_details.get(response.client_token)
+        if future is not None and not future.done():
+            future.set_exception(Exception(f"Describe job rejected: {response.code} {response.message}"))
+
+    def __execute(self, job_id: str, execution: iotjobs.JobExecutionData):
+        """actionごとに実行関数に振り分ける
 
         Args:
-            response (iotjobs.DescribeJobExecutionRequest): ジョブの詳細
+            job_id (str): ジョブID
+            execution (iotjobs.JobExecutionData): ジョブの詳細
         """
         try:
-            execution = response.execution
-            job_id = execution.job_id
-            job_logger.info('IN_PROGRESS: (job id: %s)', job_id)
+            if execution is None:
+                # 取得までの間にjobが削除・キャンセルされた場合
+                job_logger.info('Job not found: (job id: %s)', job_id)
+                return
 
             # actionはstepsの先頭のみ対応
             action = execution.job_document['steps'][0]['action']
             job_logger.info('ACTION: %s', action)
 
-            action_name = JobActionName(action['name'])
-
-            if action_name == JobActionName.JOB1:
-                # job1
-                self.__setup_execution.setup_job1(action=action)
-                self.__job_status_update.publish_succeeded(job_id=job_id)
-            elif action_name == JobActionName.JOB2:
-                # job2
-                self.__setup_execution.setup_job2(action=action)
-                self.__job_status_update.publish_succeeded(job_id=job_id)
-            elif action_name == JobActionName.JOB3:
-                # job3
-                self.__setup_execution.setup_job3(action=action)
-                self.__job_status_update.publish_succeeded(job_id=job_id)
-            else:
+            spec = ACTION_REGISTRY.get(action['name'])
+            if spec is None:
                 # 定義外action
-                job_list = [i.value for i in JobActionName]
                 job_logger.error(
-                    "No Define Action: %s. The Job List is as Follows %s", action["name"], job_list)
+                    "No Define Action: %s. The Job List is as Follows %s", action["name"], ACTION_REGISTRY.names())
                 self.__job_status_update.publish_failed(job_id=job_id)
+            else:
+                run_action(spec, "setup", action, job_id, self.__job_status_update)
 
             self.__complete_job_list.append(job_id)
 
@@ -121,46 +143,45 @@ class JobSetup:
             job_logger.error(traceback.format_exc())
             self.__job_status_update.publish_failed(job_id=job_id)
 
-    def __callback_get_pending_job_detail_rejected(self, response: iotjobs.DescribeJobExecutionRequest):
-        """job詳細取得失敗時のcallback
-
-        Args:
-            response (iotjobs.DescribeJobExecutionRequest): エラーメッセージ
+    def main(self):
+        """実行前に指示されていたjobを処理する
+        job一覧の取得に失敗した場合も、終了時の処理 (job_finish) は必ず行う
         """
         try:
-            job_logger.error(response)
-            job_id = response.exception.job_id
-            self.__job_status_update.publish_failed(job_id=job_id)
-        except Exception:
-            job_logger.error(traceback.format_exc())
-            self.__job_status_update.publish_failed(job_id=job_id)
-            raise
+            self.__do_pending_jobs()
+        finally:
+            self.__setup_execution.job_finish()
 
-    def main(self) -> bool:
-        """実行前に指示されていたjobを処理する
+        job_logger.info('Complete Setup: Do Job %s', self.__complete_job_list)
 
-        Returns:
-            bool: カメラストリームの開始可否
-        """
+    def __do_pending_jobs(self):
+        """待機中のjobを古いものから順に実行する"""
         self.__get_job.get_pending_jobs(
             callback_accepted=self.__callback_get_pending_jobs_accepted,
             callback_rejected=self.__callback_get_pending_jobs_rejected)
-        while not self.__is_pending_job_get:
-            # job一覧取得が完了するまで待機
-            time.sleep(1)
+        # job一覧取得が完了するまで待機
+        if not self.__pending_jobs_received.wait(timeout=PENDING_JOBS_TIMEOUT_SEC):
+            job_logger.error('Timed out waiting for pending jobs. Skip setup')
+            return
 
+        # 詳細の取得結果は全jobで共通のtopicで受信する
+        self.__get_job.subscribe_jobs_detail(
+            callback_accepted=self.__callback_get_pending_job_detail_accepted,
+            callback_rejected=self.__callback_get_pending_job_detail_rejected)
+
+        # 応答を待たずに全jobの詳細をrequestする
+        for job_id in self.__job_list.values():
+            self.__job_details[job_id] = Future()
         for job_id in self.__job_list.values():
-            # 古いjobから順に取得
             self.__job_status_update.publish_in_progress(job_id=job_id)
+            self.__get_job.request_job_detail(job_id=job_id)
 
-            # 詳細を取得して実行
-            self.__get_job.get_pending_jobs_detail_by_job_id(
-                job_id=job_id,
-                callback_accepted=self.__callback_get_pending_job_detail_accepted,
-                callback_rejected=self.__callback_get_pending_job_detail_rejected)
-            while job_id not in self.__complete_job_list:
-                time.sleep(1)
-
-        self.__setup_execution.job_finish()
-
-        job_logger.info('Complete Setup: Do Job %s', self.__complete_job_list)
+        for job_id in self.__job_list.values():
+            # 古いjobから順に実行
+            try:
+                execution = self.__job_details[job_id].result(timeout=DETAIL_TIMEOUT_SEC)
+            except Exception:
+                job_logger.error(traceback.format_exc())
+                self.__job_status_update.publish_failed(job_id=job_id)
+                continue
+            self.__execute(job_id=job_id, execution=execution)
@@ -5,11 +5,13 @@ jobの処理
 import argparse
 import json
 import logging
-import time
+import signal
+import threading
 from logging.config import fileConfig
 
 from job_downstream import JobDownStream
 from job_setup import JobSetup
+from utils.mqtt_connection import MqttConnectionManager
 
 fileConfig("./logging.txt", disable_existing_loggers=False)
 job_logger = logging.getLogger()
@@ -21,27 +23,57 @@ def parse_args():
 
     # エッジ設定
     parser.add_argument(
-        "-ec", "--edge-config-filepath", dest="edge_confit_filepath", type=str,
+        "-ec", "--edge-config-filepath", dest="edge_config_filepath", type=str,
         default="../configs/config.json",
         help="edge config filepath")
 
     return parser.parse_args()
 
 
+def install_shutdown_handler() -> threading.Event:
+    """SIGTERM/SIGINTを受信したらsetされるEventを作成する
+
+    Returns:
+        threading.Event: 終了要求のEvent
+    """
+    shutdown_event = threading.Event()
+
+    def handler(signum, frame):
+        job_logger.info("Received signal: %s", signal.Signals(signum).name)
+        shutdown_event.set()
+
+    signal.signal(signal.SIGTERM, handler)
+    signal.signal(signal.SIGINT, handler)
+    return shutdown_event
+
+
 if __name__ == "__main__":
     args = parse_args()
 
     edge_config = json.load(open(args.edge_config_filepath, "r"))
+    shutdown_event = install_shutdown_handler()
+
+    # セットアップとdownstreamで1つの接続を共有する
+    connection_manager = MqttConnectionManager(config=edge_config)
 
     # 溜まっているjobを処理
-    job_setup = JobSetup(edge_config=edge_config)
+    job_setup = JobSetup(edge_config=edge_config, connection_manager=connection_manager)
     job_setup.main()
 
-    # downstream
-    downstream_job = JobDownStream(
-        edge_config=edge_config
-    )
-    downstream_job.main()
+    if shutdown_event.is_set():
+        # セットアップ中に終了要求を受けた場合はdownstreamを開始しない
+        job_logger.info("Shutdown requested during setup")
+        connection_manager.disconnect()
+    else:
+        # downstream
+        downstream_job = JobDownStream(
+            edge_config=edge_config,
+            connection_manager=connection_manager
+        )
+        downstream_job.main()
+
+        # 終了要求を受けるまで待機し、実行中のjobを終えてから切断する
+        shutdown_event.wait()
+        downstream_job.exit()
 
-    while True:
-        time.sleep(1)
+    job_logger.info("MQTT connection metrics: %s", connection_manager.metrics())
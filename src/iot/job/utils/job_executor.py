@@ -0,0 +1,106 @@
+"""jobの並列実行
+
+全体の同時実行数と、アクションごとの同時実行数の上限を持つworker pool
+"""
+
+import logging
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
+
+job_logger = logging.getLogger()
+
+
+class JobExecutor:
+    """同時実行数の上限付きでjobを実行する"""
+
+    def __init__(self, max_concurrency: int = 4, action_limits: dict = None, on_job_done=None):
+        """
+        Args:
+            max_concurrency (int, optional): 全体の同時実行数の上限. Defaults to 4.
+            action_limits (dict, optional): アクション名ごとの同時実行数の上限 (未指定のアクションは全体の上限のみ). Defaults to None.
+            on_job_done (, optional): jobの完了時(空きができたとき)に呼び出すcallback関数. Defaults to None.
+        """
+        self.max_concurrency = max_concurrency
+        self.action_limits = action_limits or {}
+        self.__on_job_done = on_job_done
+
+        self.__lock = threading.Lock()
+        self.__pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="job")
+        self.__running = {}
+        self.__running_by_action = {}
+        self.__closed = False
+
+    def has_capacity(self) -> bool:
+        """全体の同時実行数に空きがあるか
+
+        Returns:
+            bool: 空きがある場合True
+        """
+        with self.__lock:
+            return len(self.__running) < self.max_concurrency
+
+    def is_running(self, job_id: str) -> bool:
+        """jobが実行中か
+
+        Args:
+            job_id (str): ジョブID
+
+        Returns:
+            bool: 実行中の場合True
+        """
+        with self.__lock:
+            return job_id in self.__running
+
+    def try_submit(self, job_id: str, action_name: str, function) -> bool:
+        """上限に空きがあればjobの実行を開始する
+
+        Args:
+            job_id (str): ジョブID
+            action_name (str): アクション名
+            function (): 実行する関数 (引数なし)
+
+        Returns:
+            bool: 実行を開始した場合True
+        """
+        with self.__lock:
+            if self.__closed or len(self.__running) >= self.max_concurrency:
+                return False
+            running = self.__running_by_action.get(action_name, 0)
+            if running >= self.action_limits.get(action_name, self.max_concurrency):
+                return False
+
+            self.__running_by_action[action_name] = running + 1
+            future = self.__pool.submit(self.__run, job_id, function)
+            self.__running[job_id] = (action_name, future)
+            return True
+
+    def __run(self, job_id: str, function):
+        """jobを実行し、完了後に枠を解放する"""
+        try:
+            function()
+        except Exception:
+            job_logger.error(traceback.format_exc())
+        finally:
+            with self.__lock:
+                action_name, _ = self.__running.pop(job_id)
+                self.__running_by_action[action_name] -= 1
+
+            if self.__on_job_done is not None:
+                self.__on_job_done(job_id)
+
+    def shutdown(self, timeout: float = None) -> bool:
+        """新しいjobの受付を止め、実行中のjobの完了を待つ
+
+        Args:
+            timeout (float, optional): 待機する最大秒数. Defaults to None (完了まで待つ).
+
+        Returns:
+            bool: すべてのjobが完了した場合True
+        """
+        with self.__lock:
+            self.__closed = True
+            futures = [future for _, future in self.__running.values()]
+        self.__pool.shutdown(wait=False)
+        _, not_done = wait(futures, timeout=timeout)
+        return not not_done
@@ -4,6 +4,8 @@ from awscrt.mqtt import QoS
 from awsiot import iotjobs
 from awsiot.iotjobs import JobStatus
 
+from defines import MQTT_TIMEOUT_SEC
+
 job_logger = logging.getLogger()
 
 
@@ -46,16 +48,19 @@ class JobStatusUpdate:
             request=request, qos=QoS.AT_LEAST_ONCE)
         publish_future.add_done_callback(publish_callback_result)
 
-    def publish_in_progress(self, job_id: str):
+    def publish_in_progress(self, job_id: str, step_timeout_in_minutes: int = None):
         """jobのステータスを実行中(IN_PROGRESS)にする
 
         Args:
             job_id (str): ジョブID
+            step_timeout_in_minutes (int, optional): 完了の報告までの制限時間(分).
+                超過した場合はAWS IoT側でTIMED_OUTになる. Defaults to None (制限なし).
         """
         request = iotjobs.UpdateJobExecutionRequest(
             thing_name=self.__thing_name,
             job_id=job_id,
-            status=JobStatus.IN_PROGRESS
+            status=JobStatus.IN_PROGRESS,
+            step_timeout_in_minutes=step_timeout_in_minutes
         )
         self.__status_publish(request=request)
         if self.__logger:
@@ -120,5 +125,5 @@ class JobStatusUpdate:
             callback=callback_reject
         )
 
-        subscribe_accepted_future.result()
-        subscribe_rejected_future.result()
+        subscribe_accepted_future.result(timeout=MQTT_TIMEOUT_SEC)
+        subscribe_rejected_future.result(timeout=MQTT_TIMEOUT_SEC)
@@ -13,70 +13,53 @@ class LockedData:
         # mqtt接続
         self.is_mqtt_connect = True
 
-        # 実行中のjob
-        self.is_working_on_job = False
+        # 待機中のjob一覧をrequest中
+        self.is_polling = False
 
-        # 実行待機中のjob
-        self.is_next_job_waiting = False
+        # request中に再度の取得が要求された
+        self.is_poll_requested = False
 
-    def lock_change_for_next_job_start(self) -> bool:
-        """現在のエッジ側のjobの処理状態からjobの実行可能の判断をする
-        実行可能でない場合、待機中のjobがあることをis_next_job_waitingで設定
-
-        job発行を受信したときに使用
-
-        Returns:
-            bool: jobの実行可能フラグ
-        """
-        # jobの実行可能フラグ
-        can_start_job = False
-
-        with self.lock:
-            if self.is_working_on_job:
-                # 実行中のjobがある場合、待機中のjobとして保留
-                self.is_next_job_waiting = True
-            else:
-                # 実行中のjobがない場合
-                can_start_job = True
-
-        return can_start_job
-
-    def lock_check_for_next_job_start(self) -> bool:
-        """job実行の最終確認
-        実行中のjobの存在、接続の切断がされていない場合のみTrueを返す
+    def lock_start_poll(self) -> bool:
+        """待機中のjob一覧のrequestを開始できるか判断する
+        request中の場合は、完了後に再度requestするよう is_poll_requested を設定する
 
         Returns:
-            bool: jobの実行可能フラグ
+            bool: requestを開始できる場合True
         """
-        can_start_job = False
-
         with self.lock:
-            if self.is_working_on_job:
-                # 実行中のjobが存在する場合
-                job_logger.info("Never mind, already working on a job")
-            elif not self.is_mqtt_connect:
+            if not self.is_mqtt_connect:
                 # 接続が切断されている場合
                 job_logger.info("Never mind, jobber connection killed")
-            else:
-                # 実行可能な場合
-                can_start_job = True
+                return False
 
-        self.is_working_on_job = True
-        self.is_next_job_waiting = False
+            if self.is_polling:
+                # request中の場合、完了後に再度requestする
+                self.is_poll_requested = True
+                return False
 
-        return can_start_job
+            self.is_polling = True
+            return True
 
-    def lock_change_by_complete_job(self) -> bool:
-        """実行中のjobが完了した事によるロック解除
+    def lock_finish_poll(self) -> bool:
+        """待機中のjob一覧のrequest完了によるロック解除
 
         Returns:
-            bool: 次のjobの有無
+            bool: 再度requestが必要な場合True
         """
         with self.lock:
-            # job実行の完了
-            self.is_working_on_job = False
+            self.is_polling = False
+            poll_again = self.is_poll_requested
+            self.is_poll_requested = False
 
-        return self.is_next_job_waiting
+        return poll_again
+
+    def reset_poll(self):
+        """request中の状態を解除する
+        接続断の間に応答が失われた場合、完了しないrequestを待ち続けないようにする
+        """
+        with self.lock:
+            self.is_polling = False
+            self.is_poll_requested = False
 
     def disconnect_mqtt(self):
         """lockクラスの接続ステータスをFalseにする
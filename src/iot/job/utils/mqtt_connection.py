@@ -1,15 +1,32 @@
 """ mqtt接続確立クラス """
 import logging
+import random
+import threading
+import time
 import traceback
-from random import randint
 from uuid import uuid4
 
-from awscrt import io
+from awscrt import io, mqtt
 from awsiot import mqtt_connection_builder
-from retry import retry
+
+from defines import MQTT_TIMEOUT_SEC
 
 job_logger = logging.getLogger()
 
+# 初回接続の最大試行回数
+CONNECT_MAX_ATTEMPTS = 5
+# 初回接続の再試行までの待機秒数 (試行ごとに倍にし、0から上限までの範囲でランダムにずらす)
+CONNECT_BACKOFF_BASE_SEC = 1
+CONNECT_BACKOFF_MAX_SEC = 30
+# 接続断からの自動再接続の待機秒数 (awscrtが最小から試行ごとに倍にする)
+# awscrtの待機秒数にはjitterがないため、最小値をクライアントごとに
+# RECONNECT_MIN_TIMEOUT_SEC から RECONNECT_MIN_TIMEOUT_JITTER_SEC の範囲でランダムに決め、
+# 多数の端末が同時に切断された場合の再接続の時期をずらす
+# NOTE: ずれるのは端末ごとの初回の待機秒数のみで、以降は同じ比率で倍になり上限で揃う
+RECONNECT_MIN_TIMEOUT_SEC = 1
+RECONNECT_MIN_TIMEOUT_JITTER_SEC = 5
+RECONNECT_MAX_TIMEOUT_SEC = 32
+
 
 def __make_client_id() -> str:
     """client_idの生成専用関数
@@ -24,28 +41,58 @@ def __make_client_id() -> str:
     return client_id
 
 
-@retry(tries=5, delay=randint(1, 5))
+def make_client_bootstrap() -> io.ClientBootstrap:
+    """event loop groupとhost resolverを作成する
+
+    Returns:
+        io.ClientBootstrap: 接続に使うbootstrap
+    """
+    event_loop_group = io.EventLoopGroup(1)
+    host_resolver = io.DefaultHostResolver(
+        event_loop_group=event_loop_group)
+    return io.ClientBootstrap(
+        event_loop_group=event_loop_group, host_resolver=host_resolver
+    )
+
+
+def backoff_delay(attempt: int, base_sec: float = CONNECT_BACKOFF_BASE_SEC, max_sec: float = CONNECT_BACKOFF_MAX_SEC) -> float:
+    """再試行までの待機秒数 (exponential backoff + full jitter)
+
+    Args:
+        attempt (int): 失敗した回数 (0始まり)
+        base_sec (float, optional): 初回の待機秒数の上限. Defaults to CONNECT_BACKOFF_BASE_SEC.
+        max_sec (float, optional): 待機秒数の上限. Defaults to CONNECT_BACKOFF_MAX_SEC.
+
+    Returns:
+        float: 待機秒数
+    """
+    return random.uniform(0, min(max_sec, base_sec * 2 ** attempt))
+
+
 def connection_builder(
     config,
+    client_bootstrap: io.ClientBootstrap = None,
+    on_connection_interrupted=None,
+    on_connection_resumed=None,
 ) -> mqtt_connection_builder:
     """mqtt接続の確立
 
     Args:
         config (dict): 証明書などの設定
+        client_bootstrap (io.ClientBootstrap, optional): 共有するbootstrap. Defaults to None (新しく作成).
+        on_connection_interrupted (, optional): 接続が切れたときに呼び出すcallback関数. Defaults to None.
+        on_connection_resumed (, optional): 自動再接続したときに呼び出すcallback関数. Defaults to None.
 
     Returns:
         mqtt_connection_builder: mqtt接続
     """
+    mqtt_connection = None
     try:
         # 設定
         client_id = __make_client_id()
 
-        event_loop_group = io.EventLoopGroup(1)
-        host_resolver = io.DefaultHostResolver(
-            event_loop_group=event_loop_group)
-        client_bootstrap = io.ClientBootstrap(
-            event_loop_group=event_loop_group, host_resolver=host_resolver
-        )
+        if client_bootstrap is None:
+            client_bootstrap = make_client_bootstrap()
 
         # 接続
         mqtt_connection = mqtt_connection_builder.mtls_from_path(
@@ -56,19 +103,197 @@ def connection_builder(
             client_id=client_id,
             clean_session=False,
             keep_alive_secs=6,
+            reconnect_min_timeout_secs=random.randint(RECONNECT_MIN_TIMEOUT_SEC, RECONNECT_MIN_TIMEOUT_JITTER_SEC),
+            reconnect_max_timeout_secs=RECONNECT_MAX_TIMEOUT_SEC,
+            on_connection_interrupted=on_connection_interrupted,
+            on_connection_resumed=on_connection_resumed,
         )
         # 接続確認
         connection_feature = mqtt_connection.connect()
-        connection_feature.result()
+        connection_feature.result(timeout=MQTT_TIMEOUT_SEC)
 
         return mqtt_connection
 
     except:
         job_logger.error(traceback.format_exc())
+        if mqtt_connection is not None:
+            # タイムアウトした接続はバックグラウンドで接続を続けるため、破棄する前に切断する
+            try:
+                mqtt_connection.disconnect()
+            except Exception:
+                job_logger.error(traceback.format_exc())
         raise
 
 
 def disconnection(mqtt_connection):
     """mqtt_connectionの切断"""
     disconnection_feature = mqtt_connection.disconnect()
-    disconnection_feature.result()
+    disconnection_feature.result(timeout=MQTT_TIMEOUT_SEC)
+
+
+class MqttConnectionManager:
+    """プロセス内で1つのmqtt接続を共有する
+    セットアップとdownstreamで同じ接続を使い、切り替えの間も接続を維持する
+
+    接続が切れた場合はawscrtが自動で再接続する。再接続時にサーバー側のセッションが
+    失われていればsubscribe済みのtopicを再度subscribeし、登録された関数を呼び出す
+    """
+
+    def __init__(self, config: dict, max_attempts: int = CONNECT_MAX_ATTEMPTS):
+        """
+        Args:
+            config (dict): 証明書などの設定
+            max_attempts (int, optional): 初回接続の最大試行回数. Defaults to CONNECT_MAX_ATTEMPTS.
+        """
+        self.__config = config
+        self.__max_attempts = max_attempts
+        self.__lock = threading.Lock()
+        self.__client_bootstrap = None
+        self.__mqtt_connection = None
+        self.__resume_listeners = []
+
+        # 計測値 (接続断・再接続のcallbackはawscrtのスレッドから呼ばれるため別のロックで保護する)
+        self.__metrics_lock = threading.Lock()
+        self.__connect_count = 0
+        self.__connect_attempts = 0
+        self.__last_connect_sec = None
+        self.__total_connect_sec = 0.0
+        self.__interrupted_at = None
+        self.__interrupt_count = 0
+        self.__recover_count = 0
+        self.__last_recover_sec = None
+        self.__max_recover_sec = None
+        self.__total_recover_sec = 0.0
+
+    def get_connection(self):
+        """接続を取得する。未接続の場合は接続する
+
+        Returns:
+            mqtt.Connection: mqtt接続
+        """
+        with self.__lock:
+            if self.__mqtt_connection is None:
+                if self.__client_bootstrap is None:
+                    self.__client_bootstrap = make_client_bootstrap()
+
+                started_at = time.perf_counter()
+                self.__mqtt_connection = self.__connect()
+                connect_sec = time.perf_counter() - started_at
+
+                with self.__metrics_lock:
+                    self.__connect_count += 1
+                    self.__last_connect_sec = connect_sec
+                    self.__total_connect_sec += connect_sec
+                job_logger.info("MQTT connected in %.3f sec", connect_sec)
+
+            return self.__mqtt_connection
+
+    def __connect(self):
+        """失敗した場合は待機時間を延ばしながら再試行して接続する"""
+        for attempt in range(self.__max_attempts):
+            with self.__metrics_lock:
+                self.__connect_attempts += 1
+            try:
+                return connection_builder(
+                    config=self.__config,
+                    client_bootstrap=self.__client_bootstrap,
+                    on_connection_interrupted=self.__callback_connection_interrupted,
+                    on_connection_resumed=self.__callback_connection_resumed,
+                )
+            except Exception:
+                if attempt + 1 >= self.__max_attempts:
+                    raise
+                delay = backoff_delay(attempt)
+                job_logger.info("Retry MQTT connect in %.1f sec (%d/%d)", delay, attempt + 1, self.__max_attempts)
+                time.sleep(delay)
+
+    def add_resume_listener(self, callback):
+        """再接続(再subscribeの完了)後に呼び出す関数を登録する
+        NOTE: awscrtのスレッドから呼ばれるため、callback内で応答を待たないこと
+
+        Args:
+            callback (): 呼び出す関数 (引数なし)
+        """
+        self.__resume_listeners.append(callback)
+
+    def __callback_connection_interrupted(self, connection, error, **kwargs):
+        """接続が切れた (awscrtが自動で再接続する)"""
+        job_logger.error("MQTT connection interrupted: %s", error)
+        with self.__metrics_lock:
+            if self.__interrupted_at is None:
+                self.__interrupted_at = time.monotonic()
+            self.__interrupt_count += 1
+
+    def __callback_connection_resumed(self, connection, return_code, session_present, **kwargs):
+        """再接続した。セッションが失われていれば再subscribeする"""
+        job_logger.info("MQTT connection resumed: return_code=%s, session_present=%s", return_code, session_present)
+        if return_code != mqtt.ConnectReturnCode.ACCEPTED:
+            return
+
+        if session_present:
+            # サーバー側にsubscriptionが残っている
+            self.__finish_recover()
+            return
+
+        resubscribe_future, _ = connection.resubscribe_existing_topics()
+        resubscribe_future.add_done_callback(self.__callback_resubscribed)
+
+    def __callback_resubscribed(self, resubscribe_future):
+        """再subscribeの完了"""
+        try:
+            result = resubscribe_future.result()
+            failed_topics = [topic for topic, qos in result["topics"] if qos is None]
+            if failed_topics:
+                job_logger.error("Resubscribe rejected: %s", failed_topics)
+        except Exception:
+            job_logger.error(traceback.format_exc())
+
+        self.__finish_recover()
+
+    def __finish_recover(self):
+        """接続断からの復旧時間を記録し、登録された関数を呼び出す"""
+        with self.__metrics_lock:
+            if self.__interrupted_at is not None:
+                recover_sec = time.monotonic() - self.__interrupted_at
+                self.__interrupted_at = None
+                self.__recover_count += 1
+                self.__last_recover_sec = recover_sec
+                self.__total_recover_sec += recover_sec
+                self.__max_recover_sec = max(self.__max_recover_sec or 0.0, recover_sec)
+                job_logger.info("MQTT connection recovered in %.3f sec", recover_sec)
+
+        for listener in list(self.__resume_listeners):
+            try:
+                listener()
+            except Exception:
+                job_logger.error(traceback.format_exc())
+
+    def disconnect(self):
+        """接続を切断する"""
+        with self.__lock:
+            if self.__mqtt_connection is None:
+                return
+            mqtt_connection = self.__mqtt_connection
+            self.__mqtt_connection = None
+        disconnection(mqtt_connection)
+
+    def metrics(self) -> dict:
+        """接続時間・復旧時間の計測値
+
+        Returns:
+            dict: connect_count(接続回数), connect_attempts(接続の試行回数), last_connect_sec(直近の接続時間),
+                total_connect_sec(接続時間の合計), interrupt_count(接続断の回数), recover_count(復旧回数),
+                last_recover_sec(直近の復旧時間), max_recover_sec(最大の復旧時間), total_recover_sec(復旧時間の合計)
+        """
+        with self.__metrics_lock:
+            return {
+                "connect_count": self.__connect_count,
+                "connect_attempts": self.__connect_attempts,
+                "last_connect_sec": self.__last_connect_sec,
+                "total_connect_sec": self.__total_connect_sec,
+                "interrupt_count": self.__interrupt_count,
+                "recover_count": self.__recover_count,
+                "last_recover_sec": self.__last_recover_sec,
+                "max_recover_sec": self.__max_recover_sec,
+                "total_recover_sec": self.__total_recover_sec,
+            }
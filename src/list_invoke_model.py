@@ -1,11 +1,10 @@
-import boto3
+from model_catalog import ModelCatalog
 
 
-def display_invoke_model_list(profile: str, region: str):
-    session = boto3.Session(profile_name=profile, region_name=region)
-    bedrock = session.client('bedrock')
+def display_invoke_model_list(profile: str, region: str, refresh: bool = False):
+    catalog = ModelCatalog(profile=profile, region=region)
 
     print("List of modelId")
-    for model in bedrock.list_foundation_models().get('modelSummaries'):
+    for model in catalog.summaries(refresh=refresh):
         print(model.get('modelId'))
-    print("-------------------------")
\ No newline at end of file
+    print("-------------------------")
@@ -0,0 +1,311 @@
+"""
+モデルファミリーごとのリクエスト・レスポンス形式の差異を吸収するアダプタ
+
+adapter = get_adapter(model_id)
+    body = adapter.build_body(prompt, max_tokens=300)
+    text = adapter.parse_response(payload)
+    delta = adapter.parse_stream_chunk(payload)
+    usage = adapter.usage(payload, headers)
+    adapter.is_deterministic(body)
+"""
+import json
+import threading
+
+# invoke_modelのレスポンスヘッダに含まれるトークン数
+INPUT_TOKEN_HEADER = 'x-amzn-bedrock-input-token-count'
+OUTPUT_TOKEN_HEADER = 'x-amzn-bedrock-output-token-count'
+
+
+class ModelAdapter:
+    """アダプタの基底クラス
+    familyはモデルIDの前方一致で使うプレフィックス
+    """
+
+    family = ''
+
+    def build_body(self, prompt: str, max_tokens: int = 300, temperature: float = None) -> dict:
+        """リクエストボディを作成する
+
+        Args:
+            prompt (str): プロンプト
+            max_tokens (int, optional): 生成する最大トークン数. Defaults to 300.
+            temperature (float, optional): 温度. Defaults to None (モデルの既定値).
+
+        Returns:
+            dict: リクエストボディ
+        """
+        raise NotImplementedError
+
+    def parse_response(self, payload: dict) -> str:
+        """invoke_modelのレスポンスから生成テキストを取り出す
+
+        Args:
+            payload (dict): レスポンスボディ
+
+        Returns:
+            str: 生成テキスト
+        """
+        raise NotImplementedError
+
+    def parse_stream_chunk(self, payload: dict) -> str:
+        """ストリーミングの1チャンクから生成テキストの差分を取り出す
+
+        Args:
+            payload (dict): チャンクのボディ
+
+        Returns:
+            str: 生成テキストの差分 (含まない場合は空文字)
+        """
+        raise NotImplementedError
+
+    def temperature(self, body: dict):
+        """リクエストボディに指定された温度 (未指定の場合はNone)"""
+        return body.get('temperature')
+
+    def is_deterministic(self, body: dict) -> bool:
+        """同じリクエストに対して同じ結果が返る設定か判定する
+        温度が0の場合のみ決定的とみなす (未指定はモデルの既定値が0でないため対象外)
+
+        Args:
+            body (dict): リクエストボディ
+
+        Returns:
+            bool: 決定的な場合True
+        """
+        return self.temperature(body) == 0
+
+    def body_usage(self, payload: dict) -> dict:
+        """レスポンスボディに含まれるトークン数 (モデル固有の形式)"""
+        return {}
+
+    def usage(self, payload: dict = None, headers: dict = None) -> dict:
+        """トークン使用量を取得する
+        ヘッダ, ストリーミング最終チャンクのinvocationMetrics, モデル固有の形式の順に参照する
+
+        Args:
+            payload (dict, optional): レスポンスボディまたはチャンクのボディ. Defaults to None.
+            headers (dict, optional): レスポンスのHTTPヘッダ. Defaults to None.
+
+        Returns:
+            dict: input_tokens, output_tokens (取得できない項目はNone)
+        """
+        headers = headers or {}
+        if INPUT_TOKEN_HEADER in headers:
+            return {
+                'input_tokens': int(headers[INPUT_TOKEN_HEADER]),
+                'output_tokens': int(headers.get(OUTPUT_TOKEN_HEADER, 0)),
+            }
+
+        payload = payload or {}
+        metrics = payload.get('amazon-bedrock-invocationMetrics')
+        if metrics:
+            return {
+                'input_tokens': metrics.get('inputTokenCount'),
+                'output_tokens': metrics.get('outputTokenCount'),
+            }
+
+        usage = {'input_tokens': None, 'output_tokens': None}
+        usage.update(self.body_usage(payload))
+        return usage
+
+
+class ClaudeAdapter(ModelAdapter):
+    """Anthropic Claude (Text Completions API)"""
+
+    family = 'anthropic.claude'
+
+    def build_body(self, prompt, max_tokens=300, temperature=None):
+        body = {
+            'prompt': '\n\nHuman: ' + prompt + '\n\nAssistant:',
+            'max_tokens_to_sample': max_tokens,
+        }
+        if temperature is not None:
+            body['temperature'] = temperature
+        return body
+
+    def parse_response(self, payload):
+        return payload.get('completion', '')
+
+    def parse_stream_chunk(self, payload):
+        return payload.get('completion', '')
+
+
+class Jurassic2Adapter(ModelAdapter):
+    """AI21 Labs Jurassic-2 (ストリーミング非対応)"""
+
+    family = 'ai21.j2'
+
+    def build_body(self, prompt, max_tokens=300, temperature=None):
+        body = {'prompt': prompt, 'maxTokens': max_tokens}
+        if temperature is not None:
+            body['temperature'] = temperature
+        return body
+
+    def parse_response(self, payload):
+        return payload.get('completions')[0].get('data').get('text')
+
+    def parse_stream_chunk(self, payload):
+        raise Exception(f"Streaming is not supported: {self.family}")
+
+    def body_usage(self, payload):
+        if 'prompt' not in payload:
+            return {}
+        return {
+            'input_tokens': len(payload['prompt'].get('tokens', [])),
+            'output_tokens': sum(len(c['data'].get('tokens', [])) for c in payload.get('completions', [])),
+        }
+
+
+class TitanTextAdapter(ModelAdapter):
+    """Amazon Titan Text"""
+
+    family = 'amazon.titan-text'
+
+    def build_body(self, prompt, max_tokens=300, temperature=None):
+        config = {'maxTokenCount': max_tokens}
+        if temperature is not None:
+            config['temperature'] = temperature
+        return {'inputText': prompt, 'textGenerationConfig': config}
+
+    def temperature(self, body):
+        return body.get('textGenerationConfig', {}).get('temperature')
+
+    def parse_response(self, payload):
+        return payload.get('results')[0].get('outputText')
+
+    def parse_stream_chunk(self, payload):
+        return payload.get('outputText', '')
+
+    def body_usage(self, payload):
+        if 'inputTextTokenCount' not in payload:
+            return {}
+        results = payload.get('results')
+        output_tokens = results[0].get('tokenCount') if results else payload.get('totalOutputTextTokenCount')
+        return {'input_tokens': payload['inputTextTokenCount'], 'output_tokens': output_tokens}
+
+
+class Llama2Adapter(ModelAdapter):
+    """Meta Llama 2"""
+
+    family = 'meta.llama2'
+
+    def build_body(self, prompt, max_tokens=300, temperature=None):
+        body = {'prompt': prompt, 'max_gen_len': max_tokens}
+        if temperature is not None:
+            body['temperature'] = temperature
+        return body
+
+    def parse_response(self, payload):
+        return payload.get('generation', '')
+
+    def parse_stream_chunk(self, payload):
+        return payload.get('generation', '')
+
+    def body_usage(self, payload):
+        if 'prompt_token_count' not in payload:
+            return {}
+        return {
+            'input_tokens': payload['prompt_token_count'],
+            'output_tokens': payload.get('generation_token_count'),
+        }
+
+
+class CohereCommandAdapter(ModelAdapter):
+    """Cohere Command"""
+
+    family = 'cohere.command'
+
+    def build_body(self, prompt, max_tokens=300, temperature=None):
+        body = {'prompt': prompt, 'max_tokens': max_tokens}
+        if temperature is not None:
+            body['temperature'] = temperature
+        return body
+
+    def parse_response(self, payload):
+        return payload.get('generations')[0].get('text')
+
+    def parse_stream_chunk(self, payload):
+        if 'generations' in payload:
+            return payload['generations'][0].get('text', '')
+        return payload.get('text', '')
+
+
+_ADAPTERS = {}
+_resolved = {}
+_lock = threading.Lock()
+
+
+def register_adapter(adapter: ModelAdapter):
+    """アダプタを登録する
+
+    Args:
+        adapter (ModelAdapter): 登録するアダプタ
+    """
+    with _lock:
+        _ADAPTERS[adapter.family] = adapter
+        # プレフィックスの対応が変わるため解決済みの結果を破棄する
+        _resolved.clear()
+
+
+def get_adapter(model_id: str) -> ModelAdapter:
+    """モデルIDに対応するアダプタを取得する
+    モデルIDごとの解決結果は保持し、2回目以降は辞書の参照のみで返す
+
+    Args:
+        model_id (str): モデルID (例: anthropic.claude-v2)
+
+    Returns:
+        ModelAdapter: アダプタ
+    """
+    adapter = _resolved.get(model_id)
+    if adapter is not None:
+        return adapter
+
+    with _lock:
+        # 最長のプレフィックスに一致するファミリーを選ぶ
+        matches = [family for family in _ADAPTERS if model_id.startswith(family)]
+        if not matches:
+            raise Exception(f"Not supported model: {model_id}")
+        adapter = _ADAPTERS[max(matches, key=len)]
+        _resolved[model_id] = adapter
+        return adapter
+
+
+def read_payload(body) -> dict:
+    """レスポンスボディを読み込みJSONとして解析する
+    bytesのまま解析し、文字列へのデコードを挟まない
+
+    Args:
+        body: invoke_modelのレスポンスのbody (StreamingBody)
+
+    Returns:
+        dict: 解析したボディ
+    """
+    return json.loads(body.read())
+
+
+def invoke_text(bedrock, model_id: str, prompt: str, max_tokens: int = 300, temperature: float = None) -> tuple:
+    """アダプタを使ってテキスト生成を実行する
+
+    Args:
+        bedrock (boto3.client): bedrock-runtimeのクライアント
+        model_id (str): モデルID
+        prompt (str): プロンプト
+        max_tokens (int, optional): 生成する最大トークン数. Defaults to 300.
+        temperature (float, optional): 温度. Defaults to None.
+
+    Returns:
+        tuple: (生成テキスト, トークン使用量)
+    """
+    adapter = get_adapter(model_id)
+    response = bedrock.invoke_model(
+        modelId=model_id,
+        body=json.dumps(adapter.build_body(prompt, max_tokens=max_tokens, temperature=temperature)),
+    )
+    payload = read_payload(response.get('body'))
+    headers = response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+    return adapter.parse_response(payload), adapter.usage(payload, headers)
+
+
+for _adapter in (ClaudeAdapter(), Jurassic2Adapter(), TitanTextAdapter(), Llama2Adapter(), CohereCommandAdapter()):
+    register_adapter(_adapter)
@@ -0,0 +1,163 @@
+"""
+Bedrockの基盤モデル一覧をディスクにキャッシュして参照する
+list_foundation_modelsの呼び出しはTTLが切れた場合のみ行う
+"""
+import json
+import os
+import threading
+import time
+
+from client_factory import get_client
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "bedrock_sample")
+
+
+class ModelCatalog:
+    """基盤モデル一覧 (modelSummaries) のキャッシュ"""
+
+    def __init__(self, profile: str, region: str, cache_path: str = None, ttl_sec: float = 24 * 60 * 60):
+        """
+        Args:
+            profile (str): AWS profile名
+            region (str): AWS region名
+            cache_path (str, optional): キャッシュファイルのパス. Defaults to ~/.cache/bedrock_sample/model_catalog_{profile}_{region}.json.
+            ttl_sec (float, optional): キャッシュの有効期間(秒). Defaults to 1日.
+        """
+        self.profile = profile
+        self.region = region
+        self.cache_path = cache_path or os.path.join(
+            DEFAULT_CACHE_DIR, f"model_catalog_{profile}_{region}.json")
+        self.ttl_sec = ttl_sec
+
+        self._lock = threading.Lock()
+        self._summaries = None
+        self._by_id = {}
+
+    def __fetch(self) -> list:
+        """Bedrockから基盤モデル一覧を取得する"""
+        bedrock = get_client('bedrock', profile=self.profile, region=self.region)
+        return bedrock.list_foundation_models().get('modelSummaries', [])
+
+    def __load_cache(self):
+        """有効期限内のキャッシュがあれば読み込む
+
+        Returns:
+            list: モデル一覧 (キャッシュがない・期限切れの場合はNone)
+        """
+        if not os.path.exists(self.cache_path):
+            return None
+
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if time.time() - cache.get("fetched_at", 0) > self.ttl_sec:
+            return None
+        return cache.get("modelSummaries")
+
+    def __save_cache(self, summaries: list):
+        """モデル一覧をキャッシュファイルに保存する"""
+        directory = os.path.dirname(self.cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"fetched_at": time.time(), "modelSummaries": summaries}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.cache_path)
+
+    def summaries(self, refresh: bool = False) -> list:
+        """基盤モデル一覧を取得する
+
+        Args:
+            refresh (bool, optional): キャッシュを使わずに取得し直す. Defaults to False.
+
+        Returns:
+            list: modelSummaries
+        """
+        with self._lock:
+            if self._summaries is None or refresh:
+                summaries = None if refresh else self.__load_cache()
+                if summaries is None:
+                    summaries = self.__fetch()
+                    self.__save_cache(summaries)
+
+                self._summaries = summaries
+                self._by_id = {summary.get('modelId'): summary for summary in summaries}
+
+            return self._summaries
+
+    def model_ids(self) -> list:
+        """モデルID一覧
+
+        Returns:
+            list: モデルID一覧
+        """
+        return [summary.get('modelId') for summary in self.summaries()]
+
+    def get(self, model_id: str):
+        """モデルIDに対応する情報を取得する
+
+        Args:
+            model_id (str): モデルID
+
+        Returns:
+            dict: モデル情報 (存在しない場合はNone)
+        """
+        self.summaries()
+        return self._by_id.get(model_id)
+
+    def by_provider(self, provider: str) -> list:
+        """提供元でモデルを絞り込む
+
+        Args:
+            provider (str): 提供元 (例: Anthropic, Amazon). 大文字小文字は区別しない
+
+        Returns:
+            list: モデル情報一覧
+        """
+        provider = provider.lower()
+        return [summary for summary in self.summaries() if summary.get('providerName', '').lower() == provider]
+
+    def by_modality(self, input_modality: str = None, output_modality: str = None) -> list:
+        """入出力の種類でモデルを絞り込む
+
+        Args:
+            input_modality (str, optional): 入力の種類 (TEXT, IMAGE等). Defaults to None.
+            output_modality (str, optional): 出力の種類 (TEXT, IMAGE, EMBEDDING等). Defaults to None.
+
+        Returns:
+            list: モデル情報一覧
+        """
+        return [
+            summary for summary in self.summaries()
+            if (input_modality is None or input_modality in summary.get('inputModalities', []))
+            and (output_modality is None or output_modality in summary.get('outputModalities', []))
+        ]
+
+    def streaming_models(self) -> list:
+        """レスポンスのストリーミングに対応したモデル
+
+        Returns:
+            list: モデル情報一覧
+        """
+        return [summary for summary in self.summaries() if summary.get('responseStreamingSupported')]
+
+    def validate(self, model_id: str, streaming: bool = False) -> dict:
+        """モデルIDが利用可能か確認する
+
+        Args:
+            model_id (str): モデルID
+            streaming (bool, optional): ストリーミング対応も確認する. Defaults to False.
+
+        Returns:
+            dict: モデル情報
+        """
+        summary = self.get(model_id)
+        if summary is None:
+            raise Exception(f"Not supported model: {model_id}")
+        if streaming and not summary.get('responseStreamingSupported'):
+            raise Exception(f"Streaming is not supported: {model_id}")
+        return summary
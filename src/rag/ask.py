@@ -0,0 +1,208 @@
+"""
+保存済みのFAISS indexを検索し、その内容をもとにClaudeで回答を生成する
+質問のembeddingとindexの読み込みは並行して行う
+回答の生成と同じクライアントでembeddingするため、リトライはクライアント (botocore) に任せ、
+embeddingの自前の再試行は行わない
+"""
+import sys
+sys.path.append("../")
+
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from batch_embedding import BatchEmbedder
+from client_factory import get_client
+from model_adapters import get_adapter
+
+EMBEDDING_MODEL_ID = "amazon.titan-embed-text-v1"
+
+PROMPT_TEMPLATE = """以下の資料を参考に質問に答えてください。資料に記載がない場合は、わからないと答えてください。
+
+<documents>
+{context}
+</documents>
+
+質問: {question}"""
+
+
+def estimate_tokens(text: str) -> int:
+    """テキストのトークン数を概算する
+    ASCII文字は4文字で1トークン、それ以外の文字(日本語等)は1文字1トークンとみなす
+
+    Args:
+        text (str): テキスト
+
+    Returns:
+        int: 概算のトークン数
+    """
+    ascii_chars = sum(1 for c in text if c.isascii())
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def build_context(hits: list, max_tokens: int) -> tuple:
+    """検索結果を距離の近い順に、トークン数の上限まで連結する
+
+    Args:
+        hits (list): (Document, 距離) のリスト
+        max_tokens (int): コンテキストのトークン数の上限
+
+    Returns:
+        tuple: (コンテキスト, 使用した資料のmetadata一覧, 概算のトークン数)
+    """
+    parts, sources = [], []
+    used_tokens = 0
+    for document, _ in hits:
+        metadata = document.metadata
+        part = f"<document source=\"{os.path.basename(str(metadata.get('source', '')))}\" page=\"{metadata.get('page', '')}\">\n{document.page_content}\n</document>"
+        tokens = estimate_tokens(part)
+        if used_tokens + tokens > max_tokens:
+            # 順位を崩さないよう、収まらない資料以降は使わない
+            break
+        parts.append(part)
+        sources.append(metadata)
+        used_tokens += tokens
+    return "\n".join(parts), sources, used_tokens
+
+
+def _load_retriever(save_folder: str, bedrock_runtime):
+    """indexを読み込む (faiss等のimportも含めて別スレッドで行う)"""
+    from retrieval import Retriever
+
+    started_at = time.perf_counter()
+    retriever = Retriever(
+        save_folder=save_folder, bedrock_runtime=bedrock_runtime, model_id=EMBEDDING_MODEL_ID, max_retries=0)
+    return retriever, time.perf_counter() - started_at
+
+
+def _embed_question(question: str, bedrock_runtime):
+    """質問をembeddingする"""
+    started_at = time.perf_counter()
+    embedder = BatchEmbedder(bedrock_runtime=bedrock_runtime, model_id=EMBEDDING_MODEL_ID, max_concurrency=1, max_retries=0)
+    vector = embedder.embed_texts([question])[0]
+    return vector, time.perf_counter() - started_at
+
+
+def ask(
+    question: str,
+    save_folder: str,
+    bedrock_runtime=None,
+    retriever=None,
+    k: int = 4,
+    context_tokens: int = 2000,
+    model_id: str = "anthropic.claude-v2",
+    max_tokens: int = 500,
+    temperature: float = 0,
+    on_delta=None,
+) -> dict:
+    """indexを検索して回答を生成する
+
+    Args:
+        question (str): 質問
+        save_folder (str): indexの保存先のパス
+        bedrock_runtime (boto3.client, optional): bedrock-runtimeのクライアント. Defaults to AWS_PROFILE, AWS_REGIONから作成.
+        retriever (Retriever, optional): 読み込み済みのRetriever (指定時はindexを読み込まない). Defaults to None.
+        k (int, optional): 検索件数. Defaults to 4.
+        context_tokens (int, optional): コンテキストのトークン数の上限. Defaults to 2000.
+        model_id (str, optional): 回答を生成するモデルID. Defaults to "anthropic.claude-v2".
+        max_tokens (int, optional): 生成する最大トークン数. Defaults to 500.
+        temperature (float, optional): 温度. Defaults to 0.
+        on_delta (callable, optional): 生成テキストの差分を受け取る関数. Defaults to None.
+
+    Returns:
+        dict: answer, sources, timings(各段階の秒数)
+    """
+    started_at = time.perf_counter()
+    timings = {}
+
+    if bedrock_runtime is None:
+        bedrock_runtime = get_client(
+            "bedrock-runtime", profile=os.environ.get("AWS_PROFILE"), region=os.environ.get("AWS_REGION"))
+
+    # 読み込み済みのRetrieverがない場合は、indexの読み込みと質問のembeddingを並行して行う
+    if retriever is None:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            retriever_future = executor.submit(_load_retriever, save_folder, bedrock_runtime)
+            vector_future = executor.submit(_embed_question, question, bedrock_runtime)
+            vector, timings["embed_query_sec"] = vector_future.result()
+            retriever, timings["load_index_sec"] = retriever_future.result()
+        vectors = [vector]
+    else:
+        embed_started_at = time.perf_counter()
+        vectors = retriever.embed_queries([question])
+        timings["embed_query_sec"] = time.perf_counter() - embed_started_at
+        timings["load_index_sec"] = 0.0
+    timings["prepare_sec"] = time.perf_counter() - started_at
+
+    search_started_at = time.perf_counter()
+    hits = retriever.search_by_vectors(vectors, k=k)[0]
+    timings["search_sec"] = time.perf_counter() - search_started_at
+
+    assemble_started_at = time.perf_counter()
+    context, sources, used_tokens = build_context(hits, context_tokens)
+    prompt = PROMPT_TEMPLATE.format(context=context, question=question)
+    timings["assemble_context_sec"] = time.perf_counter() - assemble_started_at
+
+    adapter = get_adapter(model_id)
+    body = json.dumps(adapter.build_body(prompt, max_tokens=max_tokens, temperature=temperature))
+
+    generate_started_at = time.perf_counter()
+    first_token_at = None
+    answer = []
+    usage = None
+    response = bedrock_runtime.invoke_model_with_response_stream(modelId=model_id, body=body)
+    for event in response.get('body'):
+        chunk = event.get('chunk')
+        if not chunk:
+            continue
+        payload = json.loads(chunk.get('bytes'))
+        delta = adapter.parse_stream_chunk(payload)
+        if delta:
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            answer.append(delta)
+            if on_delta is not None:
+                on_delta(delta)
+        if 'amazon-bedrock-invocationMetrics' in payload:
+            usage = adapter.usage(payload)
+    finished_at = time.perf_counter()
+
+    timings["time_to_first_token_sec"] = first_token_at - generate_started_at if first_token_at is not None else None
+    timings["generate_sec"] = finished_at - generate_started_at
+    timings["total_sec"] = finished_at - started_at
+
+    return {
+        "answer": "".join(answer),
+        "sources": sources,
+        "context_tokens": used_tokens,
+        "usage": usage,
+        "timings": {name: round(value, 4) if value is not None else None for name, value in timings.items()},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--question", dest = "question", required = True, type = str, help = "質問")
+    parser.add_argument("--save-folder", dest = "save_folder", default="./files", type = str, help = "indexの保存先のパス")
+    parser.add_argument("--k", dest = "k", default=4, type = int, help = "検索件数")
+    parser.add_argument("--context-tokens", dest = "context_tokens", default=2000, type = int, help = "コンテキストのトークン数の上限")
+    parser.add_argument("--model-id", dest = "model_id", default="anthropic.claude-v2", type = str, help = "回答を生成するモデルID")
+    parser.add_argument("--max-tokens", dest = "max_tokens", default=500, type = int, help = "生成する最大トークン数")
+    parser.add_argument("--profile", dest = "profile", default="atl", type = str, help = "aws profile")
+    parser.add_argument("--region", dest = "region", default="us-west-2", type = str, help = "aws region")
+    args = parser.parse_args()
+
+    result = ask(
+        question = args.question,
+        save_folder = args.save_folder,
+        bedrock_runtime = get_client("bedrock-runtime", profile = args.profile, region = args.region),
+        k = args.k,
+        context_tokens = args.context_tokens,
+        model_id = args.model_id,
+        max_tokens = args.max_tokens,
+        on_delta = lambda delta: print(delta, end = "", flush = True),
+    )
+    print()
+    print(json.dumps({name: value for name, value in result.items() if name != "answer"}, ensure_ascii = False, indent = 2))
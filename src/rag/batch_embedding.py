@@ -0,0 +1,125 @@
+"""
+Bedrockのembeddingモデルをスレッドプールで並列に呼び出す
+"""
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from bedrock_errors import is_throttling_error
+from embedding_cache import make_cache_key
+
+
+class BatchEmbedder:
+    """チャンクのリストを並列にembeddingする
+    結果は入力と同じ順序で返す
+    """
+
+    def __init__(
+        self,
+        bedrock_runtime,
+        model_id: str = "amazon.titan-embed-text-v1",
+        max_concurrency: int = 8,
+        max_retries: int = 8,
+        base_delay: float = 0.5,
+        max_delay: float = 20.0,
+        cache=None,
+    ):
+        """
+        Args:
+            bedrock_runtime (boto3.client): bedrock-runtimeのクライアント
+            model_id (str, optional): embeddingモデルID. Defaults to "amazon.titan-embed-text-v1".
+            max_concurrency (int, optional): 同時リクエスト数の上限. Defaults to 8.
+            max_retries (int, optional): スロットリング時の最大リトライ回数. Defaults to 8.
+            base_delay (float, optional): バックオフの初期待機秒数. Defaults to 0.5.
+            max_delay (float, optional): バックオフの最大待機秒数. Defaults to 20.0.
+            cache (EmbeddingCache, optional): embeddingのキャッシュ. Defaults to None.
+        """
+        self.bedrock_runtime = bedrock_runtime
+        self.model_id = model_id
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.cache = cache
+
+        # スロットリングによるリトライ回数
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def _invoke(self, text: str) -> list:
+        """1チャンク分のembeddingを取得する
+        スロットリング時はexponential backoff + full jitterで再試行する
+
+        Args:
+            text (str): チャンクのテキスト
+
+        Returns:
+            list: embeddingベクトル
+        """
+        body = json.dumps({"inputText": text})
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.bedrock_runtime.invoke_model(
+                    modelId=self.model_id,
+                    body=body,
+                    accept="application/json",
+                    contentType="application/json",
+                )
+                return json.loads(response.get("body").read()).get("embedding")
+
+            except ClientError as error:
+                if not is_throttling_error(error) or attempt == self.max_retries:
+                    raise
+                with self._lock:
+                    self.throttled += 1
+                delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+                time.sleep(random.uniform(0, delay))
+
+    def embed_texts(self, texts: list) -> list:
+        """テキストのリストをembeddingする
+
+        Args:
+            texts (list): チャンクのテキスト一覧
+
+        Returns:
+            list: 入力順のembeddingベクトル一覧
+        """
+        if not texts:
+            return []
+
+        if self.cache is None:
+            return self._embed_uncached(texts)
+
+        keys = [make_cache_key(self.model_id, text) for text in texts]
+        vectors = self.cache.get_many(keys)
+
+        # キャッシュにないチャンクのみBedrockに問い合わせる (同一テキストは1回のみ)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+
+        if missing:
+            new_vectors = dict(zip(missing.keys(), self._embed_uncached(list(missing.values()))))
+            self.cache.put_many(new_vectors)
+            vectors.update(new_vectors)
+
+        return [vectors[key] for key in keys]
+
+    def _embed_uncached(self, texts: list) -> list:
+        """キャッシュを使わずにBedrockへ並列に問い合わせる
+
+        Args:
+            texts (list): チャンクのテキスト一覧
+
+        Returns:
+            list: 入力順のembeddingベクトル一覧
+        """
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(texts))) as executor:
+            # mapは入力順に結果を返す
+            return list(executor.map(self._invoke, texts))
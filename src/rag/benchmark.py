@@ -0,0 +1,245 @@
+"""
+embedding()のベンチマーク
+Bedrockの代わりに決定的なベクトルを返すローカルのクライアントを使うため、ネットワーク不要で実行できる
+最大RSSを実行ごとに計測するため、各ページ数のembedding()は新しいプロセスで実行する
+"""
+import sys
+sys.path.append("../")
+
+import os
+import io
+import json
+import multiprocessing
+import random
+import resource
+import shutil
+import tempfile
+import threading
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from botocore.exceptions import ClientError
+
+from embedding import embedding
+
+WORDS = (
+    "service agreement customer data account license term privacy content "
+    "software update payment support security notice law dispute microsoft "
+    "user device access policy right obligation liability warranty"
+).split()
+
+
+class FakeBedrockRuntime:
+    """bedrock-runtimeのinvoke_modelを模したクライアント
+    同じテキストには常に同じベクトルを返す
+    """
+
+    def __init__(self, dimension: int = 1536, latency: float = 0.05, throttle_rate: float = 0.0, seed: int = 0):
+        """
+        Args:
+            dimension (int, optional): ベクトルの次元数. Defaults to 1536.
+            latency (float, optional): 1リクエストあたりの応答時間(秒). Defaults to 0.05.
+            throttle_rate (float, optional): ThrottlingExceptionを返す確率. Defaults to 0.0.
+            seed (int, optional): スロットリング発生の乱数シード. Defaults to 0.
+        """
+        self.dimension = dimension
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+
+        self.calls = 0
+        self.throttled = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def invoke_model(self, modelId: str, body: str, **kwargs) -> dict:
+        """titan embeddingの応答を返す
+
+        Args:
+            modelId (str): モデルID
+            body (str): リクエストボディ
+
+        Returns:
+            dict: invoke_modelと同じ形式の応答
+        """
+        time.sleep(self.latency)
+
+        with self._lock:
+            self.calls += 1
+            is_throttled = self._random.random() < self.throttle_rate
+            if is_throttled:
+                self.throttled += 1
+
+        if is_throttled:
+            raise ClientError(
+                {"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}, "InvokeModel")
+
+        text = json.loads(body)["inputText"]
+        seed = int.from_bytes(hashlib.sha256(f"{modelId}\0{text}".encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+        vector /= np.linalg.norm(vector)
+
+        payload = json.dumps({"embedding": vector.tolist(), "inputTextTokenCount": len(text.split())})
+        return {"body": io.BytesIO(payload.encode("utf-8"))}
+
+
+def _escape_pdf_text(text: str) -> str:
+    """pdfの文字列リテラル用にエスケープする"""
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_synthetic_pdf(path: str, pages: int, lines_per_page: int = 45, seed: int = 0):
+    """テキストのみのpdfを生成する
+    各ページにヘッダ・フッタと乱数で生成した本文を持つ
+
+    Args:
+        path (str): 出力先のパス
+        pages (int): ページ数
+        lines_per_page (int, optional): 1ページあたりの本文の行数. Defaults to 45.
+        seed (int, optional): 本文生成の乱数シード. Defaults to 0.
+    """
+    rng = random.Random(seed)
+
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # ページ数確定後に作成
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_refs = []
+    for page_number in range(pages):
+        lines = ["Synthetic Terms of Service - Confidential"]
+        for _ in range(lines_per_page):
+            lines.append(" ".join(rng.choice(WORDS) for _ in range(12)))
+        lines.append(f"Page {page_number + 1} of {pages}")
+
+        content = "BT /F1 10 Tf 14 TL 40 800 Td " + " ".join(
+            f"({_escape_pdf_text(line)}) Tj T*" for line in lines) + " ET"
+        content_bytes = content.encode("latin-1")
+
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content_bytes), content_bytes))
+        content_ref = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_ref)
+        page_refs.append(len(objects))
+
+    kids = b" ".join(b"%d 0 R" % ref for ref in page_refs)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, pages)
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+
+        xref_offset = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset))
+
+
+def _peak_rss_mb() -> float:
+    """自プロセスと子プロセス(解析worker)の最大RSS(MB)
+    プロセス開始からの累積値のため、実行ごとの計測は新しいプロセスで行う
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # Linuxではru_maxrssの単位はKB
+    return round(max(own, children) / 1024, 1)
+
+
+def _folder_size_mb(folder: str, names: tuple = ("index.faiss", "index.pkl")) -> float:
+    """保存したindexのサイズ(MB)"""
+    size = sum(os.path.getsize(os.path.join(folder, name)) for name in names if os.path.exists(os.path.join(folder, name)))
+    return round(size / (1024 * 1024), 3)
+
+
+def _run_embedding(pdf_path: str, save_folder: str, client_options: dict, embedding_options: dict) -> dict:
+    """embedding()を実行し、計測結果を返す (計測用のプロセス内で実行する)"""
+    client = FakeBedrockRuntime(**client_options)
+
+    started_at = time.perf_counter()
+    response = embedding(
+        origin_file=pdf_path,
+        save_folder=save_folder,
+        bedrock_runtime=client,
+        **embedding_options,
+    )
+    elapsed = time.perf_counter() - started_at
+    stats = response["stats"]
+
+    return {
+        "chunks": stats["chunks"],
+        "end_to_end_sec": round(elapsed, 3),
+        "chunks_per_sec": round(stats["chunks"] / elapsed, 2),
+        "bedrock_calls": client.calls,
+        "throttled": stats["throttled"],
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def run_benchmark(pages: int, client_options: dict, work_dir: str, **embedding_options) -> dict:
+    """指定ページ数のpdfを生成してembedding()を実行し、計測結果を返す
+    embedding()は新しいプロセスで実行し、その実行だけの最大RSSを計測する
+
+    Args:
+        pages (int): 生成するpdfのページ数
+        client_options (dict): Bedrockの代わりのクライアント(FakeBedrockRuntime)の引数
+        work_dir (str): 作業ディレクトリ
+        embedding_options: embedding()に渡す追加の引数
+
+    Returns:
+        dict: 計測結果
+    """
+    pdf_path = os.path.join(work_dir, f"synthetic_{pages}.pdf")
+    save_folder = os.path.join(work_dir, f"index_{pages}")
+    write_synthetic_pdf(pdf_path, pages=pages)
+
+    # forkでは親プロセスのメモリを引き継ぐため、spawnで起動する
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        result = executor.submit(_run_embedding, pdf_path, save_folder, client_options, embedding_options).result()
+
+    return {
+        "pages": pages,
+        **result,
+        "index_size_mb": _folder_size_mb(save_folder),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", dest = "pages", default="10,100,500", type = str, help = "生成するpdfのページ数 (カンマ区切り)")
+    parser.add_argument("--latency", dest = "latency", default=0.05, type = float, help = "疑似Bedrockの応答時間(秒)")
+    parser.add_argument("--throttle-rate", dest = "throttle_rate", default=0.0, type = float, help = "疑似Bedrockのスロットリング発生率")
+    parser.add_argument("--dimension", dest = "dimension", default=1536, type = int, help = "ベクトルの次元数")
+    parser.add_argument("--max-concurrency", dest = "max_concurrency", default=8, type = int, help = "embeddingの同時リクエスト数")
+    parser.add_argument("--index-type", dest = "index_type", default="flat", type = str, help = "indexの種類")
+    parser.add_argument("--work-dir", dest = "work_dir", default=None, type = str, help = "作業ディレクトリ (未指定の場合は一時ディレクトリ)")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="embedding_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+
+    client_options = {
+        "dimension": args.dimension,
+        "latency": args.latency,
+        "throttle_rate": args.throttle_rate,
+    }
+
+    try:
+        for page_count in [int(value) for value in args.pages.split(",")]:
+            result = run_benchmark(
+                pages=page_count,
+                client_options=client_options,
+                work_dir=work_dir,
+                max_concurrency=args.max_concurrency,
+                index_type=args.index_type,
+            )
+            print(json.dumps(result))
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
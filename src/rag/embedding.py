@@ -4,68 +4,372 @@ pdf fileからembeddingを作成する
 import sys
 sys.path.append("../")
 
+import startup_profile
+
 import os
 import json
-import boto3
 import argparse
-from langchain.document_loaders import PyPDFLoader
-from langchain.embeddings import BedrockEmbeddings
-from langchain.indexes import VectorstoreIndexCreator
-from langchain.vectorstores import FAISS
 
-from list_invoke_model import display_invoke_model_list
+# boto3, langchain, faiss等の重いモジュールは、実際に使う処理の中でimportする
+from index_store import IndexManifest, index_exists, make_chunk_ids
+from pdf_parse import resolve_origin_files
+from progress import ProgressReporter
+
+startup_profile.mark("import embedding")
+
+EMBEDDING_MODEL_ID = "amazon.titan-embed-text-v1"
 
 
-def embedding(origin_file: str, save_folder: str):
+def embedding(
+    origin_file: str,
+    save_folder: str,
+    max_concurrency: int = 8,
+    cache_path: str = None,
+    cache_max_bytes: int = 1024 * 1024 * 1024,
+    mode: str = "rebuild",
+    parse_workers: int = None,
+    max_inflight_chunks: int = 256,
+    pages_per_task: int = 16,
+    index_type: str = "flat",
+    nlist: int = 256,
+    pq_m: int = 64,
+    nprobe: int = 8,
+    train_size: int = 10000,
+    recall_queries: int = 0,
+    recall_k: int = 10,
+    bedrock_runtime=None,
+    dedup: bool = True,
+    near_duplicate_distance: int = 8,
+    progress_output=None,
+):
     """
     埋め込みファイルを作成する
     出力形式はfaissとpkl
 
+    origin_fileにはファイル, ディレクトリ, globパターンを指定できる
+    pdfの解析はプロセスプールで並列に行い、embeddingとindexへの追加は1つのFAISS storeにまとめる
+    pdfはページ範囲ごとに ページ読み込み -> 分割 -> embedding -> indexへ追加 と流すため、
+    メモリ使用量は文書サイズではなくmax_inflight_chunksで抑えられる
+
+    index_type (新規作成時のみ有効)
+        flat: float32のflat index (従来と同じ)
+        flat_fp16: float16で保持するflat index
+        ivf / ivf_fp16: 全ベクトルから無作為に選んだtrain_size件で学習したIVF (float32 / float16)
+        ivfpq: IVF + 直積量子化 (学習に必要なベクトル数に満たない場合はflat_fp16)
+        IVF系は学習が終わるまでindexを作れないため、全チャンクのベクトルを保持してから作成する
+    stats["index_type"]には実際に作成したindexの種類を返す
+    IVF系のindexはupsertに対応しないため、変更時はrebuildで作成し直す
+    recall_queriesを指定するとflat indexに対するrecall@kを計算して返す
+
+    dedupを指定した場合、分割前にページのヘッダ・フッタ等の繰り返し要素を除去し、
+    文書内の完全一致・ほぼ一致のチャンクはembeddingせずに除去する
+    除去したチャンクのページは残したチャンクのmetadata["duplicate_pages"]に記録する
+
+    mode
+        rebuild: indexを新規に作成して上書きする
+        upsert: 既存のindexを読み込み、新規・変更された文書のみ追加し、削除された文書のベクトルを削除する
+
     Args:
-        origin_file (str): 元ファイルのパス
+        origin_file (str): 元ファイル・ディレクトリのパス, またはglobパターン
         save_folder (str): 保存先のパス
+        max_concurrency (int, optional): embeddingの同時リクエスト数. Defaults to 8.
+        cache_path (str, optional): embeddingキャッシュのパス. Defaults to save_folder/embedding_cache.sqlite3.
+        cache_max_bytes (int, optional): embeddingキャッシュの容量上限. Defaults to 1GiB.
+        mode (str, optional): rebuild or upsert. Defaults to "rebuild".
+        parse_workers (int, optional): pdf解析のプロセス数. Defaults to CPU数.
+        max_inflight_chunks (int, optional): embedding待ちで保持するチャンク数の上限. Defaults to 256.
+        pages_per_task (int, optional): 解析プロセスに渡す1処理単位のページ数. Defaults to 16.
+        index_type (str, optional): indexの種類. Defaults to "flat".
+        nlist (int, optional): IVFのクラスタ数. Defaults to 256.
+        pq_m (int, optional): PQのサブベクトル数. Defaults to 64.
+        nprobe (int, optional): IVFの検索時に探索するクラスタ数. Defaults to 8.
+        train_size (int, optional): IVF/PQの学習に使うベクトル数. Defaults to 10000.
+        recall_queries (int, optional): recall@kの評価に使うクエリ数 (0の場合は評価しない). Defaults to 0.
+        recall_k (int, optional): recall@kのk. Defaults to 10.
+        bedrock_runtime (boto3.client, optional): bedrock-runtimeのクライアント. Defaults to AWS_PROFILE, AWS_REGIONから作成.
+        dedup (bool, optional): 繰り返し要素・重複チャンクを除去するか. Defaults to True.
+        near_duplicate_distance (int, optional): ほぼ一致とみなすSimHashのハミング距離. Defaults to 8.
+        progress_output (callable, optional): 進捗の出力関数 (例: print). Defaults to None (出力しない).
     """
 
-    # 元ファイルの拡張子を取得
-    origin_extension = origin_file.split(".")[-1]
+    if mode not in ("rebuild", "upsert"):
+        raise Exception("Not supported mode")
+
+    origin_files = resolve_origin_files(origin_file)
+    if not origin_files:
+        raise Exception("No supported files")
+
+    # upsertの場合は登録済み文書を読み込む
+    is_upsert = mode == "upsert" and index_exists(save_folder)
+    manifest = IndexManifest.load(save_folder) if is_upsert else IndexManifest()
+    if is_upsert and manifest.index.get("index_type", "").startswith("ivf"):
+        raise Exception("upsert is not supported for IVF indexes. Use mode=rebuild")
+
+    # 削除された文書・変更された文書を検出
+    stale_ids = []
+    removed_files = manifest.removed_paths()
+    for path in removed_files:
+        stale_ids.extend(manifest.chunk_ids(path))
+        manifest.remove(path)
 
-    if origin_extension == "pdf":
-        loader = PyPDFLoader(origin_file)
-    else:
-        raise Exception("Not supported extension")
-    
-    session = boto3.Session(profile_name=os.environ["AWS_PROFILE"], region_name=os.environ["AWS_REGION"])
-    bedrock_runtime = session.client(service_name="bedrock-runtime")
+    changed_files = []
+    for path in origin_files:
+        changed, content_hash, mtime, size = manifest.check(path)
+        if changed:
+            stale_ids.extend(manifest.chunk_ids(path))
+            changed_files.append((path, content_hash, mtime, size))
+        else:
+            # 内容が同じでmtimeのみ変わった場合に備えて更新
+            manifest.update(path, content_hash, mtime, size, manifest.documents[path]["chunk_count"])
+
+    progress = ProgressReporter(total_files=len(changed_files), output=progress_output)
+
+    if not changed_files and not removed_files:
+        # 変更がない場合はindexやBedrockクライアントを読み込まずに終了する
+        manifest.save(save_folder)
+        startup_profile.mark("no changes")
+        return {
+            "statusCode": 200,
+            "body": json.dumps("Success"),
+            "stats": {
+                **progress.summary(),
+                "added_documents": 0,
+                "removed_documents": 0,
+                "deleted_vectors": 0,
+                "cache_hits": 0,
+                "cache_misses": 0,
+                "throttled": 0,
+                "furniture_lines_removed": 0,
+                "exact_duplicates_removed": 0,
+                "near_duplicates_removed": 0,
+                # indexは読み込まないため、前回保存時の値を返す
+                "index_type": manifest.index.get("index_type"),
+                "vectors": manifest.index.get("vectors"),
+                f"recall_at_{recall_k}": None,
+            },
+        }
+
+    from concurrent.futures import ProcessPoolExecutor
+    from langchain.embeddings import BedrockEmbeddings
+
+    from batch_embedding import BatchEmbedder
+    from client_factory import NO_RETRY, get_client
+    from embedding_cache import EmbeddingCache
+    from instrumentation import instrument
+    from index_builder import INDEX_TYPES, IndexWriter, index_type_of, supports_upsert
+    from index_store import load_vectorstore
+    from normalize import DocumentNormalizer
+    from pdf_parse import iter_page_tasks, stream_parsed_pages
+    startup_profile.mark("import pipeline modules")
+
+    if index_type not in INDEX_TYPES:
+        raise Exception("Not supported index type")
+
+    if bedrock_runtime is None:
+        # 同時リクエスト数がプールの上限で頭打ちにならないよう、プールを並列数以上にする
+        bedrock_runtime = get_client(
+            "bedrock-runtime",
+            profile=os.environ["AWS_PROFILE"],
+            region=os.environ["AWS_REGION"],
+            max_pool_connections=max(10, max_concurrency),
+            # スロットリングはBatchEmbedderが再試行する
+            max_attempts=NO_RETRY,
+        )
+    # embeddingの呼び出しもレイテンシ・トークン数を記録する
+    bedrock_runtime = instrument(bedrock_runtime)
 
     embeddings = BedrockEmbeddings(
-        model_id="amazon.titan-embed-text-v1",
+        model_id=EMBEDDING_MODEL_ID,
         client=bedrock_runtime,
-        region_name=os.environ["AWS_REGION"],
+        region_name=os.environ.get("AWS_REGION"),
     )
-    index_creator = VectorstoreIndexCreator(
-        vectorstore_cls=FAISS,
-        embedding=embeddings,
+
+    # upsertの場合は既存のindexを読み込み、古いベクトルを削除
+    vectorstore = None
+    if is_upsert:
+        vectorstore = load_vectorstore(save_folder, embeddings)
+        if not supports_upsert(vectorstore.index):
+            # manifestにindexの種類が記録される前に作成されたindex
+            raise Exception("upsert is not supported for IVF indexes. Use mode=rebuild")
+        if stale_ids:
+            vectorstore.delete(stale_ids)
+    startup_profile.mark("load index")
+
+    # 変更のないチャンクはキャッシュから取得する
+    if cache_path is None:
+        cache_path = os.path.join(save_folder, "embedding_cache.sqlite3")
+    cache = EmbeddingCache(path=cache_path, max_bytes=cache_max_bytes)
+
+    embedder = BatchEmbedder(
+        bedrock_runtime=bedrock_runtime,
+        model_id=EMBEDDING_MODEL_ID,
+        max_concurrency=max_concurrency,
+        cache=cache,
     )
 
-    index_from_loader = index_creator.from_loaders([loader])
-    index_from_loader.vectorstore.save_local(save_folder)
+    writer = IndexWriter(
+        embeddings=embeddings,
+        vectorstore=vectorstore,
+        index_type=index_type,
+        nlist=nlist,
+        pq_m=pq_m,
+        nprobe=nprobe,
+        train_size=train_size,
+        recall_queries=recall_queries,
+    )
 
-    return {"statusCode": 200, "body": json.dumps("Success")}
+    changed_hashes = {path: content_hash for path, content_hash, _, _ in changed_files}
+    normalizers = {
+        path: DocumentNormalizer(dedup=dedup, max_distance=near_duplicate_distance)
+        for path in changed_hashes
+    }
+    buffer_texts, buffer_metadatas, buffer_ids = [], [], []
+
+    def flush():
+        """保持しているチャンクをembeddingしてindexへ追加する"""
+        if not buffer_texts:
+            return
+
+        # チャンクを並列にembeddingし、計算済みのベクトルからindexを作成・追加
+        vectors = embedder.embed_texts(buffer_texts)
+        writer.add(buffer_texts, vectors, buffer_metadatas, buffer_ids)
+
+        progress.add(chunks=len(buffer_texts))
+        buffer_texts.clear()
+        buffer_metadatas.clear()
+        buffer_ids.clear()
+
+    try:
+        if parse_workers is None:
+            parse_workers = os.cpu_count() or 1
+
+        with ProcessPoolExecutor(max_workers=parse_workers) as executor:
+            # ページ範囲ごとに並列に解析し、文書内の順序を保って取り出す
+            tasks = iter_page_tasks(list(changed_hashes), pages_per_task=pages_per_task)
+            for (path, _, _, is_last), pages in stream_parsed_pages(
+                    executor, tasks, max_pending=parse_workers * 2):
+                # 繰り返し要素・重複チャンクを除去して分割
+                for chunk_number, text, page_number in normalizers[path].feed(pages, is_last):
+                    buffer_ids.extend(make_chunk_ids(path, changed_hashes[path], 1, start=chunk_number))
+                    buffer_texts.append(text)
+                    buffer_metadatas.append({"source": path, "page": page_number})
+
+                if len(buffer_texts) >= max_inflight_chunks:
+                    flush()
+                progress.add(files=int(is_last), pages=len(pages))
+
+            flush()
+    finally:
+        cache.close()
+
+    vectorstore = writer.finish()
+
+    if progress_output is not None:
+        progress_output(progress.format())
+
+    if vectorstore is None:
+        raise Exception("No chunks to index")
+
+    for path, content_hash, mtime, size in changed_files:
+        normalizer = normalizers[path]
+        manifest.update(path, content_hash, mtime, size, normalizer.chunk_count)
+
+        # 除去した重複チャンクのページを、残したチャンクから辿れるようにする
+        for chunk_number, pages in normalizer.duplicate_pages.items():
+            chunk_id = make_chunk_ids(path, content_hash, 1, start=chunk_number)[0]
+            document = vectorstore.docstore.search(chunk_id)
+            document.metadata["duplicate_pages"] = sorted(set(pages))
+
+    index_type = index_type_of(vectorstore.index)
+    manifest.index = {"index_type": index_type, "vectors": vectorstore.index.ntotal}
+
+    vectorstore.save_local(save_folder)
+    manifest.save(save_folder)
+
+    return {
+        "statusCode": 200,
+        "body": json.dumps("Success"),
+        "stats": {
+            **progress.summary(),
+            "added_documents": len(changed_files),
+            "removed_documents": len(removed_files),
+            "deleted_vectors": len(stale_ids),
+            "cache_hits": cache.hits,
+            "cache_misses": cache.misses,
+            "throttled": embedder.throttled,
+            "furniture_lines_removed": sum(n.furniture_lines_removed for n in normalizers.values()),
+            "exact_duplicates_removed": sum(n.exact_duplicates_removed for n in normalizers.values()),
+            "near_duplicates_removed": sum(n.near_duplicates_removed for n in normalizers.values()),
+            "index_type": index_type,
+            "vectors": vectorstore.index.ntotal,
+            f"recall_at_{recall_k}": writer.recall_at_k(k=recall_k),
+        },
+    }
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--origin-file", dest = "origin_file", default = "./files/Microsoft サービス規約.pdf", type = str, help = "元ファイルのパス")
+    parser.add_argument("--origin-file", dest = "origin_file", default = "./files/Microsoft サービス規約.pdf", type = str, help = "元ファイル・ディレクトリのパス, またはglobパターン")
     parser.add_argument("--save-folder", dest = "save_folder", default="./files", type = str, help = "保存先のパス")
     parser.add_argument("--profile", dest = "profile", default="atl", type = str, help = "aws profile")
     parser.add_argument("--region", dest = "region", default="us-west-2", type = str, help = "aws region")
+    parser.add_argument("--max-concurrency", dest = "max_concurrency", default=8, type = int, help = "embeddingの同時リクエスト数")
+    parser.add_argument("--cache-path", dest = "cache_path", default=None, type = str, help = "embeddingキャッシュのパス")
+    parser.add_argument("--cache-max-mb", dest = "cache_max_mb", default=1024, type = int, help = "embeddingキャッシュの容量上限(MB)")
+    parser.add_argument("--mode", dest = "mode", default="rebuild", choices = ["rebuild", "upsert"], help = "indexの作成方法")
+    parser.add_argument("--parse-workers", dest = "parse_workers", default=None, type = int, help = "pdf解析のプロセス数")
+    parser.add_argument("--max-inflight-chunks", dest = "max_inflight_chunks", default=256, type = int, help = "embedding待ちで保持するチャンク数の上限")
+    parser.add_argument("--pages-per-task", dest = "pages_per_task", default=16, type = int, help = "解析プロセスに渡す1処理単位のページ数")
+    parser.add_argument("--index-type", dest = "index_type", default="flat", type = str, help = "indexの種類 (flat, flat_fp16, ivf, ivf_fp16, ivfpq)")
+    parser.add_argument("--nlist", dest = "nlist", default=256, type = int, help = "IVFのクラスタ数")
+    parser.add_argument("--pq-m", dest = "pq_m", default=64, type = int, help = "PQのサブベクトル数")
+    parser.add_argument("--nprobe", dest = "nprobe", default=8, type = int, help = "IVFの検索時に探索するクラスタ数")
+    parser.add_argument("--train-size", dest = "train_size", default=10000, type = int, help = "IVF/PQの学習に使うベクトル数")
+    parser.add_argument("--recall-queries", dest = "recall_queries", default=0, type = int, help = "flat indexに対するrecall@kの評価クエリ数")
+    parser.add_argument("--recall-k", dest = "recall_k", default=10, type = int, help = "recall@kのk")
+    parser.add_argument("--no-dedup", dest = "dedup", action = "store_false", help = "繰り返し要素・重複チャンクを除去しない")
+    parser.add_argument("--near-duplicate-distance", dest = "near_duplicate_distance", default=8, type = int, help = "ほぼ一致とみなすSimHashのハミング距離")
+    parser.add_argument("--list-models", dest = "list_models", action = "store_true", help = "実行前に利用可能なモデル一覧を表示する")
+    parser.add_argument("--metrics-output", dest = "metrics_output", default=None, type = str, help = "Bedrock呼び出しの計測値の出力先 (.promはPrometheus形式, それ以外はJSON)")
+    parser.add_argument("--profile-startup", dest = "profile_startup", action = "store_true", help = "起動から各段階までの時間を表示する")
     args = parser.parse_args()
 
-    display_invoke_model_list(profile = args.profile, region = args.region)
+    if args.list_models:
+        from list_invoke_model import display_invoke_model_list
+        display_invoke_model_list(profile = args.profile, region = args.region)
+        startup_profile.mark("list models")
 
     # aws profileの設定
     os.environ["AWS_PROFILE"] = args.profile
     os.environ["AWS_REGION"] = args.region
 
-    response = embedding(origin_file = args.origin_file, save_folder = args.save_folder)
-    
-    print(response)
\ No newline at end of file
+    response = embedding(
+        origin_file = args.origin_file,
+        save_folder = args.save_folder,
+        max_concurrency = args.max_concurrency,
+        cache_path = args.cache_path,
+        cache_max_bytes = args.cache_max_mb * 1024 * 1024,
+        mode = args.mode,
+        parse_workers = args.parse_workers,
+        max_inflight_chunks = args.max_inflight_chunks,
+        pages_per_task = args.pages_per_task,
+        index_type = args.index_type,
+        nlist = args.nlist,
+        pq_m = args.pq_m,
+        nprobe = args.nprobe,
+        train_size = args.train_size,
+        recall_queries = args.recall_queries,
+        recall_k = args.recall_k,
+        dedup = args.dedup,
+        near_duplicate_distance = args.near_duplicate_distance,
+        progress_output = print,
+    )
+    startup_profile.mark("embedding")
+
+    print(response)
+
+    if args.metrics_output:
+        from instrumentation import METRICS
+        METRICS.write(args.metrics_output)
+
+    if args.profile_startup:
+        startup_profile.report()
\ No newline at end of file
@@ -0,0 +1,139 @@
+"""
+チャンクのembeddingをディスクにキャッシュする
+キーは(model_id, チャンクのテキスト)のハッシュ
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+
+def make_cache_key(model_id: str, text: str) -> str:
+    """キャッシュキーを生成する
+
+    Args:
+        model_id (str): embeddingモデルID
+        text (str): チャンクのテキスト
+
+    Returns:
+        str: sha256のhex文字列
+    """
+    return hashlib.sha256(f"{model_id}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """SQLiteを使ったembeddingの永続キャッシュ
+    容量を超えた場合は最終アクセスが古いものから削除する (LRU)
+    """
+
+    def __init__(self, path: str, max_bytes: int = 1024 * 1024 * 1024):
+        """
+        Args:
+            path (str): キャッシュファイルのパス
+            max_bytes (int, optional): 保存するベクトルの合計バイト数の上限. Defaults to 1GiB.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embedding ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS embedding_last_access ON embedding (last_access)")
+        self._connection.commit()
+
+    def get_many(self, keys: list) -> dict:
+        """キーに対応するベクトルを取得する
+
+        Args:
+            keys (list): キャッシュキー一覧
+
+        Returns:
+            dict: キャッシュに存在したキーとベクトル
+        """
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+
+        with self._lock:
+            # SQLiteの変数上限を超えないよう分割して問い合わせる
+            for start in range(0, len(unique_keys), 500):
+                part = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._connection.execute(
+                    f"SELECT key, vector FROM embedding WHERE key IN ({placeholders})", part)
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+
+            if found:
+                now = time.time()
+                self._connection.executemany(
+                    "UPDATE embedding SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found])
+                self._connection.commit()
+
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+
+        return found
+
+    def put_many(self, items: dict):
+        """ベクトルを保存し、上限を超えた分を削除する
+
+        Args:
+            items (dict): キャッシュキーとベクトル
+        """
+        if not items:
+            return
+
+        now = time.time()
+        rows = []
+        for key, vector in items.items():
+            blob = array("f", vector).tobytes()
+            rows.append((key, blob, len(blob), now))
+
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embedding (key, vector, size, last_access) VALUES (?, ?, ?, ?)",
+                rows)
+            self._evict()
+            self._connection.commit()
+
+    def _evict(self):
+        """合計サイズが上限を超えている場合、古いエントリから削除する
+        NOTE: lock取得済みの状態で呼び出す
+        """
+        total = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM embedding").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        excess = total - self.max_bytes
+        removed = 0
+        expired_keys = []
+        for key, size in self._connection.execute(
+                "SELECT key, size FROM embedding ORDER BY last_access ASC"):
+            expired_keys.append((key,))
+            removed += size
+            if removed >= excess:
+                break
+        self._connection.executemany("DELETE FROM embedding WHERE key = ?", expired_keys)
+
+    def close(self):
+        """キャッシュファイルを閉じる"""
+        with self._lock:
+            self._connection.close()
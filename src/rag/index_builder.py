@@ -0,0 +1,271 @@
+"""
+FAISS indexの作成
+flat以外に、IVF / 直積量子化(PQ) / float16 による省メモリなindexに対応する
+"""
+import random
+
+import faiss
+import numpy as np
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.vectorstores import FAISS
+
+# 選択可能なindexの種類
+INDEX_TYPES = ("flat", "flat_fp16", "ivf", "ivf_fp16", "ivfpq")
+
+
+def create_index(index_type: str, dimension: int, nlist: int = 256, pq_m: int = 64, pq_bits: int = 8):
+    """種類を指定してFAISS indexを作成する
+
+    Args:
+        index_type (str): indexの種類 (INDEX_TYPES)
+        dimension (int): ベクトルの次元数
+        nlist (int, optional): IVFのクラスタ数. Defaults to 256.
+        pq_m (int, optional): PQのサブベクトル数 (dimensionの約数). Defaults to 64.
+        pq_bits (int, optional): PQのサブベクトルあたりのビット数. Defaults to 8.
+
+    Returns:
+        faiss.Index: 作成したindex (IVF系は未学習)
+    """
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dimension)
+    if index_type == "flat_fp16":
+        return faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_fp16)
+
+    quantizer = faiss.IndexFlatL2(dimension)
+    if index_type == "ivf":
+        return faiss.IndexIVFFlat(quantizer, dimension, nlist)
+    if index_type == "ivf_fp16":
+        return faiss.IndexIVFScalarQuantizer(quantizer, dimension, nlist, faiss.ScalarQuantizer.QT_fp16)
+    if index_type == "ivfpq":
+        return faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, pq_bits)
+
+    raise Exception("Not supported index type")
+
+
+def index_type_of(index) -> str:
+    """indexの種類 (INDEX_TYPES) を返す
+
+    Args:
+        index (faiss.Index): index
+
+    Returns:
+        str: indexの種類 (INDEX_TYPES以外のindexはクラス名)
+    """
+    index_types = {
+        faiss.IndexFlatL2: "flat",
+        faiss.IndexScalarQuantizer: "flat_fp16",
+        faiss.IndexIVFFlat: "ivf",
+        faiss.IndexIVFScalarQuantizer: "ivf_fp16",
+        faiss.IndexIVFPQ: "ivfpq",
+    }
+    return index_types.get(type(index), type(index).__name__)
+
+
+def supports_upsert(index) -> bool:
+    """既存のindexにベクトルの削除・追加を行えるか
+    IVF系のindexはremove_ids後も残りのベクトルのIDを詰めないが、langchainのFAISS.deleteは
+    index_to_docstore_idを0から詰め直すため、次の追加でIDが重複して検索結果が壊れる
+
+    Args:
+        index (faiss.Index): index
+
+    Returns:
+        bool: upsertできる場合True
+    """
+    return not isinstance(index, faiss.IndexIVF)
+
+
+class IndexWriter:
+    """計算済みのベクトルをFAISS vectorstoreへ追加する
+
+    学習が必要なindex (IVF系) では全チャンクを保持し、全ベクトルから無作為に選んだtrain_size件で
+    学習してからまとめて追加する (取り込み順の先頭に偏ったサンプルでクラスタが偏らないようにする)
+    recall_queries > 0 の場合はflat indexも並行して作成し、recall@kの評価に使う
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        vectorstore=None,
+        index_type: str = "flat",
+        nlist: int = 256,
+        pq_m: int = 64,
+        pq_bits: int = 8,
+        nprobe: int = 8,
+        train_size: int = 10000,
+        recall_queries: int = 0,
+    ):
+        """
+        Args:
+            embeddings (Embeddings): クエリのembeddingに使うモデル
+            vectorstore (FAISS, optional): 追加先の既存vectorstore. Defaults to None.
+            index_type (str, optional): 新規作成するindexの種類. Defaults to "flat".
+            nlist (int, optional): IVFのクラスタ数. Defaults to 256.
+            pq_m (int, optional): PQのサブベクトル数. Defaults to 64.
+            pq_bits (int, optional): PQのサブベクトルあたりのビット数. Defaults to 8.
+            nprobe (int, optional): IVFの検索時に探索するクラスタ数. Defaults to 8.
+            train_size (int, optional): 学習に使うベクトル数 (全ベクトルから無作為に選ぶ). Defaults to 10000.
+            recall_queries (int, optional): recall@kの評価に使うクエリ数 (0の場合は評価しない). Defaults to 0.
+        """
+        if index_type not in INDEX_TYPES:
+            raise Exception("Not supported index type")
+        if vectorstore is not None and not supports_upsert(vectorstore.index):
+            raise Exception("Cannot add to an IVF index. Rebuild the index")
+
+        self.embeddings = embeddings
+        self.vectorstore = vectorstore
+        self.index_type = index_type
+        self.nlist = nlist
+        self.pq_m = pq_m
+        self.pq_bits = pq_bits
+        self.nprobe = nprobe
+        self.train_size = train_size
+
+        # 学習待ちのチャンク
+        self._pending = []
+        self._pending_count = 0
+
+        # recall評価用 (既存indexへの追加時はflat indexと位置が対応しないため評価しない)
+        self.recall_queries = recall_queries if vectorstore is None else 0
+        self._flat_index = None
+        self._query_samples = []
+        self._seen = 0
+
+    def add(self, texts: list, vectors: list, metadatas: list, ids: list):
+        """チャンクを追加する
+
+        Args:
+            texts (list): チャンクのテキスト一覧
+            vectors (list): embeddingベクトル一覧
+            metadatas (list): metadata一覧
+            ids (list): ベクトルID一覧
+        """
+        if not texts:
+            return
+
+        self.__track_for_recall(vectors)
+
+        if self.vectorstore is None:
+            self._pending.append((list(texts), np.asarray(vectors, dtype=np.float32), list(metadatas), list(ids)))
+            self._pending_count += len(texts)
+            if self.index_type.startswith("ivf"):
+                # 全ベクトルから学習サンプルを選ぶため、finishまで保持する
+                return
+            self.__create_vectorstore()
+            return
+
+        self.vectorstore.add_embeddings(
+            text_embeddings=list(zip(texts, vectors)),
+            metadatas=metadatas,
+            ids=ids,
+        )
+
+    def finish(self):
+        """保持しているチャンクをindexに追加し、vectorstoreを返す
+
+        Returns:
+            FAISS: 作成したvectorstore (チャンクが1件もない場合はNone)
+        """
+        if self.vectorstore is None and self._pending:
+            self.__create_vectorstore()
+        return self.vectorstore
+
+    def __create_vectorstore(self):
+        """保持しているチャンクでindexを学習・作成する"""
+        index = self.__trained_index(self.__train_sample())
+
+        self.vectorstore = FAISS(self.embeddings.embed_query, index, InMemoryDocstore({}), {})
+        for texts, vectors, metadatas, ids in self._pending:
+            self.vectorstore.add_embeddings(
+                text_embeddings=list(zip(texts, vectors)),
+                metadatas=metadatas,
+                ids=ids,
+            )
+        self._pending = []
+        self._pending_count = 0
+
+    def __train_sample(self) -> np.ndarray:
+        """保持しているベクトルから学習用のサンプルを無作為に選ぶ
+
+        Returns:
+            np.ndarray: 学習用のベクトル (最大train_size件)
+        """
+        size = min(self._pending_count, self.train_size)
+        positions = np.sort(np.random.default_rng().choice(self._pending_count, size=size, replace=False))
+
+        parts = []
+        start = 0
+        for _, vectors, _, _ in self._pending:
+            end = start + len(vectors)
+            selected = positions[(positions >= start) & (positions < end)] - start
+            parts.append(vectors[selected])
+            start = end
+        return np.concatenate(parts)
+
+    def __trained_index(self, sample: np.ndarray):
+        """学習サンプルからindexを作成する
+        サンプル数がPQの学習に足りない場合はflat_fp16にする (実際の種類はindex_type_ofで取得できる)
+
+        Args:
+            sample (np.ndarray): 学習用のベクトル
+
+        Returns:
+            faiss.Index: 学習済みのindex
+        """
+        dimension = sample.shape[1]
+        index_type = self.index_type
+        nlist = min(self.nlist, len(sample))
+
+        # PQの学習には 2^pq_bits 件以上のベクトルが必要
+        if index_type == "ivfpq" and len(sample) < 2 ** self.pq_bits:
+            index_type = "flat_fp16"
+
+        index = create_index(index_type, dimension, nlist=nlist, pq_m=self.pq_m, pq_bits=self.pq_bits)
+        if not index.is_trained:
+            index.train(sample)
+        if hasattr(index, "nprobe"):
+            index.nprobe = min(self.nprobe, nlist)
+        return index
+
+    def __track_for_recall(self, vectors: list):
+        """recall評価用にflat indexへの追加とクエリのサンプリング (reservoir sampling) を行う
+
+        Args:
+            vectors (list): embeddingベクトル一覧
+        """
+        if self.recall_queries <= 0 or self.index_type == "flat":
+            return
+
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if self._flat_index is None:
+            self._flat_index = faiss.IndexFlatL2(matrix.shape[1])
+        self._flat_index.add(matrix)
+
+        for vector in matrix:
+            self._seen += 1
+            if len(self._query_samples) < self.recall_queries:
+                self._query_samples.append(vector)
+            else:
+                position = random.randrange(self._seen)
+                if position < self.recall_queries:
+                    self._query_samples[position] = vector
+
+    def recall_at_k(self, k: int = 10):
+        """作成したindexのflat indexに対するrecall@k
+
+        Args:
+            k (int, optional): 評価する検索件数. Defaults to 10.
+
+        Returns:
+            float: recall@k (評価していない場合はNone)
+        """
+        if self._flat_index is None or not self._query_samples or self.vectorstore is None:
+            return None
+
+        queries = np.asarray(self._query_samples, dtype=np.float32)
+        k = min(k, self._flat_index.ntotal)
+        _, expected = self._flat_index.search(queries, k)
+        _, actual = self.vectorstore.index.search(queries, k)
+
+        found = sum(len(set(row_expected) & set(row_actual)) for row_expected, row_actual in zip(expected, actual))
+        return found / (len(queries) * k)
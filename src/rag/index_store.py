@@ -0,0 +1,191 @@
+"""
+保存済みFAISS indexの読み込みと、文書ごとのmanifest管理
+"""
+import hashlib
+import json
+import os
+
+MANIFEST_FILENAME = "manifest.json"
+
+
+def file_sha256(path: str) -> str:
+    """ファイル内容のsha256を計算する
+
+    Args:
+        path (str): ファイルパス
+
+    Returns:
+        str: sha256のhex文字列
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def make_chunk_ids(path: str, content_hash: str, chunk_count: int, start: int = 0) -> list:
+    """文書のチャンクに割り当てるベクトルIDを生成する
+    IDは文書のパス・ハッシュと連番から決まるため、manifestから再現できる
+
+    Args:
+        path (str): 文書のパス
+        content_hash (str): 文書内容のsha256
+        chunk_count (int): チャンク数
+        start (int, optional): 連番の開始位置. Defaults to 0.
+
+    Returns:
+        list: ベクトルID一覧
+    """
+    prefix = hashlib.sha256(f"{path}\0{content_hash}".encode("utf-8")).hexdigest()[:16]
+    return [f"{prefix}-{i}" for i in range(start, start + chunk_count)]
+
+
+def index_exists(folder: str, index_name: str = "index") -> bool:
+    """save_localで保存されたindexが存在するか判定する
+
+    Args:
+        folder (str): 保存先のパス
+        index_name (str, optional): index名. Defaults to "index".
+
+    Returns:
+        bool: 存在する場合True
+    """
+    return os.path.exists(os.path.join(folder, f"{index_name}.faiss")) and \
+        os.path.exists(os.path.join(folder, f"{index_name}.pkl"))
+
+
+def load_vectorstore(folder: str, embeddings):
+    """save_localで保存されたFAISS vectorstoreを読み込む
+
+    Args:
+        folder (str): 保存先のパス
+        embeddings (Embeddings): クエリのembeddingに使うモデル
+
+    Returns:
+        FAISS: 読み込んだvectorstore
+    """
+    # indexを読み込まない実行 (変更なしのupsert等) で読み込みを省くため、ここでimportする
+    from langchain.vectorstores import FAISS
+
+    try:
+        # 新しいlangchainではpickle読み込みの明示的な許可が必要
+        return FAISS.load_local(folder, embeddings, allow_dangerous_deserialization=True)
+    except TypeError:
+        return FAISS.load_local(folder, embeddings)
+
+
+class IndexManifest:
+    """indexに登録済みの文書を記録する
+    文書ごとに path, mtime, size, 内容のハッシュ, ベクトルIDの範囲 を保持する
+    index全体の情報 (indexの種類, ベクトル数) も保持し、indexを読み込まずに参照できるようにする
+    """
+
+    def __init__(self, documents: dict = None, index: dict = None):
+        """
+        Args:
+            documents (dict, optional): 文書パスをキーとした登録情報. Defaults to None.
+            index (dict, optional): index全体の情報 (index_type, vectors). Defaults to None.
+        """
+        self.documents = documents or {}
+        self.index = index or {}
+
+    @classmethod
+    def load(cls, folder: str) -> "IndexManifest":
+        """保存先からmanifestを読み込む (存在しない場合は空)
+
+        Args:
+            folder (str): 保存先のパス
+
+        Returns:
+            IndexManifest: 読み込んだmanifest
+        """
+        path = os.path.join(folder, MANIFEST_FILENAME)
+        if not os.path.exists(path):
+            return cls()
+
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(documents=data.get("documents", {}), index=data.get("index", {}))
+
+    def save(self, folder: str):
+        """manifestを保存する
+        書き込み途中で中断されても壊れないよう一時ファイルから置き換える
+
+        Args:
+            folder (str): 保存先のパス
+        """
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, MANIFEST_FILENAME)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"documents": self.documents, "index": self.index}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def check(self, path: str):
+        """文書が登録済みの内容から変更されているか判定する
+        mtimeとsizeが一致する場合はハッシュ計算を省略する
+
+        Args:
+            path (str): 文書のパス
+
+        Returns:
+            tuple: (変更の有無, 内容のハッシュ, mtime, size)
+        """
+        stat = os.stat(path)
+        entry = self.documents.get(path)
+
+        if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            return False, entry["sha256"], stat.st_mtime, stat.st_size
+
+        content_hash = file_sha256(path)
+        changed = entry is None or entry["sha256"] != content_hash
+        return changed, content_hash, stat.st_mtime, stat.st_size
+
+    def chunk_ids(self, path: str) -> list:
+        """登録済み文書のベクトルID一覧
+
+        Args:
+            path (str): 文書のパス
+
+        Returns:
+            list: ベクトルID一覧 (未登録の場合は空)
+        """
+        entry = self.documents.get(path)
+        if entry is None:
+            return []
+        return make_chunk_ids(path, entry["sha256"], entry["chunk_count"])
+
+    def removed_paths(self) -> list:
+        """登録済みだがファイルが存在しなくなった文書
+
+        Returns:
+            list: 文書パス一覧
+        """
+        return [path for path in self.documents if not os.path.exists(path)]
+
+    def update(self, path: str, content_hash: str, mtime: float, size: int, chunk_count: int):
+        """文書の登録情報を更新する
+
+        Args:
+            path (str): 文書のパス
+            content_hash (str): 内容のsha256
+            mtime (float): 更新日時
+            size (int): ファイルサイズ
+            chunk_count (int): チャンク数
+        """
+        self.documents[path] = {
+            "mtime": mtime,
+            "size": size,
+            "sha256": content_hash,
+            "chunk_count": chunk_count,
+            "id_range": [0, chunk_count],
+        }
+
+    def remove(self, path: str):
+        """文書の登録情報を削除する
+
+        Args:
+            path (str): 文書のパス
+        """
+        self.documents.pop(path, None)
@@ -0,0 +1,237 @@
+"""
+embedding前のテキスト正規化
+    ページの繰り返し要素 (ヘッダ・フッタ等) の除去
+    完全一致・ほぼ一致 (SimHash) のチャンクの除去
+"""
+import hashlib
+import re
+from collections import Counter
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+_DIGITS = re.compile(r"\d+")
+_SPACES = re.compile(r"\s+")
+_TOKENS = re.compile(r"\w+")
+
+
+def _normalize_line(line: str) -> str:
+    """ページ番号等の差異を無視するため、数字と空白を正規化する"""
+    return _SPACES.sub(" ", _DIGITS.sub("#", line)).strip().lower()
+
+
+def simhash(text: str, n: int = 3) -> int:
+    """テキストの64bit SimHashを計算する
+    特徴量には単語のn-gramを使う
+
+    Args:
+        text (str): テキスト
+        n (int, optional): n-gramのn. Defaults to 3.
+
+    Returns:
+        int: 64bitのハッシュ値
+    """
+    tokens = _TOKENS.findall(text.lower())
+    if len(tokens) < n:
+        tokens = [" ".join(tokens)]
+    else:
+        tokens = [" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1)]
+
+    weights = [0] * 64
+    for token, count in Counter(tokens).items():
+        value = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+        for bit in range(64):
+            weights[bit] += count if value >> bit & 1 else -count
+
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+class ChunkDeduplicator:
+    """完全一致とほぼ一致のチャンクを検出する
+    ほぼ一致はSimHashのハミング距離で判定し、64bitを帯に分けた索引で候補を絞る
+
+    max_distanceの既定値8は、150単語のチャンクで計測した値から決めた
+    (1単語の置換: 99%以上を検出, 2単語の置換: 約90%を検出, 無関係なチャンク同士: 最小距離19)
+    """
+
+    def __init__(self, max_distance: int = 8):
+        """
+        Args:
+            max_distance (int, optional): ほぼ一致とみなすハミング距離の上限 (0の場合は完全一致のみ). Defaults to 8.
+        """
+        self.max_distance = max_distance
+        # 距離がmax_distance以下なら、max_distance+1個の帯のいずれかが一致する
+        self.bands = max_distance + 1 if max_distance > 0 else 0
+        self.band_bits = 64 // self.bands if self.bands else 0
+
+        self._exact = {}
+        self._band_index = [{} for _ in range(self.bands)]
+
+    def __band_keys(self, value: int) -> list:
+        """SimHashを帯ごとの値に分割する"""
+        mask = (1 << self.band_bits) - 1
+        return [(value >> (band * self.band_bits)) & mask for band in range(self.bands)]
+
+    def find(self, text: str):
+        """登録済みのチャンクと重複しているか判定する
+
+        Args:
+            text (str): チャンクのテキスト
+
+        Returns:
+            tuple: (重複先のチャンク番号, 種類 "exact" or "near") 重複しない場合は (None, None)
+        """
+        digest = hashlib.sha256(_SPACES.sub(" ", text).strip().encode("utf-8")).digest()
+        if digest in self._exact:
+            return self._exact[digest], "exact"
+
+        if self.bands:
+            value = simhash(text)
+            for band, key in enumerate(self.__band_keys(value)):
+                for candidate_value, chunk_number in self._band_index[band].get(key, ()):
+                    if bin(candidate_value ^ value).count("1") <= self.max_distance:
+                        return chunk_number, "near"
+
+        return None, None
+
+    def add(self, text: str, chunk_number: int):
+        """チャンクを登録する
+
+        Args:
+            text (str): チャンクのテキスト
+            chunk_number (int): 文書内のチャンク番号
+        """
+        digest = hashlib.sha256(_SPACES.sub(" ", text).strip().encode("utf-8")).digest()
+        self._exact[digest] = chunk_number
+
+        if self.bands:
+            value = simhash(text)
+            for band, key in enumerate(self.__band_keys(value)):
+                self._band_index[band].setdefault(key, []).append((value, chunk_number))
+
+
+class DocumentNormalizer:
+    """1文書分のページを順に受け取り、正規化したチャンクを返す
+
+    ページの先頭・末尾の行のうち、min_repeatsページ以上に現れるものを繰り返し要素として除去する
+    行数の少ないページでは本文まで判定対象にならないよう、判定対象の行数をページの行数の割合で制限し、
+    すべての行が繰り返し要素と判定されたページは除去しない
+    判定のため、文書の先頭warmup_pagesページは揃うまで保持する
+    重複チャンクは除去し、残したチャンクに重複元のページを記録する
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = 1000,
+        chunk_overlap: int = 0,
+        dedup: bool = True,
+        max_distance: int = 8,
+        edge_lines: int = 3,
+        max_edge_ratio: float = 0.25,
+        min_repeats: int = 3,
+        warmup_pages: int = 8,
+    ):
+        """
+        Args:
+            chunk_size (int, optional): チャンクの最大文字数. Defaults to 1000.
+            chunk_overlap (int, optional): チャンク間の重なり文字数. Defaults to 0.
+            dedup (bool, optional): 繰り返し要素・重複チャンクを除去するか. Defaults to True.
+            max_distance (int, optional): ほぼ一致とみなすSimHashのハミング距離. Defaults to 8.
+            edge_lines (int, optional): 繰り返し要素の判定対象とするページ先頭・末尾の行数. Defaults to 3.
+            max_edge_ratio (float, optional): 先頭・末尾それぞれの判定対象とする行数の、ページの行数に対する上限. Defaults to 0.25.
+            min_repeats (int, optional): 繰り返し要素とみなす出現ページ数. Defaults to 3.
+            warmup_pages (int, optional): 判定のために保持する先頭のページ数. Defaults to 8.
+        """
+        # VectorstoreIndexCreatorと同じ分割方法
+        self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        self.dedup = dedup
+        self.edge_lines = edge_lines
+        self.max_edge_ratio = max_edge_ratio
+        self.min_repeats = min_repeats
+        self.warmup_pages = warmup_pages
+
+        self.deduplicator = ChunkDeduplicator(max_distance=max_distance)
+        self._line_counts = Counter()
+        self._warmup = []
+        self._warmed_up = False
+
+        # 文書内のチャンク番号 (除去したチャンクは含まない)
+        self.chunk_count = 0
+        # 残したチャンク番号 -> 重複元のページ番号一覧
+        self.duplicate_pages = {}
+
+        self.furniture_lines_removed = 0
+        self.exact_duplicates_removed = 0
+        self.near_duplicates_removed = 0
+
+    def feed(self, pages: list, is_last: bool) -> list:
+        """ページを受け取り、indexに追加するチャンクを返す
+
+        Args:
+            pages (list): (ページ番号, テキスト) の一覧
+            is_last (bool): 文書の最後のページを含むか
+
+        Returns:
+            list: (チャンク番号, テキスト, ページ番号) の一覧
+        """
+        if not self.dedup:
+            return self.__split(pages)
+
+        for _, text in pages:
+            # 1ページ内で同じ行が複数回あっても1回と数える
+            self._line_counts.update(set(self.__edge_lines(text)))
+
+        if not self._warmed_up:
+            self._warmup.extend(pages)
+            if len(self._warmup) < self.warmup_pages and not is_last:
+                return []
+            pages, self._warmup = self._warmup, []
+            self._warmed_up = True
+
+        return self.__split([(page_number, self.__strip_furniture(text)) for page_number, text in pages])
+
+    def __edge_positions(self, lines: list) -> list:
+        """ページ先頭・末尾の判定対象とする空でない行の位置"""
+        non_empty = [i for i, line in enumerate(lines) if line.strip()]
+        count = min(self.edge_lines, int(len(non_empty) * self.max_edge_ratio))
+        if count == 0:
+            return []
+        return non_empty[:count] + non_empty[-count:]
+
+    def __edge_lines(self, text: str) -> list:
+        """ページ先頭・末尾の正規化済みの行"""
+        lines = text.splitlines()
+        return [_normalize_line(lines[i]) for i in self.__edge_positions(lines)]
+
+    def __strip_furniture(self, text: str) -> str:
+        """繰り返し要素の行を除去する"""
+        lines = text.splitlines()
+        furniture = {
+            i for i in self.__edge_positions(lines)
+            if self._line_counts[_normalize_line(lines[i])] >= self.min_repeats
+        }
+        if not furniture or all(i in furniture for i, line in enumerate(lines) if line.strip()):
+            # すべての行が繰り返し要素と判定された場合は、本文の可能性があるため除去しない
+            return text
+
+        self.furniture_lines_removed += len(furniture)
+        return "\n".join(line for i, line in enumerate(lines) if i not in furniture)
+
+    def __split(self, pages: list) -> list:
+        """ページを分割し、重複チャンクを除去する"""
+        chunks = []
+        for page_number, text in pages:
+            for chunk in self.text_splitter.split_text(text):
+                if self.dedup:
+                    duplicate_of, kind = self.deduplicator.find(chunk)
+                    if duplicate_of is not None:
+                        self.duplicate_pages.setdefault(duplicate_of, []).append(page_number)
+                        if kind == "exact":
+                            self.exact_duplicates_removed += 1
+                        else:
+                            self.near_duplicates_removed += 1
+                        continue
+                    self.deduplicator.add(chunk, self.chunk_count)
+
+                chunks.append((self.chunk_count, chunk, page_number))
+                self.chunk_count += 1
+        return chunks
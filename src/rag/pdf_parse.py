@@ -0,0 +1,120 @@
+"""
+pdfの読み込み
+CPUバウンドのためプロセスプールのworkerから呼び出す
+
+メモリ使用量を文書サイズに依存させないため、pdfはページ範囲ごとに読み込み
+結果は一定数までしか先読みしない
+"""
+import glob
+import os
+from collections import deque
+
+SUPPORTED_EXTENSIONS = (".pdf",)
+
+
+def resolve_origin_files(origin: str) -> list:
+    """元ファイルの指定をファイル一覧に展開する
+    ファイル, ディレクトリ (再帰的に探索), globパターンに対応
+
+    Args:
+        origin (str): 元ファイル・ディレクトリのパス, またはglobパターン
+
+    Returns:
+        list: 対応する拡張子のファイルの絶対パス一覧 (ソート済み)
+    """
+    if os.path.isdir(origin):
+        candidates = glob.glob(os.path.join(origin, "**", "*"), recursive=True)
+    elif glob.has_magic(origin):
+        candidates = glob.glob(origin, recursive=True)
+    else:
+        if not origin.lower().endswith(SUPPORTED_EXTENSIONS):
+            raise Exception("Not supported extension")
+        candidates = [origin]
+
+    files = [
+        os.path.abspath(path) for path in candidates
+        if os.path.isfile(path) and path.lower().endswith(SUPPORTED_EXTENSIONS)
+    ]
+    return sorted(set(files))
+
+
+def count_pdf_pages(path: str) -> int:
+    """pdfのページ数を取得する
+    ファイルオブジェクトから読むため、ページの内容はメモリに展開しない
+
+    Args:
+        path (str): pdfのパス
+
+    Returns:
+        int: ページ数
+    """
+    from pypdf import PdfReader
+
+    with open(path, "rb") as f:
+        return len(PdfReader(f).pages)
+
+
+def extract_pdf_pages(path: str, start: int, stop: int) -> list:
+    """pdfの指定したページ範囲のテキストを抽出する
+    分割・正規化は文書をまたいだ状態が必要なため呼び出し側で行う
+
+    Args:
+        path (str): pdfのパス
+        start (int): 開始ページ (0始まり)
+        stop (int): 終了ページ (このページは含まない)
+
+    Returns:
+        list: (ページ番号, テキスト) の一覧
+    """
+    from pypdf import PdfReader
+
+    with open(path, "rb") as f:
+        reader = PdfReader(f)
+        return [(page_number, reader.pages[page_number].extract_text()) for page_number in range(start, stop)]
+
+
+def iter_page_tasks(paths: list, pages_per_task: int = 16):
+    """ファイルをページ範囲の処理単位に分割する
+
+    Args:
+        paths (list): pdfのパス一覧
+        pages_per_task (int, optional): 1処理単位のページ数. Defaults to 16.
+
+    Yields:
+        tuple: (pdfのパス, 開始ページ, 終了ページ, ファイルの最後の処理単位か)
+    """
+    for path in paths:
+        page_count = count_pdf_pages(path)
+        if page_count == 0:
+            yield path, 0, 0, True
+            continue
+
+        for start in range(0, page_count, pages_per_task):
+            stop = min(start + pages_per_task, page_count)
+            yield path, start, stop, stop == page_count
+
+
+def stream_parsed_pages(executor, tasks, max_pending: int):
+    """ページ範囲の解析をexecutorで並列に行い、入力順に結果を返す
+    未取得の結果はmax_pending件までしか保持しない
+
+    Args:
+        executor (Executor): 解析に使うexecutor
+        tasks (iterable): iter_page_tasksの出力
+        max_pending (int): 先読みする処理単位の上限
+
+    Yields:
+        tuple: (処理単位, extract_pdf_pagesの結果)
+    """
+    pending = deque()
+    for task in tasks:
+        path, start, stop, _ = task
+        pending.append((task, executor.submit(extract_pdf_pages, path, start, stop)))
+
+        if len(pending) >= max_pending:
+            task, future = pending.popleft()
+            yield task, future.result()
+
+    while pending:
+        task, future = pending.popleft()
+        yield task, future.result()
@@ -0,0 +1,79 @@
+"""
+取り込み処理の進捗表示
+"""
+import threading
+import time
+
+
+class ProgressReporter:
+    """処理済みのファイル・ページ・チャンク数とスループットを集計する"""
+
+    def __init__(self, total_files: int, interval: float = 5.0, output=print):
+        """
+        Args:
+            total_files (int): 処理対象のファイル数
+            interval (float, optional): 進捗を出力する最小間隔(秒). Defaults to 5.0.
+            output (callable, optional): 出力関数 (Noneの場合は出力しない). Defaults to print.
+        """
+        self.total_files = total_files
+        self.interval = interval
+        self.output = output
+
+        self.files = 0
+        self.pages = 0
+        self.chunks = 0
+
+        self._lock = threading.Lock()
+        self._started_at = time.perf_counter()
+        self._last_report = 0.0
+
+    def add(self, files: int = 0, pages: int = 0, chunks: int = 0):
+        """処理数を加算し、一定間隔ごとに進捗を出力する
+
+        Args:
+            files (int, optional): 完了したファイル数. Defaults to 0.
+            pages (int, optional): 処理したページ数. Defaults to 0.
+            chunks (int, optional): indexに追加したチャンク数. Defaults to 0.
+        """
+        with self._lock:
+            self.files += files
+            self.pages += pages
+            self.chunks += chunks
+
+            now = time.perf_counter()
+            if now - self._last_report < self.interval:
+                return
+            self._last_report = now
+
+        if self.output is not None:
+            self.output(self.format())
+
+    def summary(self) -> dict:
+        """現在までの集計
+
+        Returns:
+            dict: 処理数とスループット
+        """
+        with self._lock:
+            elapsed = max(time.perf_counter() - self._started_at, 1e-9)
+            return {
+                "files": self.files,
+                "pages": self.pages,
+                "chunks": self.chunks,
+                "elapsed_sec": round(elapsed, 3),
+                "pages_per_sec": round(self.pages / elapsed, 2),
+                "chunks_per_sec": round(self.chunks / elapsed, 2),
+            }
+
+    def format(self) -> str:
+        """進捗の表示用文字列
+
+        Returns:
+            str: 進捗
+        """
+        summary = self.summary()
+        return (
+            f"[{summary['files']}/{self.total_files} files] "
+            f"{summary['pages']} pages ({summary['pages_per_sec']} pages/sec), "
+            f"{summary['chunks']} chunks ({summary['chunks_per_sec']} chunks/sec)"
+        )
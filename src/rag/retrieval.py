@@ -0,0 +1,230 @@
+"""
+保存済みのFAISS indexを常駐させて検索する
+"""
+import sys
+sys.path.append("../")
+
+import os
+import json
+import pickle
+import threading
+import time
+import argparse
+from collections import OrderedDict, deque
+
+import faiss
+import numpy as np
+
+from batch_embedding import BatchEmbedder
+from client_factory import NO_RETRY, get_client
+
+
+class Retriever:
+    """embedding.pyで作成したindexを1度だけ読み込み、top-k検索を行う
+    indexはFAISSが対応していればmmapで読み込み、クエリのembeddingはLRUでキャッシュする
+    """
+
+    def __init__(
+        self,
+        save_folder: str,
+        bedrock_runtime,
+        model_id: str = "amazon.titan-embed-text-v1",
+        index_name: str = "index",
+        use_mmap: bool = True,
+        query_cache_size: int = 1024,
+        max_concurrency: int = 8,
+        max_retries: int = 8,
+        latency_window: int = 1000,
+    ):
+        """
+        Args:
+            save_folder (str): indexの保存先のパス
+            bedrock_runtime (boto3.client): bedrock-runtimeのクライアント
+            model_id (str, optional): embeddingモデルID. Defaults to "amazon.titan-embed-text-v1".
+            index_name (str, optional): index名. Defaults to "index".
+            use_mmap (bool, optional): indexをmmapで読み込むか. Defaults to True.
+            query_cache_size (int, optional): クエリembeddingのキャッシュ件数. Defaults to 1024.
+            max_concurrency (int, optional): クエリembeddingの同時リクエスト数. Defaults to 8.
+            max_retries (int, optional): スロットリング時の最大リトライ回数 (クライアント側でリトライする場合は0). Defaults to 8.
+            latency_window (int, optional): レイテンシ統計に使う直近のクエリ数. Defaults to 1000.
+        """
+        started_at = time.perf_counter()
+
+        self.embedder = BatchEmbedder(
+            bedrock_runtime=bedrock_runtime,
+            model_id=model_id,
+            max_concurrency=max_concurrency,
+            max_retries=max_retries,
+        )
+
+        self.index = self.__read_index(os.path.join(save_folder, f"{index_name}.faiss"), use_mmap)
+        with open(os.path.join(save_folder, f"{index_name}.pkl"), "rb") as f:
+            self.docstore, self.index_to_docstore_id = pickle.load(f)
+
+        self.cold_start_sec = time.perf_counter() - started_at
+
+        self.query_cache_size = query_cache_size
+        self._query_cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=latency_window)
+        self.queries = 0
+        self.query_cache_hits = 0
+        self.query_cache_misses = 0
+
+    def __read_index(self, path: str, use_mmap: bool):
+        """FAISS indexを読み込む
+        mmapに対応していないindexの場合は通常の読み込みを行う
+
+        Args:
+            path (str): indexファイルのパス
+            use_mmap (bool): mmapで読み込むか
+
+        Returns:
+            faiss.Index: 読み込んだindex
+        """
+        if use_mmap:
+            try:
+                return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError:
+                pass
+        return faiss.read_index(path)
+
+    def embed_queries(self, queries: list) -> list:
+        """クエリをembeddingする (キャッシュ済みのものは再利用)
+
+        Args:
+            queries (list): クエリ一覧
+
+        Returns:
+            list: 入力順のembeddingベクトル一覧
+        """
+        vectors = {}
+        with self._lock:
+            for query in queries:
+                if query in self._query_cache:
+                    self._query_cache.move_to_end(query)
+                    vectors[query] = self._query_cache[query]
+                    self.query_cache_hits += 1
+                else:
+                    self.query_cache_misses += 1
+
+        missing = [query for query in dict.fromkeys(queries) if query not in vectors]
+        if missing:
+            new_vectors = dict(zip(missing, self.embedder.embed_texts(missing)))
+            vectors.update(new_vectors)
+            with self._lock:
+                for query, vector in new_vectors.items():
+                    self._query_cache[query] = vector
+                    self._query_cache.move_to_end(query)
+                while len(self._query_cache) > self.query_cache_size:
+                    self._query_cache.popitem(last=False)
+
+        return [vectors[query] for query in queries]
+
+    def search_by_vectors(self, vectors: list, k: int = 4) -> list:
+        """embedding済みのベクトルでtop-k検索する
+
+        Args:
+            vectors (list): クエリのembeddingベクトル一覧
+            k (int, optional): 取得件数. Defaults to 4.
+
+        Returns:
+            list: クエリごとの (Document, 距離) のリスト
+        """
+        distances, indices = self.index.search(np.asarray(vectors, dtype=np.float32), k)
+
+        results = []
+        for row_distances, row_indices in zip(distances, indices):
+            hits = []
+            for distance, position in zip(row_distances, row_indices):
+                # 件数がkに満たない場合は-1が返る
+                if position == -1:
+                    continue
+                document = self.docstore.search(self.index_to_docstore_id[int(position)])
+                hits.append((document, float(distance)))
+            results.append(hits)
+        return results
+
+    def search_batch(self, queries: list, k: int = 4) -> list:
+        """複数クエリをまとめてtop-k検索する
+
+        Args:
+            queries (list): クエリ一覧
+            k (int, optional): 取得件数. Defaults to 4.
+
+        Returns:
+            list: クエリごとの (Document, 距離) のリスト
+        """
+        if not queries:
+            return []
+
+        started_at = time.perf_counter()
+        results = self.search_by_vectors(self.embed_queries(queries), k=k)
+        elapsed = time.perf_counter() - started_at
+
+        with self._lock:
+            self.queries += len(queries)
+            # バッチ内のクエリは同じレイテンシとして記録する
+            self._latencies.extend([elapsed] * len(queries))
+
+        return results
+
+    def search(self, query: str, k: int = 4) -> list:
+        """top-k検索する
+
+        Args:
+            query (str): クエリ
+            k (int, optional): 取得件数. Defaults to 4.
+
+        Returns:
+            list: (Document, 距離) のリスト
+        """
+        return self.search_batch([query], k=k)[0]
+
+    def stats(self) -> dict:
+        """起動時間とクエリごとのレイテンシの統計
+
+        Returns:
+            dict: 統計
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+
+        def percentile(ratio):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * ratio))], 6)
+
+        return {
+            "cold_start_sec": round(self.cold_start_sec, 6),
+            "vectors": self.index.ntotal,
+            "queries": self.queries,
+            "query_cache_hits": self.query_cache_hits,
+            "query_cache_misses": self.query_cache_misses,
+            "latency_mean_sec": round(sum(latencies) / len(latencies), 6) if latencies else None,
+            "latency_p50_sec": percentile(0.5),
+            "latency_p95_sec": percentile(0.95),
+            "latency_p99_sec": percentile(0.99),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--save-folder", dest = "save_folder", default="./files", type = str, help = "indexの保存先のパス")
+    parser.add_argument("--query", dest = "queries", action = "append", required = True, help = "検索クエリ (複数指定可)")
+    parser.add_argument("--k", dest = "k", default=4, type = int, help = "取得件数")
+    parser.add_argument("--profile", dest = "profile", default="atl", type = str, help = "aws profile")
+    parser.add_argument("--region", dest = "region", default="us-west-2", type = str, help = "aws region")
+    args = parser.parse_args()
+
+    retriever = Retriever(
+        save_folder=args.save_folder,
+        bedrock_runtime=get_client("bedrock-runtime", profile=args.profile, region=args.region, max_attempts=NO_RETRY),
+    )
+
+    for query, hits in zip(args.queries, retriever.search_batch(args.queries, k=args.k)):
+        print(f"Query: {query}")
+        for document, distance in hits:
+            print(f"  [{distance:.4f}] {document.metadata} {document.page_content[:80]!r}")
+
+    print(json.dumps(retriever.stats(), ensure_ascii=False))
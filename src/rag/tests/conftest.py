@@ -0,0 +1,10 @@
+import os
+import sys
+
+# rag/ のモジュールは rag/ を作業ディレクトリとして実行する前提のため、importできるようにする
+RAG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (RAG_DIR, os.path.dirname(RAG_DIR)):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+os.environ.setdefault("AWS_REGION", "us-west-2")
@@ -0,0 +1,51 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+faiss = pytest.importorskip("faiss")
+pytest.importorskip("langchain")
+
+from index_builder import IndexWriter, index_type_of
+
+
+class FakeEmbeddings:
+    def embed_query(self, text):
+        raise AssertionError("not used")
+
+
+def _add_batches(writer, batches):
+    offset = 0
+    for vectors in batches:
+        count = len(vectors)
+        writer.add(
+            texts=[f"chunk {offset + i}" for i in range(count)],
+            vectors=vectors.tolist(),
+            metadatas=[{"page": offset + i} for i in range(count)],
+            ids=[f"id-{offset + i}" for i in range(count)],
+        )
+        offset += count
+    return writer.finish()
+
+
+def test_ivf_trains_on_sample_across_all_batches():
+    rng = np.random.default_rng(0)
+    # 取り込み順の前半と後半で分布が異なる
+    first = (rng.standard_normal((400, 8)) + 10).astype(np.float32)
+    second = (rng.standard_normal((400, 8)) - 10).astype(np.float32)
+
+    writer = IndexWriter(FakeEmbeddings(), index_type="ivf", nlist=4, train_size=100)
+    vectorstore = _add_batches(writer, [first[:200], first[200:], second[:200], second[200:]])
+
+    assert vectorstore.index.ntotal == 800
+    centroids = vectorstore.index.quantizer.reconstruct_n(0, 4)
+    assert (centroids.mean(axis=1) > 0).any() and (centroids.mean(axis=1) < 0).any()
+
+
+def test_ivfpq_falls_back_to_flat_fp16_without_printing(capsys):
+    vectors = np.random.default_rng(0).standard_normal((50, 16)).astype(np.float32)
+
+    writer = IndexWriter(FakeEmbeddings(), index_type="ivfpq", nlist=4, pq_m=4, train_size=100)
+    vectorstore = _add_batches(writer, [vectors])
+
+    assert index_type_of(vectorstore.index) == "flat_fp16"
+    assert vectorstore.index.ntotal == 50
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("faiss")
+pytest.importorskip("langchain")
+pytest.importorskip("boto3")
+pytest.importorskip("pypdf")
+
+from benchmark import FakeBedrockRuntime, write_synthetic_pdf
+from embedding import embedding
+from retrieval import Retriever
+
+
+def _write_documents(folder, seeds):
+    os.makedirs(folder, exist_ok=True)
+    for name, seed in seeds.items():
+        write_synthetic_pdf(os.path.join(folder, f"{name}.pdf"), pages=3, seed=seed)
+
+
+def _embedding(origin, save_folder, client, **options):
+    return embedding(origin, save_folder, bedrock_runtime=client, parse_workers=1, **options)
+
+
+def test_upsert_then_search_returns_own_chunk(tmp_path):
+    docs = str(tmp_path / "docs")
+    save_folder = str(tmp_path / "index")
+    client = FakeBedrockRuntime(dimension=32, latency=0)
+
+    _write_documents(docs, {"d1": 1, "d2": 2})
+    _embedding(docs, save_folder, client)
+
+    os.remove(os.path.join(docs, "d1.pdf"))
+    _write_documents(docs, {"d3": 3})
+    stats = _embedding(docs, save_folder, client, mode="upsert")["stats"]
+    assert stats["removed_documents"] == 1
+    assert stats["added_documents"] == 1
+
+    retriever = Retriever(save_folder=save_folder, bedrock_runtime=client)
+    documents = [retriever.docstore.search(doc_id) for doc_id in retriever.index_to_docstore_id.values()]
+    assert len(documents) == retriever.index.ntotal
+    assert {os.path.basename(document.metadata["source"]) for document in documents} == {"d2.pdf", "d3.pdf"}
+
+    hits = retriever.search_batch([document.page_content for document in documents], k=1)
+    assert [hit[0][0].page_content for hit in hits] == [document.page_content for document in documents]
+
+
+@pytest.mark.parametrize("index_type", ["ivf", "ivf_fp16"])
+def test_upsert_rejects_ivf_index(tmp_path, index_type):
+    docs = str(tmp_path / "docs")
+    save_folder = str(tmp_path / "index")
+    client = FakeBedrockRuntime(dimension=32, latency=0)
+
+    _write_documents(docs, {"d1": 1, "d2": 2})
+    stats = _embedding(docs, save_folder, client, index_type=index_type, nlist=4, train_size=8)["stats"]
+    assert stats["index_type"] == index_type
+
+    os.remove(os.path.join(docs, "d1.pdf"))
+    with pytest.raises(Exception, match="upsert is not supported"):
+        _embedding(docs, save_folder, client, mode="upsert")
@@ -0,0 +1,79 @@
+import random
+
+import pytest
+
+pytest.importorskip("langchain")
+
+from normalize import ChunkDeduplicator, DocumentNormalizer
+
+
+def _feed_all(normalizer, pages):
+    return normalizer.feed(list(enumerate(pages, start=1)), is_last=True)
+
+
+def _vocabulary(size=3000, seed=0):
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(3, 9))) for _ in range(size)]
+
+
+def test_strips_repeated_header_and_footer():
+    rng = random.Random(0)
+    vocabulary = _vocabulary()
+    pages = []
+    for page_number in range(1, 11):
+        body = [" ".join(rng.choice(vocabulary) for _ in range(10)) for _ in range(20)]
+        pages.append("\n".join(["Terms of Service - Confidential", *body, f"Page {page_number} of 10"]))
+
+    normalizer = DocumentNormalizer()
+    text = "\n".join(chunk for _, chunk, _ in _feed_all(normalizer, pages))
+
+    assert "Confidential" not in text
+    assert "Page " not in text
+    assert normalizer.furniture_lines_removed == 20
+
+
+def test_short_numbered_pages_are_not_stripped_to_empty():
+    # 数字の正規化で、行数の少ないページの全行が繰り返し要素と一致する
+    pages = ["\n".join(f"{page * 10 + line}. item" for line in range(6)) for page in range(6)]
+
+    normalizer = DocumentNormalizer()
+    chunks = _feed_all(normalizer, pages)
+
+    assert chunks
+    text = "\n".join(chunk for _, chunk, _ in chunks)
+    for page in pages:
+        assert page.splitlines()[len(page.splitlines()) // 2] in text
+
+
+def test_removes_exact_duplicate_chunks_and_records_pages():
+    pages = ["same paragraph about the license terms", "other text", "same paragraph about the license terms"]
+
+    normalizer = DocumentNormalizer()
+    chunks = _feed_all(normalizer, pages)
+
+    assert [chunk for _, chunk, _ in chunks] == pages[:2]
+    assert normalizer.exact_duplicates_removed == 1
+    assert normalizer.duplicate_pages == {0: [3]}
+
+
+def test_detects_one_word_edits_without_matching_unrelated_chunks():
+    rng = random.Random(1)
+    vocabulary = _vocabulary()
+
+    detected = 0
+    false_positives = 0
+    trials = 200
+    for _ in range(trials):
+        words = [rng.choice(vocabulary) for _ in range(150)]
+        edited = list(words)
+        edited[rng.randrange(len(edited))] = rng.choice(vocabulary)
+        unrelated = [rng.choice(vocabulary) for _ in range(150)]
+
+        deduplicator = ChunkDeduplicator()
+        deduplicator.add(" ".join(words), 0)
+        detected += deduplicator.find(" ".join(edited))[1] == "near"
+        false_positives += deduplicator.find(" ".join(unrelated))[0] is not None
+
+    assert detected / trials >= 0.95
+    assert false_positives == 0
@@ -0,0 +1,343 @@
+"""
+Bedrockのレスポンスキャッシュ
+キーは(model_id, 正規化したリクエストボディ)のハッシュ
+メモリ上のLRUとSQLiteの2段で保持する
+
+cache = ResponseCache("./response_cache.sqlite3")
+bedrock = CachedClient(session.client('bedrock-runtime'), cache)
+bedrock.invoke_model(modelId=..., body=...)
+cache.stats()
+"""
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from botocore.response import StreamingBody
+
+from model_adapters import get_adapter
+
+
+def canonical_body(body) -> str:
+    """リクエストボディを正規化する
+    キーの順序や空白の違いで別のキーにならないよう、キーをソートして詰めて出力する
+
+    Args:
+        body (str | bytes | dict): リクエストボディ
+
+    Returns:
+        str: 正規化したJSON文字列
+    """
+    if isinstance(body, (str, bytes, bytearray)):
+        body = json.loads(body)
+    return json.dumps(body, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+
+def make_request_key(model_id: str, body) -> str:
+    """リクエストのキャッシュキーを生成する
+
+    Args:
+        model_id (str): モデルID
+        body (str | bytes | dict): リクエストボディ
+
+    Returns:
+        str: sha256のhex文字列
+    """
+    return hashlib.sha256(f"{model_id}\0{canonical_body(body)}".encode("utf-8")).hexdigest()
+
+
+def is_deterministic_request(model_id: str, body) -> bool:
+    """同じリクエストに対して同じ結果が返るか判定する (結果を再利用・共有してよいか)
+
+    Args:
+        model_id (str): モデルID
+        body (str | bytes | dict): リクエストボディ
+
+    Returns:
+        bool: 決定的な場合True (アダプタのないモデルは判断できないためFalse)
+    """
+    if isinstance(body, (str, bytes, bytearray)):
+        body = json.loads(body)
+    try:
+        return get_adapter(model_id).is_deterministic(body)
+    except Exception:
+        return False
+
+
+class ResponseCache:
+    """メモリ(LRU)とSQLiteの2段のレスポンスキャッシュ
+    SQLiteの期限切れエントリは参照時に破棄し、容量超過時は最終アクセスが古いものから削除する
+    """
+
+    def __init__(
+        self,
+        path: str = None,
+        memory_items: int = 256,
+        max_bytes: int = 256 * 1024 * 1024,
+        ttl_sec: float = 24 * 60 * 60,
+    ):
+        """
+        Args:
+            path (str, optional): キャッシュファイルのパス. Defaults to None (メモリのみ).
+            memory_items (int, optional): メモリに保持するエントリ数. Defaults to 256.
+            max_bytes (int, optional): キャッシュファイルに保存する合計バイト数の上限. Defaults to 256MiB.
+            ttl_sec (float, optional): エントリの有効期間(秒). Defaults to 1日.
+        """
+        self.memory_items = memory_items
+        self.max_bytes = max_bytes
+        self.ttl_sec = ttl_sec
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._connection = None
+
+        if path is not None:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS response ("
+                " key TEXT PRIMARY KEY,"
+                " value BLOB NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS response_last_access ON response (last_access)")
+            self._connection.commit()
+
+    def get(self, key: str):
+        """キーに対応するレスポンスを取得する
+
+        Args:
+            key (str): キャッシュキー
+
+        Returns:
+            dict: 保存したレスポンス (存在しない・期限切れの場合はNone)
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if now - created_at <= self.ttl_sec:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return value
+                del self._memory[key]
+
+            if self._connection is not None:
+                row = self._connection.execute(
+                    "SELECT value, created_at FROM response WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    blob, created_at = row
+                    if now - created_at <= self.ttl_sec:
+                        self._connection.execute(
+                            "UPDATE response SET last_access = ? WHERE key = ?", (now, key))
+                        self._connection.commit()
+                        value = json.loads(blob)
+                        self.__remember(key, created_at, value)
+                        self.disk_hits += 1
+                        return value
+
+                    self._connection.execute("DELETE FROM response WHERE key = ?", (key,))
+                    self._connection.commit()
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: dict):
+        """レスポンスを保存する
+
+        Args:
+            key (str): キャッシュキー
+            value (dict): レスポンス (JSONに変換できる形式)
+        """
+        now = time.time()
+        with self._lock:
+            self.__remember(key, now, value)
+
+            if self._connection is not None:
+                blob = json.dumps(value, ensure_ascii=False).encode("utf-8")
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO response (key, value, size, created_at, last_access)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (key, blob, len(blob), now, now))
+                self._evict()
+                self._connection.commit()
+
+    def __remember(self, key: str, created_at: float, value: dict):
+        """メモリに保持し、上限を超えた分を古いものから捨てる
+        NOTE: lock取得済みの状態で呼び出す
+        """
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _evict(self):
+        """期限切れのエントリを削除し、合計サイズが上限を超えている場合は古いエントリから削除する
+        NOTE: lock取得済みの状態で呼び出す
+        """
+        self._connection.execute(
+            "DELETE FROM response WHERE created_at < ?", (time.time() - self.ttl_sec,))
+
+        total = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM response").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        excess = total - self.max_bytes
+        removed = 0
+        expired_keys = []
+        for key, size in self._connection.execute(
+                "SELECT key, size FROM response ORDER BY last_access ASC"):
+            expired_keys.append((key,))
+            removed += size
+            if removed >= excess:
+                break
+        self._connection.executemany("DELETE FROM response WHERE key = ?", expired_keys)
+
+    def stats(self) -> dict:
+        """ヒット率などの集計
+
+        Returns:
+            dict: memory_hits, disk_hits, misses, hit_rate
+        """
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / total, 4) if total else None,
+            }
+
+    def close(self):
+        """キャッシュファイルを閉じる"""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def _streaming_body(data: bytes) -> StreamingBody:
+    """bytesをinvoke_modelのレスポンスと同じ形式のbodyにする"""
+    return StreamingBody(io.BytesIO(data), len(data))
+
+
+class CachedEventStream:
+    """キャッシュから再生・記録しながらイベントを返すストリーム
+    boto3のEventStreamと同様にclose()で読み込みを中断できる
+    """
+
+    def __init__(self, events, stream=None):
+        """
+        Args:
+            events (generator): イベントを返すgenerator
+            stream (EventStream, optional): 記録中の元のストリーム. Defaults to None (キャッシュからの再生).
+        """
+        self._events = events
+        self._stream = stream
+
+    def __iter__(self):
+        return self._events
+
+    def close(self):
+        """読み込みを中断する (記録中の場合は保存せず、元のストリームを閉じる)"""
+        self._events.close()
+        if self._stream is not None:
+            self._stream.close()
+
+
+class CachedClient:
+    """bedrock-runtimeクライアントの前段でレスポンスをキャッシュするラッパー
+    invoke_model / invoke_model_with_response_stream 以外の呼び出しはそのままクライアントへ渡す
+    """
+
+    def __init__(self, client, cache: ResponseCache, cache_all: bool = False):
+        """
+        Args:
+            client (boto3.client): bedrock-runtimeのクライアント
+            cache (ResponseCache): レスポンスキャッシュ
+            cache_all (bool, optional): 温度0以外のリクエストもキャッシュする. Defaults to False.
+        """
+        self.client = client
+        self.cache = cache
+        self.cache_all = cache_all
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def __cache_key(self, model_id: str, body, stream: bool = False):
+        """キャッシュ対象のリクエストであればキーを返す (対象外の場合はNone)
+        ストリーミングはチャンク単位で保存するため、通常の呼び出しとは別のキーにする
+        """
+        if not self.cache_all and not is_deterministic_request(model_id, body):
+            return None
+        key = make_request_key(model_id, body)
+        return key + ":stream" if stream else key
+
+    def invoke_model(self, **kwargs) -> dict:
+        key = self.__cache_key(kwargs['modelId'], kwargs['body'])
+        if key is None:
+            return self.client.invoke_model(**kwargs)
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            data = cached['body'].encode("utf-8")
+            return {
+                'body': _streaming_body(data),
+                'contentType': cached.get('contentType'),
+                'ResponseMetadata': {'HTTPStatusCode': 200, 'HTTPHeaders': cached.get('headers', {})},
+            }
+
+        response = self.client.invoke_model(**kwargs)
+        data = response['body'].read()
+        self.cache.put(key, {
+            'body': data.decode("utf-8"),
+            'contentType': response.get('contentType'),
+            'headers': response.get('ResponseMetadata', {}).get('HTTPHeaders', {}),
+        })
+        response['body'] = _streaming_body(data)
+        return response
+
+    def invoke_model_with_response_stream(self, **kwargs) -> dict:
+        key = self.__cache_key(kwargs['modelId'], kwargs['body'], stream=True)
+        if key is None:
+            return self.client.invoke_model_with_response_stream(**kwargs)
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            return {
+                'body': CachedEventStream({'chunk': {'bytes': chunk.encode("utf-8")}} for chunk in cached['chunks']),
+                'contentType': cached.get('contentType'),
+                'ResponseMetadata': {'HTTPStatusCode': 200, 'HTTPHeaders': {}},
+            }
+
+        response = self.client.invoke_model_with_response_stream(**kwargs)
+        stream = response['body']
+        response['body'] = CachedEventStream(self.__record(key, stream, response.get('contentType')), stream)
+        return response
+
+    def __record(self, key: str, stream, content_type: str):
+        """ストリームをそのまま返しつつチャンクを記録し、最後まで受信できた場合のみ保存する"""
+        chunks = []
+        for event in stream:
+            chunk = event.get('chunk')
+            if chunk:
+                chunks.append(chunk.get('bytes').decode("utf-8"))
+            yield event
+        self.cache.put(key, {'chunks': chunks, 'contentType': content_type})
@@ -0,0 +1,102 @@
+"""
+同一リクエストの同時実行をまとめる (single-flight)
+同じ(model_id, リクエストボディ)のinvoke_modelが実行中の場合、後続の呼び出しは実行中の結果を待って共有する
+温度0以外のリクエストは呼び出しごとに別の結果を期待しているため、まとめずにそのまま実行する
+
+bedrock = SingleFlightClient(session.client('bedrock-runtime'))
+bedrock.invoke_model(modelId=..., body=...)
+bedrock.stats()
+"""
+import io
+import threading
+
+from botocore.response import StreamingBody
+
+from response_cache import is_deterministic_request, make_request_key
+
+
+class _Call:
+    """実行中の呼び出し"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.data = None
+        self.response = None
+        self.error = None
+
+
+class SingleFlightClient:
+    """bedrock-runtimeクライアントの前段で同一リクエストの同時実行をまとめるラッパー
+    完了済みのリクエストは対象外 (結果の再利用はResponseCacheで行う)
+    invoke_model 以外の呼び出しはそのままクライアントへ渡す
+    """
+
+    def __init__(self, client, coalesce_all: bool = False):
+        """
+        Args:
+            client (boto3.client): bedrock-runtimeのクライアント
+            coalesce_all (bool, optional): 温度0以外のリクエストもまとめる. Defaults to False.
+        """
+        self.client = client
+        self.coalesce_all = coalesce_all
+        self.upstream_calls = 0
+        self.coalesced_calls = 0
+
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def invoke_model(self, **kwargs) -> dict:
+        if not self.coalesce_all and not is_deterministic_request(kwargs['modelId'], kwargs['body']):
+            with self._lock:
+                self.upstream_calls += 1
+            return self.client.invoke_model(**kwargs)
+
+        options = {name: value for name, value in kwargs.items() if name not in ('modelId', 'body')}
+        key = make_request_key(kwargs['modelId'], kwargs['body']) + repr(sorted(options.items()))
+
+        with self._lock:
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self._in_flight[key] = _Call()
+                self.upstream_calls += 1
+            else:
+                self.coalesced_calls += 1
+
+        if leader:
+            try:
+                call.response = self.client.invoke_model(**kwargs)
+                call.data = call.response['body'].read()
+            except Exception as error:
+                call.error = error
+            finally:
+                with self._lock:
+                    del self._in_flight[key]
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+
+        # bodyは呼び出し元ごとに読み込めるよう、受信済みのbytesから作り直す
+        response = dict(call.response)
+        response['body'] = StreamingBody(io.BytesIO(call.data), len(call.data))
+        return response
+
+    def stats(self) -> dict:
+        """まとめた呼び出しの集計
+
+        Returns:
+            dict: upstream_calls (実際の呼び出し数), coalesced_calls (削減した呼び出し数), saved_ratio
+        """
+        with self._lock:
+            total = self.upstream_calls + self.coalesced_calls
+            return {
+                "upstream_calls": self.upstream_calls,
+                "coalesced_calls": self.coalesced_calls,
+                "saved_ratio": round(self.coalesced_calls / total, 4) if total else None,
+            }
@@ -0,0 +1,31 @@
+"""
+CLIの起動時間の計測
+--profile-startup 指定時に、各段階までの経過時間を表示する
+"""
+import time
+
+_STARTED_AT = time.perf_counter()
+_marks = []
+
+
+def mark(label: str):
+    """現在時刻を段階名とともに記録する
+
+    Args:
+        label (str): 段階名
+    """
+    _marks.append((label, time.perf_counter()))
+
+
+def report(output=print):
+    """記録した段階ごとの所要時間を表示する
+
+    Args:
+        output (callable, optional): 出力関数. Defaults to print.
+    """
+    previous = _STARTED_AT
+    output("Startup profile")
+    for label, at in _marks:
+        output(f"  {label:<32} {(at - previous) * 1000:9.1f} ms  (total {(at - _STARTED_AT) * 1000:9.1f} ms)")
+        previous = at
+    output("-------------------------")
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+pytest.importorskip("botocore")
+
+from response_cache import CachedClient, ResponseCache
+
+MODEL_ID = "anthropic.claude-v2"
+BODY = json.dumps({"prompt": "\n\nHuman: hi\n\nAssistant:", "temperature": 0})
+
+
+class FakeEventStream:
+    def __init__(self, count):
+        self.count = count
+        self.closed = False
+
+    def __iter__(self):
+        for position in range(self.count):
+            yield {"chunk": {"bytes": json.dumps({"completion": str(position)}).encode("utf-8")}}
+
+    def close(self):
+        self.closed = True
+
+
+class FakeRuntime:
+    def __init__(self):
+        self.streams = []
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        self.streams.append(FakeEventStream(3))
+        return {"body": self.streams[-1], "contentType": "application/json"}
+
+
+def test_closing_recording_stream_closes_upstream_and_skips_cache():
+    runtime = FakeRuntime()
+    client = CachedClient(runtime, ResponseCache())
+
+    body = client.invoke_model_with_response_stream(modelId=MODEL_ID, body=BODY)["body"]
+    next(iter(body))
+    body.close()
+
+    assert runtime.streams[0].closed
+    # 途中で閉じたストリームは保存されず、次の呼び出しも上流へ送られる
+    assert len(list(client.invoke_model_with_response_stream(modelId=MODEL_ID, body=BODY)["body"])) == 3
+    assert len(runtime.streams) == 2
+
+
+def test_replayed_stream_supports_close():
+    runtime = FakeRuntime()
+    client = CachedClient(runtime, ResponseCache())
+    list(client.invoke_model_with_response_stream(modelId=MODEL_ID, body=BODY)["body"])
+
+    body = client.invoke_model_with_response_stream(modelId=MODEL_ID, body=BODY)["body"]
+    next(iter(body))
+    body.close()
+
+    assert len(runtime.streams) == 1
+    assert list(body) == []
@@ -0,0 +1,66 @@
+import io
+import json
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("botocore")
+
+from botocore.response import StreamingBody
+
+from single_flight import SingleFlightClient
+
+MODEL_ID = "anthropic.claude-v2"
+
+
+class FakeRuntime:
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def invoke_model(self, **kwargs):
+        with self._lock:
+            self.calls += 1
+            completion = f"completion {self.calls}"
+        # 後続の呼び出しが実行中に届くよう、応答を遅らせる
+        time.sleep(0.2)
+        data = json.dumps({"completion": completion}).encode("utf-8")
+        return {"body": StreamingBody(io.BytesIO(data), len(data))}
+
+
+def _invoke_concurrently(client, body, count=4):
+    results = [None] * count
+
+    def invoke(position):
+        response = client.invoke_model(modelId=MODEL_ID, body=json.dumps(body))
+        results[position] = json.loads(response["body"].read())["completion"]
+
+    threads = [threading.Thread(target=invoke, args=(position,)) for position in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_coalesces_deterministic_requests():
+    runtime = FakeRuntime()
+    client = SingleFlightClient(runtime)
+
+    results = _invoke_concurrently(client, {"prompt": "\n\nHuman: hi\n\nAssistant:", "temperature": 0})
+
+    assert runtime.calls == 1
+    assert len(set(results)) == 1
+    assert client.stats()["coalesced_calls"] == 3
+
+
+def test_sends_non_deterministic_requests_separately():
+    runtime = FakeRuntime()
+    client = SingleFlightClient(runtime)
+
+    results = _invoke_concurrently(client, {"prompt": "\n\nHuman: hi\n\nAssistant:", "temperature": 0.7})
+
+    assert runtime.calls == 4
+    assert len(set(results)) == 4
+    assert client.stats()["coalesced_calls"] == 0